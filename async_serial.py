@@ -0,0 +1,158 @@
+"""
+serial ports read from one asyncio event loop instead of one blocking pool thread per port
+
+on posix the port's file descriptor is put in non blocking mode and watched with loop.add_reader: a reader wakes up as
+soon as bytes arrive, reads everything that is there into a preallocated buffer and feeds it to its decoder. Handles
+without a file descriptor (pyserial loop:// and the other url handlers, Windows ports) are polled with in_waiting
+instead. Stopping cancels the reader tasks, nothing waits for a read timeout.
+"""
+import asyncio
+import os
+import threading
+import time
+
+import serial
+
+from filters import FilterChain
+from frames import SCHEMAS, FrameSchema
+from utility import BlockQueue, channel_blocks
+
+
+class AsyncSerialReader:
+    """
+    one port on the event loop: bytes -> decoder of the schema -> filters -> SampleBlock in queue, like SerialCapture
+    without recording
+
+    max_read bounds a single read, poll_interval is only used for handles without a file descriptor
+    """
+
+    def __init__(self, handle: serial.Serial, name: str | None = None, sample_rate: float = 48_000,
+                 queue_policy: str = 'drop_oldest', queue_size: int = 64, max_read: int = 1 << 16,
+                 poll_interval: float = 0.001, schema: FrameSchema | None = None, filters: FilterChain | None = None):
+        self.handle = handle
+        if not self.handle.is_open:
+            self.handle.open()
+        self.name = name or getattr(handle, 'port', None) or 'UART'
+        self.sample_rate = sample_rate
+        self.queue = BlockQueue(maxsize=queue_size, policy=queue_policy)
+        self.schema = schema or SCHEMAS['legacy']
+        self.decoder = self.schema.decoder()
+        self.filters = filters or FilterChain([], sample_rate)
+        self.poll_interval = poll_interval
+        self.n_reads = 0
+        self._buffer = bytearray(max_read)
+        self._view = memoryview(self._buffer)
+        self._task = None
+
+    def _fileno(self):
+        try:
+            return self.handle.fileno()
+        except (AttributeError, OSError, NotImplementedError):
+            return None
+
+    def _feed(self, data):
+        """
+        decode one read, the decoder copies what it keeps so the read buffer can be reused right away
+        """
+        read_time = time.monotonic()
+        self.n_reads += 1
+        samples = self.filters.process(self.decoder.feed(data))
+        if len(samples):
+            timestamp = read_time - len(samples) / self.filters.output_rate
+            for block in channel_blocks(self.name, timestamp, samples, self.schema.channels):
+                self.queue.put(block, timeout=0)
+
+    def _read_fd(self, fd: int):
+        # drain the descriptor, a burst larger than the buffer takes several reads
+        while True:
+            try:
+                n_bytes = os.readv(fd, [self._buffer])
+            except BlockingIOError:
+                return
+            if not n_bytes:
+                return
+            self._feed(self._view[:n_bytes])
+            if n_bytes < len(self._buffer):
+                return
+
+    async def _watch_fd(self, fd: int):
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        os.set_blocking(fd, False)
+        loop.add_reader(fd, readable.set)
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+                self._read_fd(fd)
+        finally:
+            loop.remove_reader(fd)
+
+    async def _poll(self):
+        while True:
+            n_bytes = self.handle.in_waiting
+            if n_bytes:
+                self._feed(self.handle.read(min(n_bytes, len(self._buffer))))
+            else:
+                await asyncio.sleep(self.poll_interval)
+
+    async def run(self):
+        fd = self._fileno()
+        try:
+            if fd is None or not hasattr(os, 'readv'):
+                await self._poll()
+            else:
+                await self._watch_fd(fd)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.handle.close()
+            print(f'{self.name} async reader stopped after {self.n_reads} reads, '
+                  f'{self.decoder.stats()}, {self.queue.stats()}')
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._task = loop.create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+class AsyncSerialEngine:
+    """
+    runs an asyncio loop on one background thread and reads any number of ports on it
+
+    add() and stop() may be called from any thread, the readers' queues are drained like the ones of SerialDataFetcher
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.readers = {}
+        self._thread = threading.Thread(target=self._run_loop, name='async serial', daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+        # give the cancelled readers a chance to close their handles
+        pending = asyncio.all_tasks(self.loop)
+        self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        self.loop.close()
+
+    def add(self, handle: serial.Serial, **kwargs) -> AsyncSerialReader:
+        reader = AsyncSerialReader(handle, **kwargs)
+        self.readers[reader.name] = reader
+        self.loop.call_soon_threadsafe(reader.start, self.loop)
+        return reader
+
+    def remove(self, name: str):
+        reader = self.readers.pop(name, None)
+        if reader is not None:
+            self.loop.call_soon_threadsafe(reader.stop)
+
+    def stop(self, timeout: float = 1):
+        for name in list(self.readers):
+            self.remove(name)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
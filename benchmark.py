@@ -0,0 +1,344 @@
+import functools
+import os
+import threading
+import time
+
+import numpy as np
+import serial
+
+from capture import SerialCapture
+from filters import parse_filters
+from frames import FrameSchema, SCHEMAS
+from pipeline import PipelinePort, STAT_SAMPLES
+from publisher import Publisher
+from publisher_client import Subscriber
+from replay import Replayer, encode_frames, open_source, open_target
+from utility import HEADER, SampleBlock, decode_bytes
+
+
+def decode_bytes_reference(byte_packet):
+    """
+    the list based decoder we used before the vectorized one, kept here to compare against (without its print)
+    """
+    packets = byte_packet.split(b'\xff\xff\xff\xff')
+    packets[0] = packets[0][len(packets[0]) % 4:]
+    packets[-1] = packets[-1][:-len(packets[-1]) % 4] if len(packets[-1]) % 4 else packets[-1]
+    packets = [packet[:-len(packet) % 4] if (len(packet) % 4) else packet for packet in packets]
+    packets = [packet for packet in packets if len(packet) > 3]
+    float_packets = [np.frombuffer(packet, dtype=np.float32) for packet in packets]
+    float_packet = [item for sublist in float_packets for item in sublist]
+    return float_packet
+
+
+def make_uart_stream(n_packets: int, packet_len: int = 32, seed: int = 0) -> bytes:
+    """
+    header + float32 packets like the boards send them, values are kept away from 0xFF bytes
+    """
+    rng = np.random.default_rng(seed)
+    samples = rng.uniform(-10, 10, size=(n_packets, packet_len)).astype(np.float32)
+    header = np.frombuffer(HEADER, dtype=np.uint8)
+    frames = np.hstack([np.tile(header, (n_packets, 1)), samples.view(np.uint8)])
+    return frames.tobytes()
+
+
+def time_it(func, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - tic)
+    return best
+
+
+def bench_decoder(chunk: int = 256, total_bytes: int = 4_000_000):
+    stream = make_uart_stream(total_bytes // (4 + 4 * 32))
+    chunks = [stream[i:i + chunk] for i in range(0, len(stream), chunk)]
+    out = np.empty(chunk // 4, dtype=np.float32)
+
+    candidates = {
+        'reference': lambda: [decode_bytes_reference(c) for c in chunks],
+        'reference + asarray': lambda: [np.asarray(decode_bytes_reference(c), dtype=np.float32) for c in chunks],
+        'vectorized': lambda: [decode_bytes(c) for c in chunks],
+        'vectorized (out=)': lambda: [decode_bytes(c, out=out) for c in chunks],
+    }
+
+    print(f'decode_bytes, {len(stream) / 1e6:.1f} MB in {chunk} byte chunks')
+    for name, func in candidates.items():
+        elapsed = time_it(func)
+        print(f'  {name:<20} {len(stream) / elapsed / 1e6:8.2f} MB/s')
+
+
+def bench_filters(block: int = 4096, seconds: float = 10, sample_rate: int = 48_000, channels: int = 1):
+    """
+    samples per second of every filter type, fed block by block like the capture threads do
+    """
+    samples = np.random.default_rng(0).standard_normal((int(seconds * sample_rate), channels)).astype(np.float32)
+    if channels == 1:
+        samples = samples[:, 0]
+    blocks = [samples[i:i + block] for i in range(0, len(samples), block)]
+    specs = ['dc', 'fir_lowpass:5000', 'fir_lowpass:5000:255', 'lowpass:5000', 'lowpass:5000:8', 'notch:50',
+             'decimate:4', 'decimate:16', 'dc, lowpass:5000, decimate:4']
+
+    print(f'filters, {len(samples) / 1e6:.2f} M samples x {channels} channels in {block} sample blocks')
+    for spec in specs:
+        chain = parse_filters(spec, sample_rate)
+        elapsed = time_it(lambda: [chain.process(b) for b in blocks], repeat=3)
+        print(f'  {spec:<30} {len(samples) / elapsed / 1e6:8.2f} MS/s')
+
+
+def make_frame_stream(schema: FrameSchema, n_frames: int, seed: int = 0) -> bytes:
+    """
+    n_frames of a fixed payload schema with random samples, the sequence field and the crc filled in if the schema
+    has them
+    """
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(-1000, 1000, (n_frames * schema.frame_samples, len(schema.channels)))
+    return encode_frames(schema, counts * schema.scale)
+
+
+def bench_frame_decoder(chunk: int = 4096, total_bytes: int = 4_000_000):
+    """
+    FrameDecoder of a 4 channel int16 schema against the legacy StreamDecoder on the same number of bytes
+    """
+    schema = FrameSchema('bench', sync=b'\xa5\x5a', channels=('a', 'b', 'c', 'd'), sample_dtype='i2',
+                         byte_order='>', header=[('counter', 'u2')], frame_samples=16)
+    streams = {
+        'legacy stream': (SCHEMAS['legacy'], make_uart_stream(total_bytes // (4 + 4 * 32))),
+        'fixed 4 x i2': (schema, make_frame_stream(schema, total_bytes // schema.frame_dtype.itemsize)),
+    }
+
+    print(f'frame decoders, {total_bytes / 1e6:.1f} MB in {chunk} byte chunks')
+    for name, (schema, stream) in streams.items():
+        chunks = [stream[i:i + chunk] for i in range(0, len(stream), chunk)]
+        elapsed = time_it(lambda: [decoder.feed(c) for decoder in [schema.decoder()] for c in chunks])
+        print(f'  {name:<20} {len(stream) / elapsed / 1e6:8.2f} MB/s')
+
+
+class MemoryHandle:
+    """
+    serial handle that replays a byte stream in a loop
+
+    without bytes_per_second it is as fast as it is read. With it, it behaves like a UART: bytes arrive at that rate
+    into a port buffer of port_buffer bytes and whatever does not fit when the reader is late is lost (overflow_bytes)
+    """
+
+    def __init__(self, stream: bytes, bytes_per_second: float | None = None, port_buffer: int = 4096,
+                 timeout: float = 0.1):
+        self._stream = stream * 2
+        self._length = len(stream)
+        self._position = 0
+        self.bytes_per_second = bytes_per_second
+        self.port_buffer = port_buffer
+        self.overflow_bytes = 0
+        self._start = time.perf_counter()
+        self._consumed = 0
+        self.port = 'memory'
+        self.timeout = timeout
+        self.is_open = True
+
+    @property
+    def in_waiting(self) -> int:
+        if self.bytes_per_second is None:
+            return 1 << 16
+        arrived = int((time.perf_counter() - self._start) * self.bytes_per_second) - self._consumed
+        if arrived > self.port_buffer:
+            self._skip(arrived - self.port_buffer)
+            self.overflow_bytes += arrived - self.port_buffer
+            arrived = self.port_buffer
+        return arrived
+
+    def _skip(self, size: int):
+        self._position = (self._position + size) % self._length
+        self._consumed += size
+
+    def _take(self, size: int) -> bytes:
+        size = min(size, self._length)
+        data = self._stream[self._position:self._position + size]
+        self._skip(size)
+        return data
+
+    def read(self, size: int) -> bytes:
+        if self.bytes_per_second is None:
+            return self._take(size)
+
+        # like a driver, a blocking read keeps emptying the port buffer until it has size bytes or times out
+        parts = []
+        deadline = time.perf_counter() + self.timeout
+        while size > 0:
+            part = self._take(min(self.in_waiting, size))
+            parts.append(part)
+            size -= len(part)
+            if size > 0:
+                if time.perf_counter() > deadline:
+                    break
+                time.sleep(0.0002)
+        return b''.join(parts)
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+
+def busy(seconds: float):
+    """
+    hold the GIL for a while in pure python, like matplotlib drawing a frame
+    """
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def consume(queue, seconds: float, frame_seconds: float, render_seconds: float) -> int:
+    """
+    the GUI side: drain the queue once per frame and spend render_seconds drawing, returns the samples received
+    """
+    n_samples = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        frame_end = time.perf_counter() + frame_seconds
+        n_samples += sum(len(block.samples) for block in queue.get_all())
+        busy(render_seconds)
+        time.sleep(max(frame_end - time.perf_counter(), 0))
+    return n_samples
+
+
+def bench_publisher(n_subscribers: int = 4, seconds: float = 2, block: int = 256, blocks_per_second: float = 2000,
+                    address: str = 'tcp:55555'):
+    """
+    publish blocks at a fixed rate to n_subscribers local subscribers, one of them reading 10 times slower than the
+    blocks come. The fast ones should get every block, the slow one is skipped and then dropped, and the time
+    publish() takes stays the same
+    """
+    publisher = Publisher(address)
+    received = [0] * n_subscribers
+    subscribers = [Subscriber(address, timeout=seconds + 5) for _ in range(n_subscribers)]
+
+    def consume(index: int, subscriber: Subscriber):
+        delay = 10 / blocks_per_second if index == n_subscribers - 1 else 0
+        try:
+            for _ in subscriber:
+                received[index] += 1
+                time.sleep(delay)
+        except OSError:
+            pass
+
+    threads = [threading.Thread(target=consume, args=(i, s), daemon=True) for i, s in enumerate(subscribers)]
+    for thread in threads:
+        thread.start()
+    while len(publisher.subscribers) < n_subscribers:
+        time.sleep(0.01)
+
+    samples = np.random.default_rng(0).standard_normal(block).astype(np.float32)
+    n_blocks = int(seconds * blocks_per_second)
+    publish_time = 0.0
+    start = time.perf_counter()
+    for i in range(n_blocks):
+        tic = time.perf_counter()
+        publisher.publish(SampleBlock('bench', time.monotonic(), samples))
+        publish_time += time.perf_counter() - tic
+        time.sleep(max(start + (i + 1) / blocks_per_second - time.perf_counter(), 0))
+    time.sleep(0.2)
+    stats = publisher.stats()
+    publisher.close()
+    for thread in threads:
+        thread.join(1)
+
+    print(f'publisher, {n_blocks} blocks of {block} samples at {blocks_per_second:g} blocks/s to {n_subscribers} '
+          f'subscribers: {publish_time / n_blocks * 1e6:.1f} us per publish(), {stats}')
+    for i, (count, subscriber) in enumerate(zip(received, subscribers)):
+        print(f'  subscriber {i}{" (slow)" if i == n_subscribers - 1 else ""}: {count} blocks, '
+              f'missed {subscriber.missed.get("bench", 0)}')
+        subscriber.close()
+
+
+def bench_pipeline(seconds: float = 3, render_seconds: float = 0.02, fps: float = 30,
+                   bytes_per_second: float | None = None, port_buffer: int = 4096):
+    """
+    sustained samples/s reaching the GUI thread, capture thread in the GUI process vs reader and decoder processes.
+    With bytes_per_second the source is paced like a UART and the bytes lost in its port buffer are counted
+    """
+    stream = make_uart_stream(4096)
+    open_handle = functools.partial(MemoryHandle, stream, bytes_per_second, port_buffer)
+    source = 'as fast as it is read' if bytes_per_second is None else \
+        f'{bytes_per_second / 1e6:g} MB/s with a {port_buffer} B port buffer'
+    print(f'capture pipeline, source {source}, {render_seconds * 1e3:g} ms of GUI work per frame at {fps:g} fps')
+
+    handle = open_handle()
+    capture = SerialCapture(handle, 0, verbose=False, queue_size=4096, queue_policy='drop_oldest')
+    thread = threading.Thread(target=capture.run)
+    thread.start()
+    received = consume(capture.queue, seconds, 1 / fps, render_seconds)
+    capture.is_stopped = True
+    thread.join()
+    lost = f', lost in the port buffer: {handle.overflow_bytes} B' if bytes_per_second else ''
+    print(f'  {"single process":<16} {received / seconds / 1e6:8.3f} MS/s to the GUI{lost}')
+
+    port = PipelinePort(open_handle, 'memory', 48_000)
+    # the first port of a run starts the forkserver, measure from the first decoded samples
+    while not port.stats_array[STAT_SAMPLES]:
+        time.sleep(0.01)
+    port.queue.get_all()
+    received = consume(port.queue, seconds, 1 / fps, render_seconds)
+    port.stop()
+    # the overflow counter lives in the reader process, it shows as missing samples here
+    print(f'  {"multiprocess":<16} {received / seconds / 1e6:8.3f} MS/s to the GUI')
+
+
+def bench_replay(seconds: float = 3, speed: float = 8, render_seconds: float = 0.02, fps: float = 30,
+                 sample_rate: float = 48_000, jitter: float = 0.0, burst_every: float = 0.0):
+    """
+    end to end through a pty: replay.py writes a generated signal, SerialCapture reads it with pyserial like a board
+    and the GUI side drains and draws. The latency is from the write of the newest sample of a drained block to the
+    end of the drawing of its frame
+    """
+    source, sample_rate = open_source('sine:1000', SCHEMAS['legacy'], sample_rate)
+    target = open_target('pty')
+    replayer = Replayer(source, target, sample_rate, speed=speed, jitter=jitter, burst_every=burst_every,
+                        burst_hold=0.05)
+    handle = serial.Serial(target.port, timeout=0.1)
+    capture = SerialCapture(handle, 0, verbose=False, queue_size=4096, queue_policy='drop_oldest')
+    thread = threading.Thread(target=capture.run)
+    thread.start()
+    replayer.start()
+
+    n_samples = 0
+    latencies = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        frame_end = time.perf_counter() + 1 / fps
+        n_samples += sum(len(block.samples) for block in capture.queue.get_all())
+        busy(render_seconds)
+        sent = replayer.sent_time(n_samples)
+        if sent is not None:
+            latencies.append(time.monotonic() - sent)
+        time.sleep(max(frame_end - time.perf_counter(), 0))
+
+    replayer.stop()
+    capture.is_stopped = True
+    thread.join()
+    target.close()
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1e3 if latencies else (np.nan, np.nan)
+    pace = f'{speed:g} x {sample_rate / 1e3:g} kHz' if speed else 'full speed'
+    print(f'replay through a pty at {pace}, {render_seconds * 1e3:g} ms of GUI work per frame at {fps:g} fps: '
+          f'{n_samples / seconds / 1e3:.1f} kS/s to the GUI, latency p50 {p50:.1f} ms, p99 {p99:.1f} ms')
+    print(f'  replay: {replayer.stats()}, capture: {capture.decoder.stats()}')
+
+
+if __name__ == '__main__':
+    for chunk_size in (256, 1024, 4096, 65536):
+        bench_decoder(chunk_size)
+    for chunk_size in (1024, 65536):
+        bench_frame_decoder(chunk_size)
+    for block_size in (256, 4096):
+        bench_filters(block_size)
+    bench_filters(4096, channels=4)
+    bench_publisher()
+    if os.name == 'posix':
+        bench_replay()
+        bench_replay(speed=0)
+        bench_replay(speed=1, jitter=0.002, burst_every=0.5)
+    bench_pipeline()
+    # 12 Mbaud, the GUI holds the GIL for most of every frame
+    bench_pipeline(render_seconds=0.03, bytes_per_second=1.2e6)
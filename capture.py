@@ -0,0 +1,323 @@
+import platform
+import time
+
+import serial
+from serial import PortNotOpenError
+
+from filters import FilterChain
+from frames import SCHEMAS, FrameSchema
+from recording import RecordWriter, CaptureWriter, CAPTURE_EXTENSION
+from utility import BlockQueue, RingBuffer, SampleBlock, channel_blocks
+
+
+class MicCapture:
+    """
+    35 works for voiceaudio (out_device)
+
+    the audio callback only copies each block into a preallocated ring buffer and counts xruns, it allocates no arrays
+    and never starts or stops the stream. run() polls the ring every poll_interval seconds, forwards the new samples
+    to the queue and starts/stops the stream according to is_stopped.
+
+    plain python, the GUI runs it as MicRecorder on its thread pool and headless.py on a normal thread.
+    Blocks are queued as SampleBlock tagged with name, after the filters if there are any (on the polling thread, not
+    in the audio callback)
+    """
+
+    def __init__(self, in_device: str | int, out_device: str | int, samplerate: int, channels: int,
+                 latency: str = 'high', blocksize: int = 0, queue_policy: str = 'drop_oldest',
+                 poll_interval: float = 0.01, queue_size: int = 64, name: str = 'USB',
+                 filters: FilterChain | None = None):
+        super().__init__()
+        # imported here so UART only captures do not need PortAudio
+        import sounddevice as sd
+
+        if in_device == -1:
+            if platform.system() == 'Windows':
+                # MME is needed since there are more than one MicNode device APIs (at least in Windows)
+                self.in_device = ' Microphone (MicNode), Windows WDM-KS'
+            elif platform.system() == 'Darwin':
+                self.in_device = 'MicNode'
+            else:
+                self.in_device = 'default'
+        else:
+            self.in_device = in_device
+
+        self.out_device = out_device
+        self.samplerate = samplerate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.dtype = 'int16'
+        self.latency = latency
+        self.poll_interval = poll_interval
+        self.name = name
+        self.queue = BlockQueue(maxsize=queue_size, policy=queue_policy)
+        self.filters = filters or FilterChain([], samplerate)
+        self.callback_status = sd.CallbackFlags()
+        self.is_stopped = False
+        self.is_closed = False
+        self.enable = False
+
+        # one second of audio gives the polling thread plenty of slack
+        self.ring = RingBuffer(max(self.samplerate, 8 * self.blocksize))
+        self._read_position = 0
+        self.input_overflows = 0
+        self.input_underflows = 0
+        self.output_overflows = 0
+        self.output_underflows = 0
+        self.stream = sd.Stream(device=(self.in_device, self.out_device),
+                                samplerate=self.samplerate, blocksize=self.blocksize,
+                                dtype=self.dtype, latency=self.latency,
+                                channels=self.channels, callback=self.callback)
+
+    def callback(self, indata, outdata, frames, time, status):
+        if status:
+            self.callback_status |= status
+            self.input_overflows += status.input_overflow
+            self.input_underflows += status.input_underflow
+            self.output_overflows += status.output_overflow
+            self.output_underflows += status.output_underflow
+
+        outdata[:] = indata
+        # indata is reused by PortAudio for the next block, copy (and convert) it into the ring right away
+        self.ring.write(indata[:, 0])
+
+    @property
+    def xruns(self) -> int:
+        return self.input_overflows + self.input_underflows + self.output_overflows + self.output_underflows
+
+    def stream_status_check(self):
+        if self.is_stopped:
+            if self.stream.active:
+                self.stream.stop()
+        elif not self.stream.active:
+            self.stream.start()
+
+    def forward_samples(self):
+        """
+        move everything the callback wrote since the last call into the queue
+        """
+        samples, self._read_position = self.ring.read_since(self._read_position)
+        samples = self.filters.process(samples)
+        if len(samples):
+            # the newest sample left the sound card about now
+            timestamp = time.monotonic() - len(samples) / self.filters.output_rate
+            self.queue.put(SampleBlock(self.name, timestamp, samples), timeout=self.poll_interval)
+
+    def run(self) -> None:
+        with self.stream:
+            while not self.is_closed:
+                self.stream_status_check()
+                time.sleep(self.poll_interval)
+                self.forward_samples()
+
+        print(f'mic recorder closed, xruns: {self.xruns}')
+
+
+class AdaptiveReadSizer:
+    """
+    size of the next serial read from the bytes already waiting, the measured byte rate and a latency target
+
+    a read of rate * target_latency bytes returns about every target_latency seconds: as large as the latency allows,
+    to keep the per call overhead down at high baud rates, and small enough not to wait long at low ones. Whatever
+    is already waiting is taken in one read (up to max_size), so a backlog is cleared instead of growing.
+    rate (bytes/s) and latency (time between two reads returning, i.e. how old the oldest delivered byte can be) are
+    exponential moving averages
+    """
+
+    def __init__(self, target_latency: float = 0.01, min_size: int = 64, max_size: int = 1 << 16, alpha: float = 0.2):
+        self.target_latency = target_latency
+        self.min_size = min_size
+        self.max_size = max_size
+        self.alpha = alpha
+        self.size = min_size
+        self.rate = 0.0
+        self.latency = 0.0
+        self.n_reads = 0
+        self._last_read = None
+
+    def next_size(self, in_waiting: int) -> int:
+        size = max(in_waiting, int(self.rate * self.target_latency))
+        self.size = min(max(size, self.min_size), self.max_size)
+        return self.size
+
+    def update(self, n_bytes: int):
+        """
+        call after every read with the number of bytes it returned
+        """
+        now = time.perf_counter()
+        if self._last_read is not None and now > self._last_read:
+            interval = now - self._last_read
+            if self.n_reads == 1:
+                self.rate, self.latency = n_bytes / interval, interval
+            else:
+                self.rate += self.alpha * (n_bytes / interval - self.rate)
+                self.latency += self.alpha * (interval - self.latency)
+        self._last_read = now
+        self.n_reads += 1
+
+    def stats(self) -> str:
+        return (f'read size: {self.size} B, rate: {self.rate / 1e3:.1f} kB/s, '
+                f'latency: {self.latency * 1e3:.1f} ms (target {self.target_latency * 1e3:g} ms)')
+
+
+class SerialCapture:
+    """
+    data fetcher of UART protocol. It should only be used for serial communication with specific behaviour we described
+    behavior: float packages of variable length with defined header structure: we use |0xff 0xff 0xff 0xff| for header
+    and data is float (MSB) but packaged of 4 x 8 bits, because uart only support for 8-bit per element for sending
+    and transmitting.
+
+    recording: when record_file is given the capture is streamed to that file while the decoded samples still go to
+    the live view. A '.scap' file gets the decoded samples in the indexed capture format (sample_rate is stored in it),
+    any other name the raw bytes. It runs until is_stopped is set or until record_n_sample decoded samples /
+    record_seconds have been captured (0 = no limit).
+
+    plain python, the GUI runs it as SerialDataFetcher on its thread pool and headless.py on a normal thread.
+    finished() is called once when run() ends, the GUI turns it into a signal. Blocks are queued as SampleBlock tagged
+    with name, the port name by default. Every capture has its own handle, decoder and queue, so several of them run
+    side by side without sharing a lock
+
+    chunk is the size of every read, 0 lets an AdaptiveReadSizer choose it for target_latency seconds per read
+
+    schema is the FrameSchema of the board (the legacy float32 protocol by default), every channel of a multi channel
+    schema is queued as its own stream 'name/channel' and a '.scap' recording gets one column per channel
+
+    todo: add parameter and variable descriptions
+    """
+
+    def __init__(self, handle: serial.Serial, chunk: int, record_n_sample: int = 0, queue_policy: str = 'drop_oldest',
+                 record_file: str | None = None, record_seconds: float = 0, sample_rate: float = 48_000,
+                 verbose: bool = True, queue_size: int = 64, name: str | None = None, target_latency: float = 0.01,
+                 schema: FrameSchema | None = None, filters: FilterChain | None = None):
+        super().__init__()
+        self.handle: serial.Serial = handle
+        if not self.handle.is_open:
+            self.handle.open()
+
+        self.chunk = chunk
+        self.sizer = AdaptiveReadSizer(target_latency) if chunk <= 0 else None
+        self.name = name or getattr(handle, 'port', None) or 'UART'
+        self.queue = BlockQueue(maxsize=queue_size, policy=queue_policy)
+        self.schema = schema or SCHEMAS['legacy']
+        self.decoder = self.schema.decoder()
+        self.record_n_sample: int = record_n_sample
+        self.record_file = record_file
+        self.record_seconds = record_seconds
+        self.sample_rate = sample_rate
+        # for the queued blocks only, recordings keep the samples as they came
+        self.filters = filters or FilterChain([], sample_rate)
+        self.verbose = verbose
+        self.writer = None
+        self.is_stopped = False
+        self.bytes_read = 0
+        self._first_read = None
+
+    def finished(self):
+        pass
+
+    def read(self) -> bytes:
+        if self._first_read is None:
+            self._first_read = time.perf_counter()
+        if self.sizer is None:
+            byte_packet = self.handle.read(self.chunk)
+        else:
+            byte_packet = self.handle.read(self.sizer.next_size(self.handle.in_waiting))
+            self.sizer.update(len(byte_packet))
+        self.bytes_read += len(byte_packet)
+        return byte_packet
+
+    def read_stats(self) -> str:
+        if self.sizer is not None:
+            return self.sizer.stats()
+        elapsed_time = time.perf_counter() - self._first_read if self._first_read is not None else 0
+        line_rate = self.bytes_read * 10 / elapsed_time if elapsed_time > 0 else 0  # 8N1, 10 bits a byte
+        return f'read size: {self.chunk} B, line rate: {line_rate:.0f} bps'
+
+    def record(self) -> None:
+        print("recording started!")
+        # a stop request is noticed after the running read returns, do not let it hang for the whole port timeout
+        self.handle.timeout = min(self.handle.timeout or 1, 1)
+        is_capture = self.record_file.endswith(CAPTURE_EXTENSION)
+        if is_capture:
+            self.writer = writer = CaptureWriter(self.record_file, self.sample_rate, source='UART',
+                                                 channels=len(self.schema.channels))
+        else:
+            self.writer = writer = RecordWriter(self.record_file)
+
+        tic = last_report = time.perf_counter()
+        try:
+            while not self.is_stopped:
+                byte_packet = self.read()
+                read_time, read_monotonic = time.time(), time.monotonic()
+
+                float_packet = self.decoder.feed(byte_packet)
+                duration = len(float_packet) / self.sample_rate
+                if is_capture:
+                    writer.write(float_packet, timestamp=read_time - duration)
+                else:
+                    writer.write(byte_packet)
+
+                filtered = self.filters.process(float_packet)
+                if len(filtered):
+                    for block in channel_blocks(self.name, read_monotonic - len(filtered) / self.filters.output_rate,
+                                                filtered, self.schema.channels):
+                        self.queue.put(block, timeout=0)
+
+                now = time.perf_counter()
+                if 0 < self.record_n_sample <= self.decoder.n_samples:
+                    break
+                if 0 < self.record_seconds <= now - tic:
+                    break
+                if self.verbose and now - last_report > 1:
+                    print(f'recording: {self.decoder.stats()}, {self.read_stats()}, {writer.stats()}')
+                    last_report = now
+
+        except PortNotOpenError:
+            print("Connect to the port before recording!")
+        finally:
+            writer.close()
+
+        print(f"recording finished after {time.perf_counter() - tic:.2f} seconds: {self.decoder.n_samples} samples, "
+              f"{self.decoder.stats()}, {writer.stats()}")
+
+    def run(self) -> None:
+        if self.record_file:
+            try:
+                self.record()
+            except Exception as e:
+                print(f"An exception occured while recording: {e}")
+
+            self.handle.close()
+            self.finished()
+        else:
+            last_report = time.perf_counter()
+            while not self.is_stopped:
+                try:
+                    byte_packet = self.read()
+                    read_monotonic = time.monotonic()
+
+                    # partial floats and headers at the end of the chunk are kept for the next read
+                    float_packet = self.filters.process(self.decoder.feed(byte_packet))
+                    if len(float_packet):
+                        timestamp = read_monotonic - len(float_packet) / self.filters.output_rate
+                        for block in channel_blocks(self.name, timestamp, float_packet, self.schema.channels):
+                            self.queue.put(block, timeout=1)
+
+                    # print(float_packet)
+                    # once a second, a print per read costs more than the read itself at high rates
+                    now = time.perf_counter()
+                    if self.verbose and now - last_report > 1:
+                        print(f'{self.name}: {self.decoder.stats()}, {self.read_stats()}, {self.queue.stats()}')
+                        last_report = now
+
+                except KeyboardInterrupt:
+                    print('Com interrupted!')
+                    break
+
+                except Exception as e:
+                    print(f"An exception occured: {e}")
+                    break
+
+            print('thread initiated stopping sequence')
+            self.handle.close()
+            self.finished()
@@ -0,0 +1,318 @@
+from functools import lru_cache
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+
+from utility import RingBuffer
+
+
+AVERAGING_MODES = ('none', 'welch', 'exp')
+DECIMATION_MODES = ('minmax', 'lttb', 'none')
+
+
+@lru_cache(maxsize=16)
+def spectrum_plan(n_fft: int, sample_rate: int):
+    """
+    window and frequency vector for one (fft size, sample rate) pair, computed once and shared by every engine
+
+    the window is scaled so that a full scale sine of amplitude A shows up as a peak of height A in the magnitude
+    """
+    window = np.hanning(n_fft).astype(np.float32)
+    window *= 2 / window.sum()
+    window.flags.writeable = False
+    freqs = np.fft.rfftfreq(n_fft, 1 / sample_rate)
+    freqs.flags.writeable = False
+    return window, freqs
+
+
+class SpectralEngine:
+    """
+    magnitude spectrum of the newest n_fft samples of a real signal (rfft, Hann window)
+
+    averaging across frames:
+    none: every frame stands on its own
+    welch: mean power of the last n_average frames
+    exp: exponential moving average of the power, alpha is the weight of the newest frame
+    """
+
+    def __init__(self, n_fft: int, sample_rate: int, averaging: str = 'none', n_average: int = 8,
+                 alpha: float = 0.25):
+        if averaging not in AVERAGING_MODES:
+            raise ValueError(f"unknown averaging '{averaging}', use one of {AVERAGING_MODES}")
+
+        self.n_fft = n_fft
+        self.sample_rate = sample_rate
+        self.averaging = averaging
+        self.alpha = alpha
+        self.window, self.freqs = spectrum_plan(n_fft, sample_rate)
+
+        n_bins = len(self.freqs)
+        self._frame = np.zeros(n_fft, dtype=np.float32)
+        self._power = np.zeros(n_bins)
+        self._history = np.zeros((n_average if averaging == 'welch' else 1, n_bins))
+        self._n_frames = 0
+
+    def reset(self):
+        self._power[:] = 0
+        self._history[:] = 0
+        self._n_frames = 0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        spectrum of the newest n_fft samples (zero padded at the front if fewer are given), returns the magnitude
+        """
+        n_samples = min(len(samples), self.n_fft)
+        self._frame[:self.n_fft - n_samples] = 0
+        self._frame[self.n_fft - n_samples:] = samples[len(samples) - n_samples:]
+        self._frame *= self.window
+        power = np.abs(np.fft.rfft(self._frame)) ** 2
+
+        if self.averaging == 'welch':
+            self._history[self._n_frames % len(self._history)] = power
+            self._history.sum(axis=0, out=self._power)
+            self._power /= min(self._n_frames + 1, len(self._history))
+        elif self.averaging == 'exp' and self._n_frames:
+            self._power += self.alpha * (power - self._power)
+        else:
+            self._power[:] = power
+
+        self._n_frames += 1
+        return np.sqrt(self._power)
+
+
+class IncrementalSTFT:
+    """
+    short time Fourier transform of a stream for a spectrogram, feed() only computes the frames the new samples
+    complete, so the cost follows the sample rate and not the history shown
+
+    frames of n_fft samples every hop samples (Hann window like SpectralEngine), magnitude in dB clipped at floor_db.
+    The newest n_frames frames are kept in a RingBuffer of spectra, image() is one contiguous (n_frames, n_bins) view
+    with the oldest frame first
+    """
+
+    def __init__(self, n_fft: int, hop: int, sample_rate: int, n_frames: int, floor_db: float = -120):
+        self.n_fft = n_fft
+        self.hop = hop
+        self.floor_db = floor_db
+        self.window, self.freqs = spectrum_plan(n_fft, sample_rate)
+        self.frames = RingBuffer(n_frames, item_shape=(len(self.freqs),), fill_value=floor_db)
+        self._tail = np.zeros(0, dtype=np.float32)
+
+    def reset(self):
+        self.frames.view()[:] = self.floor_db
+        self._tail = np.zeros(0, dtype=np.float32)
+
+    def feed(self, samples: np.ndarray) -> int:
+        """
+        add samples, returns the number of new frames
+        """
+        buffer = np.concatenate((self._tail, samples)) if len(self._tail) else np.asarray(samples, dtype=np.float32)
+        n_new = (len(buffer) - self.n_fft) // self.hop + 1 if len(buffer) >= self.n_fft else 0
+        # frames that would scroll out right away are not computed
+        n_skip = max(n_new - self.frames.capacity, 0)
+
+        if n_new > n_skip:
+            frames = sliding_window_view(buffer, self.n_fft)[n_skip * self.hop:n_new * self.hop:self.hop]
+            magnitude = np.abs(np.fft.rfft(frames * self.window, axis=1))
+            np.maximum(magnitude, 10 ** (self.floor_db / 20), out=magnitude)
+            self.frames.write(20 * np.log10(magnitude))
+
+        self._tail = buffer[n_new * self.hop:].copy()
+        return n_new
+
+    def image(self) -> np.ndarray:
+        return self.frames.view()
+
+
+class StreamResampler:
+    """
+    sample rate conversion of a stream block by block: linear interpolation, the position of the next output sample
+    is carried over to the next block so the blocks join without clicks. When the rate goes down the input is low
+    passed first (FIR, its state kept between blocks) so nothing above the new Nyquist frequency folds back
+    """
+
+    def __init__(self, in_rate: float, out_rate: float, n_taps: int = 63):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        # input samples per output sample
+        self.step = in_rate / out_rate
+        self._taps = signal.firwin(n_taps, 0.9 / self.step) if self.step > 1 else None
+        self.reset()
+
+    def reset(self):
+        self._position = 0.0  # of the next output sample, relative to the last sample of the previous block
+        self._last = None
+        self._zi = None if self._taps is None else np.zeros(len(self._taps) - 1)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        samples = np.asarray(samples, dtype=np.float32)
+        if self.step == 1:
+            return samples
+        if self._taps is not None:
+            samples, self._zi = signal.lfilter(self._taps, 1.0, samples, zi=self._zi)
+
+        buffer = samples if self._last is None else np.concatenate(([self._last], samples))
+        if len(buffer) - 1 < self._position:
+            self._position -= len(buffer) - 1
+            self._last = buffer[-1] if len(buffer) else self._last
+            return np.zeros(0, dtype=np.float32)
+
+        n_out = int((len(buffer) - 1 - self._position) // self.step) + 1
+        positions = self._position + np.arange(n_out) * self.step
+        out = np.interp(positions, np.arange(len(buffer)), buffer).astype(np.float32)
+        self._position += n_out * self.step - (len(buffer) - 1)
+        self._last = buffer[-1]
+        return out
+
+
+def decimate(samples: np.ndarray, n_points: int, mode: str = 'minmax') -> tuple[np.ndarray, np.ndarray]:
+    """
+    reduce samples to about n_points for plotting, returns (positions, values), positions index into samples
+    """
+    if mode == 'minmax':
+        return minmax_decimate(samples, max(n_points // 2, 1))
+    if mode == 'lttb':
+        return lttb(samples, n_points)
+    if mode == 'none':
+        return np.arange(len(samples)), samples
+    raise ValueError(f"unknown decimation '{mode}', use one of {DECIMATION_MODES}")
+
+
+def minmax_decimate(samples: np.ndarray, n_bins: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    reduce samples to at most 2 * n_bins points without losing a peak: the min and the max of every bin, in the order
+    they occur. Returns (positions, values), positions index into samples
+    """
+    n_samples = len(samples)
+    if n_samples <= 2 * n_bins:
+        return np.arange(n_samples), samples
+
+    bin_size = -(-n_samples // n_bins)
+    n_full = n_samples // bin_size
+    body = samples[:n_full * bin_size].reshape(n_full, bin_size)
+    lows = body.argmin(axis=1)
+    highs = body.argmax(axis=1)
+
+    positions = np.empty(2 * n_full + 2 * (n_full * bin_size < n_samples), dtype=np.intp)
+    offsets = np.arange(n_full) * bin_size
+    positions[0:2 * n_full:2] = offsets + np.minimum(lows, highs)
+    positions[1:2 * n_full:2] = offsets + np.maximum(lows, highs)
+    if n_full * bin_size < n_samples:
+        tail_start = n_full * bin_size
+        tail = samples[tail_start:]
+        positions[-2:] = np.sort([tail_start + tail.argmin(), tail_start + tail.argmax()])
+    return positions, samples[positions]
+
+
+def lttb(samples: np.ndarray, n_out: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Largest-Triangle-Three-Buckets downsampling to n_out points, looks closer to the original line than min/max but
+    may skip single sample spikes. Returns (positions, values) like minmax_decimate
+    """
+    n_samples = len(samples)
+    if n_samples <= n_out or n_out < 3:
+        return np.arange(n_samples), samples
+
+    # n_out - 2 buckets between the fixed first and last sample
+    edges = np.linspace(1, n_samples - 1, n_out - 1).astype(np.intp)
+    bucket_means = np.add.reduceat(samples[1:n_samples - 1], edges[:-1] - 1) / np.diff(edges)
+    bucket_centres = (edges[:-1] + edges[1:] - 1) / 2
+
+    positions = np.empty(n_out, dtype=np.intp)
+    positions[0] = 0
+    positions[-1] = n_samples - 1
+    a = 0
+    for i in range(n_out - 2):
+        low, high = edges[i], edges[i + 1]
+        if i + 1 < n_out - 2:
+            next_x, next_y = bucket_centres[i + 1], bucket_means[i + 1]
+        else:
+            next_x, next_y = n_samples - 1, samples[-1]
+        # twice the area of the triangle (a, candidate, next bucket mean), for every candidate in the bucket
+        area = np.abs((a - next_x) * (samples[low:high] - samples[a])
+                      - (a - np.arange(low, high)) * (next_y - samples[a]))
+        a = low + int(area.argmax())
+        positions[i + 1] = a
+    return positions, samples[positions]
+
+
+class MinMaxPyramid:
+    """
+    min/max envelope of a long recording at several resolutions, level k has one (min, max) pair per
+    base * factor ** k samples. A zoomed out view is answered from the pyramid instead of reading the samples.
+    """
+
+    def __init__(self, n_samples: int, base: int = 256, factor: int = 4):
+        self.n_samples = n_samples
+        self.base = base
+        self.factor = factor
+        self.levels = []  # (bin size, mins, maxs), finest first
+
+    @classmethod
+    def build(cls, read, n_samples: int, base: int = 256, factor: int = 4, chunk_bins: int = 4096):
+        """
+        build from read(start, n) -> 1-d samples, the samples are visited once in chunks of chunk_bins * base
+        """
+        pyramid = cls(n_samples, base, factor)
+        n_bins = -(-n_samples // base)
+        mins = np.empty(n_bins, dtype=np.float32)
+        maxs = np.empty(n_bins, dtype=np.float32)
+        chunk = chunk_bins * base
+        for start in range(0, n_samples, chunk):
+            samples = read(start, chunk)
+            first_bin = start // base
+            _reduce_bins(samples, base, mins[first_bin:], maxs[first_bin:])
+
+        bin_size = base
+        pyramid.levels.append((bin_size, mins, maxs))
+        while len(mins) > factor:
+            bin_size *= factor
+            n_coarse = -(-len(mins) // factor)
+            coarse_mins = np.empty(n_coarse, dtype=np.float32)
+            coarse_maxs = np.empty(n_coarse, dtype=np.float32)
+            _reduce_bins(mins, factor, coarse_mins, np.empty_like(coarse_maxs))
+            _reduce_bins(maxs, factor, np.empty_like(coarse_mins), coarse_maxs)
+            mins, maxs = coarse_mins, coarse_maxs
+            pyramid.levels.append((bin_size, mins, maxs))
+        return pyramid
+
+    def query(self, start: int, stop: int, n_bins: int):
+        """
+        envelope of [start, stop) in about n_bins (min, max) pairs as (positions, values), positions in samples.
+        None if the range is so short that even the finest level is too coarse, read the samples then
+        """
+        target = (stop - start) / max(n_bins, 1)
+        usable = [level for level in self.levels if level[0] <= target]
+        if not usable:
+            return None
+
+        bin_size, mins, maxs = usable[-1]
+        first, last = start // bin_size, -(-stop // bin_size)
+        group = max((last - first) // n_bins, 1)
+        n_out = -(-(last - first) // group)
+        out_mins = np.empty(n_out, dtype=np.float32)
+        out_maxs = np.empty(n_out, dtype=np.float32)
+        _reduce_bins(mins[first:last], group, out_mins, np.empty_like(out_maxs))
+        _reduce_bins(maxs[first:last], group, np.empty_like(out_mins), out_maxs)
+
+        centres = (first + (np.arange(n_out) + 0.5) * group) * bin_size
+        positions = np.minimum(np.repeat(centres, 2), self.n_samples - 1)
+        values = np.empty(2 * n_out, dtype=np.float32)
+        values[0::2] = out_mins
+        values[1::2] = out_maxs
+        return positions, values
+
+
+def _reduce_bins(samples: np.ndarray, bin_size: int, mins: np.ndarray, maxs: np.ndarray):
+    """
+    min and max of every bin_size samples (the last bin may be shorter) into the beginning of mins and maxs
+    """
+    n_full = len(samples) // bin_size
+    body = samples[:n_full * bin_size].reshape(n_full, bin_size)
+    body.min(axis=1, out=mins[:n_full])
+    body.max(axis=1, out=maxs[:n_full])
+    if n_full * bin_size < len(samples):
+        tail = samples[n_full * bin_size:]
+        mins[n_full] = tail.min()
+        maxs[n_full] = tail.max()
@@ -0,0 +1,201 @@
+"""
+streaming filters for the live streams: FIR, SOS (biquad) IIR, a DC blocker and a polyphase decimator
+
+every filter keeps its state between blocks (the zi of lfilter / sosfilt, the history of the decimator), so a stream
+filtered block by block is the same as filtered in one piece, without a transient at every block edge. Blocks are
+(samples,) or (samples, channels), every channel has its own state. The filters run where the blocks are made, in the
+capture threads and the pipeline's decoder process, never on the GUI thread
+
+the filter setting is a comma separated chain, frequencies in Hz at the rate where the filter sits in the chain:
+
+    dc, lowpass:5000, decimate:4
+
+dc[:pole]                                   DC blocker, pole 0.995 by default
+fir_lowpass:f[:taps], fir_highpass:f[:taps] windowed FIR, 101 taps by default
+fir_bandpass:f1:f2[:taps]
+lowpass:f[:order], highpass:f[:order]       Butterworth as second order sections, order 4 by default
+bandpass:f1:f2[:order]
+notch:f[:q]                                 IIR notch, q 30 by default
+decimate:m[:taps]                           anti-alias FIR and every m-th sample, only those outputs are computed
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+
+
+FILTER_TYPES = ('dc', 'fir_lowpass', 'fir_highpass', 'fir_bandpass', 'lowpass', 'highpass', 'bandpass', 'notch',
+                'decimate')
+
+
+def _steady_state(zi: np.ndarray, first: np.ndarray) -> np.ndarray:
+    """
+    the per unit step state zi scaled to the first sample of every channel, as if the stream had been at that value
+    forever. zi has the state axis last but one like sosfilt wants it, or last for lfilter
+    """
+    return zi[..., None] * first if first.ndim else zi * first
+
+
+class LinearFilter:
+    """
+    b / a filter through lfilter, FIR if a is 1
+    """
+    decimation = 1
+
+    def __init__(self, b, a=1.0):
+        self.b = np.atleast_1d(np.asarray(b, dtype=np.float64))
+        self.a = np.atleast_1d(np.asarray(a, dtype=np.float64))
+        self._zi = None
+
+    def reset(self):
+        self._zi = None
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        if not len(samples):
+            return samples
+        if self._zi is None:
+            self._zi = _steady_state(signal.lfilter_zi(self.b, self.a), samples[0])
+        filtered, self._zi = signal.lfilter(self.b, self.a, samples, axis=0, zi=self._zi)
+        return filtered.astype(np.float32, copy=False)
+
+
+class DCBlocker(LinearFilter):
+    """
+    y[n] = x[n] - x[n - 1] + pole * y[n - 1], a zero at DC and a pole just inside it. The cutoff is about
+    (1 - pole) * sample_rate / (2 pi), 38 Hz at 48 kHz for the default pole
+    """
+
+    def __init__(self, pole: float = 0.995):
+        super().__init__([1.0, -1.0], [1.0, -pole])
+
+
+class SOSFilter:
+    """
+    IIR filter as a cascade of second order sections through sosfilt, stable at high orders where b / a is not
+    """
+    decimation = 1
+
+    def __init__(self, sos):
+        self.sos = np.asarray(sos, dtype=np.float64)
+        self._zi = None
+
+    def reset(self):
+        self._zi = None
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        if not len(samples):
+            return samples
+        if self._zi is None:
+            self._zi = _steady_state(signal.sosfilt_zi(self.sos), samples[0])
+        filtered, self._zi = signal.sosfilt(self.sos, samples, axis=0, zi=self._zi)
+        return filtered.astype(np.float32, copy=False)
+
+
+class PolyphaseDecimator:
+    """
+    low-pass FIR and every factor-th sample. Only the kept outputs are computed, each one as a dot product of the taps
+    with a window of the input: the work of a polyphase decimator, factor times less than filtering and dropping
+    samples. The last n_taps - 1 inputs and the offset of the next output are carried to the next block
+    """
+
+    def __init__(self, factor: int, n_taps: int | None = None):
+        if factor < 1:
+            raise ValueError('the decimation factor must be at least 1')
+        self.decimation = int(factor)
+        n_taps = n_taps or 8 * self.decimation + 1
+        self.taps = signal.firwin(n_taps, 0.8 / self.decimation) if self.decimation > 1 else np.ones(1)
+        # reversed, so a window of the input times the taps is the convolution
+        self._kernel = self.taps[::-1].astype(np.float32)
+        self._history = None
+        self._skip = 0
+
+    def reset(self):
+        self._history = None
+        self._skip = 0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        if not len(samples):
+            return samples
+        n_taps = len(self._kernel)
+        if self._history is None:
+            self._history = np.repeat(samples[:1], n_taps - 1, axis=0).astype(np.float32)
+        buffer = np.concatenate((self._history, samples.astype(np.float32, copy=False)))
+
+        # window i covers buffer[i:i + n_taps] and gives the output at input i + n_taps - 1
+        windows = sliding_window_view(buffer, n_taps, axis=0)[self._skip::self.decimation]
+        decimated = windows @ self._kernel
+        self._skip += len(windows) * self.decimation - len(samples)
+        self._history = buffer[len(buffer) - (n_taps - 1):].copy()
+        return decimated
+
+
+class FilterChain:
+    """
+    filters applied one after the other, output_rate is the sample rate after the decimators
+    """
+
+    def __init__(self, filters: list, sample_rate: float, spec: str = ''):
+        self.filters = filters
+        self.sample_rate = sample_rate
+        self.spec = spec
+        self.decimation = int(np.prod([stage.decimation for stage in filters]))
+        self.output_rate = sample_rate / self.decimation
+
+    def __bool__(self):
+        return bool(self.filters)
+
+    def __repr__(self):
+        return f'FilterChain({self.spec or "none"}, {self.sample_rate:g} -> {self.output_rate:g} Hz)'
+
+    def reset(self):
+        for stage in self.filters:
+            stage.reset()
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        for stage in self.filters:
+            samples = stage.process(samples)
+        return samples
+
+
+def _make_filter(name: str, args: list, sample_rate: float):
+    nyquist = sample_rate / 2
+    if name == 'dc':
+        return DCBlocker(*args)
+    if name in ('fir_lowpass', 'fir_highpass'):
+        cutoff, n_taps = args[0], int(args[1]) if len(args) > 1 else 101
+        # a high-pass needs an odd number of taps
+        n_taps |= name == 'fir_highpass'
+        return LinearFilter(signal.firwin(n_taps, cutoff / nyquist, pass_zero=name == 'fir_lowpass'))
+    if name == 'fir_bandpass':
+        low, high, n_taps = args[0], args[1], int(args[2]) if len(args) > 2 else 101
+        return LinearFilter(signal.firwin(n_taps, [low / nyquist, high / nyquist], pass_zero=False))
+    if name in ('lowpass', 'highpass'):
+        order = int(args[1]) if len(args) > 1 else 4
+        return SOSFilter(signal.butter(order, args[0], btype=name, output='sos', fs=sample_rate))
+    if name == 'bandpass':
+        order = int(args[2]) if len(args) > 2 else 4
+        return SOSFilter(signal.butter(order, args[:2], btype='bandpass', output='sos', fs=sample_rate))
+    if name == 'notch':
+        b, a = signal.iirnotch(args[0], args[1] if len(args) > 1 else 30, fs=sample_rate)
+        return SOSFilter(signal.tf2sos(b, a))
+    if name == 'decimate':
+        return PolyphaseDecimator(int(args[0]), int(args[1]) if len(args) > 1 else None)
+    raise ValueError(f"unknown filter '{name}', use one of {FILTER_TYPES}")
+
+
+def parse_filters(spec: str, sample_rate: float) -> FilterChain:
+    """
+    FilterChain of a filter setting like 'dc, lowpass:5000, decimate:4', an empty one for ''
+    """
+    filters = []
+    rate = sample_rate
+    for item in filter(None, (item.strip() for item in spec.split(','))):
+        name, *args = (part.strip() for part in item.split(':'))
+        try:
+            stage = _make_filter(name.lower(), [float(arg) for arg in args], rate)
+        except IndexError:
+            raise ValueError(f"bad filter '{item}': missing arguments, see filters.py") from None
+        except ValueError as e:
+            raise ValueError(f"bad filter '{item}': {e}") from e
+        filters.append(stage)
+        rate /= stage.decimation
+    return FilterChain(filters, sample_rate, spec.strip())
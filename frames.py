@@ -0,0 +1,403 @@
+"""
+frame schemas: how the samples of a board are laid out on the wire
+
+a frame is  sync word | header fields | payload | crc  and the payload holds interleaved samples of every channel,
+the crc is optional. A schema is compiled once into numpy structured dtypes; FrameDecoder finds the sync words of a
+whole read with array operations and converts every frame in it with one gather and one dtype view, there is no Python
+loop over frames.
+
+frames whose crc (crc8, crc16, crc16_modbus or crc32 over header and payload) does not match are dropped and counted,
+gaps in the sequence_field counter are counted as lost frames. LinkMonitor turns the counters into the payload rate and
+the share of the line rate that is usable data, shown in the status bar and by headless.py.
+
+'legacy' is the original protocol (4 x 0xFF between float32 blobs of any length) and still goes through
+StreamDecoder. Other schemas are json files with the arguments of FrameSchema, e.g.
+
+    {"name": "adc4", "sync": "a55a", "channels": ["x", "y", "z", "w"], "sample_dtype": "i2", "byte_order": ">",
+     "header": [["counter", "u2"]], "payload": "fixed", "frame_samples": 16, "scale": 0.000125,
+     "sequence_field": "counter", "crc": "crc16"}
+"""
+import json
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from utility import HEADER, StreamDecoder
+
+PAYLOAD_MODES = ('fixed', 'length_prefixed', 'stream')
+# width, polynomial, initial value, reflected, final xor
+CRC_SPECS = {
+    'crc8': (8, 0x07, 0x00, False, 0x00),  # CRC-8/SMBUS
+    'crc16': (16, 0x1021, 0xFFFF, False, 0x0000),  # CRC-16/CCITT-FALSE
+    'crc16_modbus': (16, 0x8005, 0xFFFF, True, 0x0000),
+    'crc32': (32, 0x04C11DB7, 0xFFFFFFFF, True, 0xFFFFFFFF),  # zlib / Ethernet
+}
+
+
+@lru_cache(maxsize=None)
+def crc_table(name: str) -> np.ndarray:
+    """
+    the 256 entry table of a CRC_SPECS entry, for the reflected ones in reflected bit order
+    """
+    width, poly, _, reflected, _ = CRC_SPECS[name]
+    mask = (1 << width) - 1
+    table = np.zeros(256, dtype=np.uint64)
+    for byte in range(256):
+        if reflected:
+            value = byte
+            reflected_poly = int(f'{poly:0{width}b}'[::-1], 2)
+            for _ in range(8):
+                value = (value >> 1) ^ reflected_poly if value & 1 else value >> 1
+        else:
+            value = byte << (width - 8)
+            for _ in range(8):
+                value = ((value << 1) ^ poly) & mask if value & (1 << (width - 1)) else (value << 1) & mask
+        table[byte] = value
+    table.flags.writeable = False
+    return table
+
+
+def crc(rows: np.ndarray, name: str, lengths: np.ndarray | None = None) -> np.ndarray:
+    """
+    CRC of every row of an (n, k) uint8 array. The table lookups go one byte column at a time for all rows together,
+    so a read of many frames costs k array operations. With lengths only the first lengths[i] bytes of row i count
+    """
+    width, _, init, reflected, xor_out = CRC_SPECS[name]
+    table = crc_table(name)
+    mask = np.uint64((1 << width) - 1)
+    value = np.full(len(rows), init, dtype=np.uint64)
+    for i in range(rows.shape[1]):
+        column = rows[:, i].astype(np.uint64)
+        if reflected:
+            new = (value >> np.uint64(8)) ^ table[(value ^ column) & np.uint64(0xFF)]
+        else:
+            new = ((value << np.uint64(8)) & mask) ^ table[((value >> np.uint64(width - 8)) ^ column) & np.uint64(0xFF)]
+        value = new if lengths is None else np.where(i < lengths, new, value)
+    return value ^ np.uint64(xor_out)
+
+
+class FrameSchema:
+    """
+    layout of one frame
+
+    sync: the bytes every frame starts with
+    channels: names of the interleaved channels, every sample is a sample_dtype in byte_order ('<' or '>')
+    header: (name, dtype) fields between the sync word and the payload, e.g. a counter
+    payload: 'fixed': frame_samples samples per channel in every frame
+             'length_prefixed': the header field length_field holds the samples per channel of each frame (at most
+             max_frame_samples, longer ones are taken for a false sync)
+             'stream': float32 blobs of any length between syncs, the legacy protocol (one channel, no header)
+    scale: the decoded float32 samples are multiplied by it, e.g. volts per count
+    sequence_field: a header field counting frames (wrapping at its size), gaps are counted as lost frames
+    crc: a CRC_SPECS name, the crc follows the payload in byte_order and covers the header and the payload (and the
+    sync word with crc_includes_sync). Frames that fail it are dropped
+    """
+
+    def __init__(self, name: str, sync: bytes = HEADER, channels=('ch0',), sample_dtype='f4', byte_order: str = '<',
+                 header=(), payload: str = 'fixed', frame_samples: int = 1, length_field: str | None = None,
+                 max_frame_samples: int = 4096, scale: float = 1.0, sequence_field: str | None = None,
+                 crc: str | None = None, crc_includes_sync: bool = False):
+        if payload not in PAYLOAD_MODES:
+            raise ValueError(f"unknown payload '{payload}', use one of {PAYLOAD_MODES}")
+        if not sync:
+            raise ValueError('a frame schema needs a sync word')
+        if byte_order not in '<>':
+            raise ValueError(f"byte order must be '<' or '>', got '{byte_order}'")
+        if payload == 'length_prefixed' and length_field not in [field for field, _ in header]:
+            raise ValueError(f"length field '{length_field}' is not one of the header fields")
+        if sequence_field is not None and sequence_field not in [field for field, _ in header]:
+            raise ValueError(f"sequence field '{sequence_field}' is not one of the header fields")
+        if crc is not None and crc not in CRC_SPECS:
+            raise ValueError(f"unknown crc '{crc}', use one of {list(CRC_SPECS)}")
+        if payload == 'stream' and (sync != HEADER or len(channels) != 1 or header or crc):
+            raise ValueError('stream payloads only exist in the legacy layout: 4 x 0xFF, one float32 channel')
+
+        self.name = name
+        self.sync = bytes(sync)
+        self.channels = tuple(channels)
+        self.payload = payload
+        self.frame_samples = frame_samples
+        self.length_field = length_field
+        self.max_frame_samples = max_frame_samples
+        self.scale = scale
+        self.sequence_field = sequence_field
+        self.crc = crc
+        self.crc_includes_sync = crc_includes_sync
+
+        # compiled layout: one row of samples, the fixed part in front of the payload and for fixed payloads the
+        # whole frame
+        self.sample_dtype = np.dtype(sample_dtype).newbyteorder(byte_order)
+        self.row_dtype = np.dtype([(channel, self.sample_dtype) for channel in self.channels])
+        self.header_dtype = np.dtype([('sync', np.uint8, (len(self.sync),))]
+                                     + [(field, np.dtype(dtype).newbyteorder(byte_order)) for field, dtype in header])
+        self.crc_dtype = None if crc is None else np.dtype(f'u{CRC_SPECS[crc][0] // 8}').newbyteorder(byte_order)
+        self.frame_dtype = np.dtype([('header', self.header_dtype), ('rows', self.row_dtype, (frame_samples,))]
+                                    + ([] if crc is None else [('crc', self.crc_dtype)]))
+        # bytes after the payload
+        self.trailer_size = 0 if crc is None else self.crc_dtype.itemsize
+
+    def __repr__(self):
+        return f'FrameSchema({self.name}, {self.payload}, channels: {self.channels}, {self.sample_dtype.str})'
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> 'FrameSchema':
+        spec = dict(spec)
+        if isinstance(spec.get('sync'), str):
+            spec['sync'] = bytes.fromhex(spec['sync'])
+        spec['header'] = [tuple(field) for field in spec.get('header', ())]
+        return cls(**spec)
+
+    def decoder(self):
+        return StreamDecoder() if self.payload == 'stream' else FrameDecoder(self)
+
+
+SCHEMAS = {
+    'legacy': FrameSchema('legacy', payload='stream'),
+}
+
+
+def load_schema(name_or_path: str) -> FrameSchema:
+    """
+    a schema of SCHEMAS by name or read from a json file
+    """
+    if name_or_path in SCHEMAS:
+        return SCHEMAS[name_or_path]
+    if not name_or_path.endswith('.json'):
+        raise ValueError(f"unknown frame schema '{name_or_path}', use one of {list(SCHEMAS)} or a .json file")
+    try:
+        with open(name_or_path) as f:
+            return FrameSchema.from_dict(json.load(f))
+    except (OSError, TypeError) as e:
+        raise ValueError(f'cannot load the frame schema {name_or_path}: {e}') from e
+
+
+class LinkMonitor:
+    """
+    what a serial link delivered between two calls of report(): bytes in, usable payload and the decoder's counters,
+    so a higher baud rate can be judged by the data it actually brings. decoder is anything with n_bytes,
+    payload_bytes and stats(), a StreamDecoder, a FrameDecoder or the counters of a pipeline
+    """
+
+    def __init__(self, decoder):
+        self.decoder = decoder
+        self._last = (decoder.n_bytes, decoder.payload_bytes)
+        self._last_time = time.monotonic()
+
+    def report(self) -> str:
+        now = time.monotonic()
+        elapsed = max(now - self._last_time, 1e-9)
+        n_bytes, payload_bytes = self.decoder.n_bytes, self.decoder.payload_bytes
+        rate_in = (n_bytes - self._last[0]) / elapsed
+        payload_rate = (payload_bytes - self._last[1]) / elapsed
+        self._last, self._last_time = (n_bytes, payload_bytes), now
+
+        usable = f' ({100 * payload_rate / rate_in:.0f} %)' if rate_in else ''
+        return f'payload {payload_rate / 1e3:.1f} of {rate_in / 1e3:.1f} kB/s{usable}, {self.decoder.stats()}'
+
+
+def find_sync(buffer: np.ndarray, sync: bytes) -> np.ndarray:
+    """
+    every offset of buffer where sync starts, overlapping matches included
+    """
+    n_offsets = len(buffer) - len(sync) + 1
+    if n_offsets <= 0:
+        return np.empty(0, dtype=np.intp)
+    match = buffer[:n_offsets] == sync[0]
+    for i in range(1, len(sync)):
+        match &= buffer[i:i + n_offsets] == sync[i]
+    return match.nonzero()[0]
+
+
+def _gather_rows(buffer: np.ndarray, starts: np.ndarray, size: int) -> np.ndarray:
+    """
+    buffer[start:start + size] of every start as one (n, size) uint8 array
+    """
+    return buffer[starts[:, None] + np.arange(size)]
+
+
+class FrameDecoder:
+    """
+    incremental decoder of a fixed or length prefixed FrameSchema, a drop in for StreamDecoder
+
+    a sync word counts as a frame start when the next frame's sync follows right after the frame (or the read ends
+    before it could), so sync bytes inside a payload are not taken for frames. Bytes of an incomplete frame at the end
+    of a read are carried to the next feed(), everything else outside of frames is counted in resync_bytes.
+
+    feed() returns float32 samples of shape (n,) for one channel and (n, channels) otherwise, the header fields of
+    the frames it decoded are left in headers (a structured array, one entry per frame)
+
+    counters: n_frames (frames that passed every check), frames_lost (sequence gaps that are not explained by CRC
+    failures, a backwards jump of more than half the counter range is taken for a restart and not counted),
+    crc_failures, resync_bytes, payload_bytes (sample bytes of the good frames) and n_bytes (everything fed)
+    """
+
+    def __init__(self, schema: FrameSchema):
+        self.schema = schema
+        self.channels = schema.channels
+        self.synced = False
+        self.resync_bytes = 0
+        self.n_bytes = 0
+        self.n_samples = 0
+        self.n_frames = 0
+        self.frames_lost = 0
+        self.crc_failures = 0
+        self.payload_bytes = 0
+        self.headers = np.zeros(0, dtype=schema.header_dtype)
+        self._pending = b''
+        self._last_sequence = None
+        self._unmatched_crc_failures = 0
+
+    def reset(self):
+        self.synced = False
+        self._pending = b''
+
+    @property
+    def pending_bytes(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> str:
+        return (f'frames ok: {self.n_frames}, lost: {self.frames_lost}, crc errors: {self.crc_failures}, '
+                f'resync bytes: {self.resync_bytes}')
+
+    def _frame_sizes(self, buffer: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """
+        byte size of the frame at every candidate start, -1 where the header is not complete yet and 0 where the
+        length is implausible
+        """
+        schema = self.schema
+        if schema.payload == 'fixed':
+            return np.full(len(candidates), schema.frame_dtype.itemsize)
+
+        header_size = schema.header_dtype.itemsize
+        sizes = np.full(len(candidates), -1)
+        complete = candidates + header_size <= len(buffer)
+        headers = _gather_rows(buffer, candidates[complete], header_size).view(schema.header_dtype)[:, 0]
+        lengths = headers[schema.length_field].astype(np.int64)
+        sizes[complete] = np.where(lengths <= schema.max_frame_samples,
+                                   header_size + lengths * schema.row_dtype.itemsize + schema.trailer_size, 0)
+        return sizes
+
+    def _select_frames(self, buffer: np.ndarray, candidates: np.ndarray, sizes: np.ndarray):
+        """
+        (starts, sizes) of the frames to decode and the offset the carried bytes start at
+        """
+        ends = candidates + sizes
+        sync_len = len(self.schema.sync)
+        # the next sync follows right after the frame, or the read ends before it could be seen. candidates are
+        # sorted, a binary search is cheaper than np.isin for the small arrays of a single read
+        following = np.minimum(np.searchsorted(candidates, ends), len(candidates) - 1)
+        chained = (candidates[following] == ends) | (ends > len(buffer) - sync_len)
+        frames = (sizes > 0) & chained & (ends <= len(buffer))
+        incomplete = (sizes < 0) | (ends > len(buffer))
+        starts, sizes = candidates[frames], sizes[frames]
+
+        if len(starts) > 1 and (starts[1:] < starts[:-1] + sizes[:-1]).any():
+            # overlapping frames need a sync pattern repeating at the frame period inside the payload, rare enough
+            # for a loop over the candidates
+            keep = np.zeros(len(starts), dtype=bool)
+            next_free = 0
+            for i, (start, size) in enumerate(zip(starts, sizes)):
+                if start >= next_free:
+                    keep[i] = True
+                    next_free = start + size
+            starts, sizes = starts[keep], sizes[keep]
+
+        # carry from the first frame start that is not complete yet, else the bytes that may begin a sync word
+        decoded_end = int(starts[-1] + sizes[-1]) if len(starts) else 0
+        open_starts = candidates[(candidates >= decoded_end) & incomplete]
+        carry = int(open_starts[0]) if len(open_starts) else max(decoded_end, len(buffer) - sync_len + 1)
+        return starts, sizes, carry
+
+    def _check_crc(self, buffer: np.ndarray, starts: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+        """
+        True for every frame whose crc matches
+        """
+        schema = self.schema
+        first = 0 if schema.crc_includes_sync else len(schema.sync)
+        covered = sizes - schema.trailer_size - first
+        width = int(covered.max()) if len(covered) else 0
+        # shorter frames of a length prefixed schema read past their end, crc() ignores those bytes
+        indices = np.minimum(starts[:, None] + first + np.arange(width), len(buffer) - 1)
+        computed = crc(buffer[indices], schema.crc, covered if schema.payload == 'length_prefixed' else None)
+        received = _gather_rows(buffer, starts + sizes - schema.trailer_size, schema.trailer_size)
+        return computed == received.view(schema.crc_dtype)[:, 0]
+
+    def _count_lost(self, sequence: np.ndarray, n_crc_failures: int):
+        # frames dropped by the crc check leave a gap as well (maybe only in the next read), they are counted as crc
+        # failures only
+        self._unmatched_crc_failures += n_crc_failures
+        modulus = 1 << (8 * sequence.dtype.itemsize)
+        sequence = sequence.astype(np.int64)
+        if self._last_sequence is not None:
+            sequence = np.concatenate(([self._last_sequence], sequence))
+        if len(sequence) > 1:
+            gaps = (np.diff(sequence) - 1) % modulus
+            gaps[gaps >= modulus // 2] = 0
+            n_missing = int(gaps.sum())
+            explained = min(n_missing, self._unmatched_crc_failures)
+            self._unmatched_crc_failures -= explained
+            self.frames_lost += n_missing - explained
+        if len(sequence):
+            self._last_sequence = int(sequence[-1])
+
+    def feed(self, byte_packet, out: np.ndarray | None = None) -> np.ndarray:
+        """
+        decode the next block of the stream, returns the samples of every complete frame in it
+        """
+        schema = self.schema
+        self.n_bytes += len(byte_packet)
+        data = self._pending + bytes(byte_packet) if self._pending else byte_packet
+        buffer = np.frombuffer(data, dtype=np.uint8)
+
+        candidates = find_sync(buffer, schema.sync)
+        starts, sizes, carry = self._select_frames(buffer, candidates, self._frame_sizes(buffer, candidates))
+        self._pending = bytes(data[carry:])
+        skipped = carry - int(sizes.sum())
+        self.resync_bytes += skipped
+        self.synced = len(starts) > 0 or (self.synced and not skipped)
+
+        n_crc_failures = 0
+        if schema.crc is not None:
+            valid = self._check_crc(buffer, starts, sizes)
+            n_crc_failures = len(valid) - int(valid.sum())
+            self.crc_failures += n_crc_failures
+            starts, sizes = starts[valid], sizes[valid]
+
+        header_size = schema.header_dtype.itemsize
+        if schema.payload == 'fixed':
+            frame_size = schema.frame_dtype.itemsize
+            if len(starts) and starts[-1] - starts[0] == (len(starts) - 1) * frame_size:
+                # back to back frames, the usual case once synced: a view, no gather
+                frames = buffer[starts[0]:starts[-1] + frame_size].view(schema.frame_dtype)
+            else:
+                frames = _gather_rows(buffer, starts, frame_size).view(schema.frame_dtype)[:, 0]
+            self.headers = frames['header']
+            rows = frames['rows'].reshape(-1)
+        else:
+            self.headers = _gather_rows(buffer, starts, header_size).view(schema.header_dtype)[:, 0]
+            # payload bytes of every frame back to back, the same index trick as gather_segments
+            lengths = sizes - header_size - schema.trailer_size
+            n_bytes = int(lengths.sum())
+            indices = (starts + header_size - (lengths.cumsum() - lengths)).repeat(lengths)
+            indices += np.arange(n_bytes)
+            rows = buffer.take(indices).view(schema.row_dtype)
+
+        if schema.sequence_field is not None:
+            self._count_lost(self.headers[schema.sequence_field], n_crc_failures)
+
+        n_channels = len(self.channels)
+        shape = (len(rows),) if n_channels == 1 else (len(rows), n_channels)
+        samples = np.empty(shape, dtype=np.float32) if out is None else out[:len(rows)]
+        for i, channel in enumerate(self.channels):
+            if n_channels == 1:
+                samples[:] = rows[channel]
+            else:
+                samples[:, i] = rows[channel]
+        if schema.scale != 1:
+            samples *= schema.scale
+
+        self.n_frames += len(starts)
+        self.n_samples += len(rows)
+        self.payload_bytes += len(rows) * schema.row_dtype.itemsize
+        return samples
@@ -0,0 +1,218 @@
+"""
+capture without the GUI: UART or USB straight to disk with throughput and loss stats printed every few seconds.
+Nothing from Qt, matplotlib or qdarktheme is imported, sounddevice only for USB captures.
+
+    python headless.py uart --port /dev/ttyACM0 --baud 12000000 --output run.scap --seconds 60
+    python headless.py usb --input-device 3 --output mic.scap --seconds 10
+    python headless.py uart --config lab.json
+
+the config file is json with the keys of the GUI settings (com_port, baud_rate, chunk, sample_rate, record_file, ...),
+flags given on the command line win over it. An empty --output only prints the stats. --schema takes a frame schema
+name or .json file like the GUI setting, see frames.py. --publish tcp:5555 serves the blocks to other programs while
+capturing, see publisher_client.py
+"""
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+import serial
+
+from capture import MicCapture, SerialCapture
+from frames import LinkMonitor, load_schema
+from publisher import Publisher
+from recording import CaptureWriter
+from utility import QUEUE_POLICIES
+
+
+DEFAULTS = {
+    'sample_rate': 48_000,
+    'input_device': -1,
+    'output_device': 35,
+    'channels': 1,
+    'block_size': 0,
+    'latency': 'high',
+    'com_port': 'COM8',
+    'baud_rate': 12_000_000,
+    'chunk': 0,
+    'target_latency_ms': 10,
+    'frame_schema': 'legacy',
+    'timeout': 1,
+    'queue_policy': 'block',
+    'record_n_samples': 0,
+    'record_seconds': 0,
+    'record_file': 'recorded_signal.scap',
+    'stats_interval': 1.0,
+    'publish': '',
+}
+# blocks waiting for the main thread, at 12 Mbaud and 256 byte reads that is about 0.2 s
+QUEUE_SIZE = 1024
+
+
+class SummaryStats:
+    """
+    running count, mean, rms, min and max of every sample that went through, one numpy pass per block
+    """
+
+    def __init__(self):
+        self.n_samples = 0
+        self._sum = 0.0
+        self._sum_squares = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+
+    def update(self, block: np.ndarray):
+        if len(block):
+            block = block.astype(np.float64, copy=False)
+            self.n_samples += len(block)
+            self._sum += block.sum()
+            self._sum_squares += np.dot(block, block)
+            self.minimum = min(self.minimum, block.min())
+            self.maximum = max(self.maximum, block.max())
+
+    def __str__(self):
+        if not self.n_samples:
+            return 'no samples'
+        mean = self._sum / self.n_samples
+        rms = np.sqrt(self._sum_squares / self.n_samples)
+        return (f'{self.n_samples} samples, mean: {mean:.6g}, rms: {rms:.6g}, min: {self.minimum:.6g}, '
+                f'max: {self.maximum:.6g}')
+
+
+def parse_args(argv=None):
+    """
+    settings from the defaults, then the --config file, then the flags
+    """
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument('--config')
+    config_args, _ = config_parser.parse_known_args(argv)
+
+    settings = dict(DEFAULTS)
+    if config_args.config:
+        with open(config_args.config) as f:
+            config = json.load(f)
+        unknown = set(config) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f'unknown settings in {config_args.config}: {sorted(unknown)}')
+        settings.update(config)
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     parents=[config_parser])
+    parser.add_argument('source', choices=('uart', 'usb'))
+    parser.add_argument('--sample-rate', dest='sample_rate', type=int)
+    parser.add_argument('--port', dest='com_port')
+    parser.add_argument('--baud', dest='baud_rate', type=int)
+    parser.add_argument('--chunk', type=int, help='bytes per read, 0 = adapt to the byte rate')
+    parser.add_argument('--target-latency-ms', dest='target_latency_ms', type=float,
+                        help='how long an adaptive read may take')
+    parser.add_argument('--timeout', type=float, help='serial read timeout in seconds')
+    parser.add_argument('--schema', dest='frame_schema', help='frame schema name or .json file')
+    parser.add_argument('--input-device', dest='input_device', type=int)
+    parser.add_argument('--output-device', dest='output_device', type=int)
+    parser.add_argument('--channels', type=int)
+    parser.add_argument('--block-size', dest='block_size', type=int)
+    parser.add_argument('--latency')
+    parser.add_argument('--queue-policy', dest='queue_policy', choices=QUEUE_POLICIES)
+    parser.add_argument('--samples', dest='record_n_samples', type=int, help='stop after this many samples, 0 = never')
+    parser.add_argument('--seconds', dest='record_seconds', type=float, help='stop after this long, 0 = never')
+    parser.add_argument('--output', dest='record_file', help='.scap for decoded samples, any other name for raw bytes')
+    parser.add_argument('--stats-interval', dest='stats_interval', type=float)
+    parser.add_argument('--publish', help='unix:path or tcp:port to serve the blocks to publisher_client.py')
+    parser.set_defaults(**settings)
+    return parser.parse_args(argv)
+
+
+def open_capture(args):
+    if args.source == 'uart':
+        # urls like loop:// or socket://host:port work as well as port names
+        handle = serial.serial_for_url(args.com_port, baudrate=args.baud_rate, timeout=args.timeout)
+        return SerialCapture(handle, args.chunk, record_n_sample=args.record_n_samples,
+                             queue_policy=args.queue_policy, record_file=args.record_file or None,
+                             record_seconds=args.record_seconds, sample_rate=args.sample_rate, verbose=False,
+                             queue_size=QUEUE_SIZE, target_latency=args.target_latency_ms / 1000,
+                             schema=load_schema(args.frame_schema))
+
+    return MicCapture(in_device=args.input_device, out_device=args.output_device, samplerate=args.sample_rate,
+                      channels=args.channels, latency=args.latency, blocksize=args.block_size,
+                      queue_policy=args.queue_policy, queue_size=QUEUE_SIZE)
+
+
+def stop_capture(capture):
+    capture.is_stopped = True
+    capture.is_closed = True
+
+
+def report(capture, summary: SummaryStats, writer, elapsed: float, link: LinkMonitor | None = None):
+    line = f'[{elapsed:7.1f} s] {summary.n_samples / max(elapsed, 1e-9) / 1e3:.1f} kS/s, queue {capture.queue.stats()}'
+    if isinstance(capture, SerialCapture):
+        line += f', {link.report() if link else capture.decoder.stats()}, {capture.read_stats()}'
+        writer = capture.writer
+    else:
+        line += f', xruns: {capture.xruns}'
+    if writer is not None:
+        line += f', {writer.stats()}'
+    print(line, flush=True)
+
+
+def main(argv=None):
+    tic = time.perf_counter()
+    args = parse_args(argv)
+    capture = open_capture(args)
+
+    # the serial capture writes its own file, USB samples are written from here
+    writer = None
+    if args.source == 'usb' and args.record_file:
+        writer = CaptureWriter(args.record_file, args.sample_rate, source='USB')
+
+    publisher = Publisher(args.publish) if args.publish else None
+
+    thread = threading.Thread(target=capture.run, name=f'{args.source} capture', daemon=True)
+    thread.start()
+    print(f'capturing {args.source} to {args.record_file or "nowhere"}, started in {time.perf_counter() - tic:.2f} s')
+
+    # payload against line bytes and the frame counters since the last report
+    link = LinkMonitor(capture.decoder) if args.source == 'uart' else None
+    summary = SummaryStats()
+    start = last_report = time.perf_counter()
+    try:
+        while thread.is_alive():
+            time.sleep(0.01)
+            for block in capture.queue.get_all():
+                if writer is not None:
+                    # blocks carry monotonic time, the capture file wants wall clock time
+                    writer.write(block.samples, timestamp=block.timestamp + time.time() - time.monotonic())
+                if publisher is not None:
+                    publisher.publish(block)
+                summary.update(block.samples)
+
+            # a recording serial capture stops itself, the limits are checked here for everything else
+            now = time.perf_counter()
+            if 0 < args.record_n_samples <= summary.n_samples or 0 < args.record_seconds <= now - start:
+                stop_capture(capture)
+            if now - last_report >= args.stats_interval:
+                report(capture, summary, writer, now - start, link)
+                last_report = now
+
+    except KeyboardInterrupt:
+        print('interrupted, stopping the capture')
+        stop_capture(capture)
+    finally:
+        thread.join()
+        for block in capture.queue.get_all():
+            if writer is not None:
+                writer.write(block.samples, timestamp=block.timestamp + time.time() - time.monotonic())
+            if publisher is not None:
+                publisher.publish(block)
+            summary.update(block.samples)
+        if writer is not None:
+            writer.close()
+        if publisher is not None:
+            publisher.close()
+
+    report(capture, summary, writer, time.perf_counter() - start, link)
+    print(summary)
+
+
+if __name__ == '__main__':
+    main()
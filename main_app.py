@@ -1,37 +1,89 @@
+import functools
+import os
 import sys
+import time
 
 import numpy as np
 import qdarktheme
 import serial
-import sounddevice as sd
-from PyQt6.QtCore import QSize, QThreadPool, QProcess
-from PyQt6.QtWidgets import QPushButton, QSizePolicy, QStatusBar, QStyleFactory, QFileDialog, QApplication
+from PyQt6.QtCore import QThreadPool, QProcess, QTimer
+from PyQt6.QtGui import QFontDatabase
+from PyQt6.QtWidgets import QPushButton, QSizePolicy, QStatusBar, QStyleFactory, QFileDialog, QApplication, QLabel
 from matplotlib.backends.backend_qtagg import FigureCanvas
 from matplotlib.backends.backend_qtagg import \
     NavigationToolbar2QT as NavigationToolbar
 from matplotlib.backends.qt_compat import QtWidgets
 from matplotlib.figure import Figure
-from numpy.fft import fftfreq, fft
 from serial import SerialException
 
+from render_scheduler import BlitCanvas, RenderScheduler
 from settings_window import SettingsWindow
-from threaded_classes import SerialDataFetcher, MicRecorder
-from utility import decode_bytes
+from trigger import TriggerEngine, TRIGGER_MODES, TRIGGER_EDGES
+from dsp import SpectralEngine, IncrementalSTFT, DECIMATION_MODES, decimate
+from filters import parse_filters
+from frames import LinkMonitor, load_schema
+from measurements import StreamMeasurements, format_spectral_metrics, spectral_metrics
+from threaded_classes import SerialDataFetcher, MicRecorder, SpectrumWorker, PyramidWorker, AudioPlayer, \
+    RecordingOpener
+from async_serial import AsyncSerialEngine
+from pipeline import PipelinePort
+from playback import RecordingSource, LiveSource
+from publisher import Publisher
+from recording import CaptureReader, is_capture_file
+from utility import StreamBuffer, QUEUE_POLICIES
+
+# zoomed in further than the min/max pyramid reaches, a recording is read at full rate up to this many samples
+MAX_RAW_READ = 4_000_000
+# threads: a blocking SerialDataFetcher per port, asyncio: every port on one event loop, processes: a reader and a
+# decoder process per port (the last two for reading only)
+SERIAL_IO_MODES = ('threads', 'asyncio', 'processes')
+# columns of the spectrogram, the hop between them follows from the seconds shown. Colour scale in dB
+SPECTROGRAM_FRAMES = 400
+SPECTROGRAM_DB_RANGE = (-100, 20)
+# share of the trigger window before the trigger point
+TRIGGER_POSITION = 0.25
+# the measurements panel is refreshed this often, its statistics cover the time since the last refresh
+MEASUREMENT_INTERVAL_MS = 500
 
 
 class ApplicationWindow(QtWidgets.QMainWindow):
     def __init__(self):
         super().__init__()
         self.mic_recorder_thread = None
-        self.packet = None
+        self.reader = None
+        self.pyramid = None
+        # the running playback, a recording or the monitor of a live stream (then _monitor is its LiveSource)
+        self.player = None
+        self._monitor = None
+        self._monitor_stream = None
         self.setWindowTitle('Serial COM Analyzer')
         # self.setStyleSheet("background-color: white;")
         self._main = QtWidgets.QWidget()
         self.setCentralWidget(self._main)
 
-        self.fetcher_thread = None
-        self.handle = None
+        # one handle and one fetcher per serial port, keyed by port name
+        self.fetcher_threads = {}
+        self.serial_engine = None
+        self.pipelines = {}
+        self.handles = {}
+        self._recording_ports = set()
+        # live window of every stream (serial ports and the mic) and its line in the time plot
+        self.live_streams = {}
+        self._stream_lines = {}
+        self._measurements = {}
+        # the newest (freqs, magnitude) of the first stream, for the spectral measurements
+        self._spectrum = None
         self.time_indices = None
+        self.spectrum_worker = None
+        # STFT of the first live stream for the spectrogram, None when it is switched off
+        self.stft = None
+        self._new_stft_frames = 0
+        # trigger on the first live stream, None when it is off. The time plot then shows its last window around the
+        # trigger point and is only redrawn when a new one is ready
+        self.trigger = None
+        self._trigger_ready = False
+        self._trigger_times = None
+        self._trigger_marks = []
         # (self.com_port,
         #  self.baud_rate,
         #  self.sample_rate,
@@ -46,20 +98,30 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         #  ) = [None] * 11
 
         self.param_dict = {}
+        self.frame_schema = None
+        # the filter setting parsed once to check it and for the rate of the live streams, every reader gets its own
+        # chain from _new_filters()
+        self.filter_chain = None
+        # serves the live blocks to other programs if the publish setting has an address
+        self.publisher = None
 
         self.record_file: str = ""
         self.record_mic_flag = False
 
         self._default_time_ax_lims = [(0, 0.6), (-12, 12)]
-        self._default_freq_ax_lims = [(-500, 500), (0, 1400)]
+        self._default_freq_ax_lims = [(0, 500), (0, 12)]
 
         self.threadpool = QThreadPool()
+        # readers block on I/O most of the time, leave room for the spectrum worker even on small machines
+        self.threadpool.setMaxThreadCount(max(self.threadpool.maxThreadCount(), 4))
 
         print(f'Multithreading with maximum {self.threadpool.maxThreadCount()} threads')
 
         main_layout = QtWidgets.QVBoxLayout(self._main)
         self.statusbar: QStatusBar = self.statusBar()
         self.statusbar.showMessage("Ready")
+        self.rate_label = QLabel()
+        self.statusbar.addPermanentWidget(self.rate_label)
 
         plot_layouts = QtWidgets.QHBoxLayout()
         time_layout = QtWidgets.QVBoxLayout()
@@ -70,12 +132,20 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         # incompatible between PyQt6 and other bindings, so we just add the
         # toolbar as a plain widget instead.
         time_layout.addWidget(time_canvas)
-        time_layout.addWidget(NavigationToolbar(time_canvas, self))
+        self._time_toolbar = NavigationToolbar(time_canvas, self)
+        time_layout.addWidget(self._time_toolbar)
 
         freq_canvas = FigureCanvas(Figure(figsize=(5, 3)))
         freq_layout.addWidget(freq_canvas)
         freq_layout.addWidget(NavigationToolbar(freq_canvas, self))
 
+        spectrogram_canvas = FigureCanvas(Figure(figsize=(10, 2.5)))
+        self._spectrogram_widget = QtWidgets.QWidget()
+        spectrogram_layout = QtWidgets.QVBoxLayout(self._spectrogram_widget)
+        spectrogram_layout.setContentsMargins(0, 0, 0, 0)
+        spectrogram_layout.addWidget(spectrogram_canvas)
+        spectrogram_layout.addWidget(NavigationToolbar(spectrogram_canvas, self))
+
         # define time and freq axes
         self._time_ax = time_canvas.figure.subplots()
         self._time_ax.set_xlim(self._default_time_ax_lims[0])
@@ -90,6 +160,14 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self._freq_ax.grid(True)
         self._line_freq, = self._freq_ax.plot([], [], label='frequency domain')
         freq_canvas.figure.tight_layout()
+
+        # time on x (newest at 0), frequency on y, one column per STFT frame
+        self._spectrogram_ax = spectrogram_canvas.figure.subplots()
+        low_db, high_db = SPECTROGRAM_DB_RANGE
+        self._spectrogram_image = self._spectrogram_ax.imshow(np.full((2, 2), low_db), aspect='auto', origin='lower',
+                                                              cmap='magma', vmin=low_db, vmax=high_db,
+                                                              interpolation='nearest')
+        spectrogram_canvas.figure.tight_layout()
         ############
 
         # apply dark theme compatible matplotlib styles
@@ -100,11 +178,49 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         freq_canvas.figure.patch.set_facecolor('#202124')
         self._freq_ax.set_facecolor('#202124')
         self._freq_ax.tick_params(axis='both', colors='white')
+
+        spectrogram_canvas.figure.patch.set_facecolor('#202124')
+        self._spectrogram_ax.tick_params(axis='both', colors='white')
         ############
 
+        # live plots are redrawn at a fixed rate, only the lines are blitted over the cached axes
+        self._time_blit = BlitCanvas(time_canvas, [self._line_t])
+        self._freq_blit = BlitCanvas(freq_canvas, [self._line_freq])
+        self._spectrogram_blit = BlitCanvas(spectrogram_canvas, [self._spectrogram_image])
+        self.render_scheduler = RenderScheduler(30, self._update_window, self._drain_capture_queues, self)
+
+        # recordings are read window by window, scrolling or zooming loads the newly visible part shortly after
+        self._recording_timer = QTimer(self)
+        self._recording_timer.setSingleShot(True)
+        self._recording_timer.setInterval(50)
+        self._recording_timer.timeout.connect(self._load_visible_window)
+        self._time_ax.callbacks.connect('xlim_changed', self._on_time_xlim_changed)
+        # a click into a recording while it plays seeks there
+        time_canvas.mpl_connect('button_press_event', self._on_time_click)
+
+        # per stream throughput in the status bar
+        self._rate_timer = QTimer(self)
+        self._rate_timer.setInterval(1000)
+        self._rate_timer.timeout.connect(self._show_stream_rates)
+        self._rate_samples = {}
+        self._rate_time = time.monotonic()
+        self._link_monitors = {}
+        self._rate_timer.start()
+
         plot_layouts.addLayout(time_layout)
         plot_layouts.addLayout(freq_layout)
         main_layout.addLayout(plot_layouts)
+        self._spectrogram_widget.setVisible(False)
+        main_layout.addWidget(self._spectrogram_widget)
+
+        # one line per live stream: mean, rms, peak, crest factor and measured rate, spectral metrics for the first
+        self.measurements_label = QLabel()
+        self.measurements_label.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        main_layout.addWidget(self.measurements_label)
+        self._measurement_timer = QTimer(self)
+        self._measurement_timer.setInterval(MEASUREMENT_INTERVAL_MS)
+        self._measurement_timer.timeout.connect(self._show_measurements)
+        self._measurement_timer.start()
 
         # button layouts
         read_record_layout = QtWidgets.QHBoxLayout()
@@ -115,6 +231,11 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.play_button.setSizePolicy(QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Minimum)
         read_record_layout.addWidget(self.play_button)
 
+        self.arm_button = QPushButton("Arm")
+        self.arm_button.setEnabled(False)
+        self.arm_button.setSizePolicy(QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Minimum)
+        read_record_layout.addWidget(self.arm_button)
+
         self.record_button = QPushButton("Record")
         self.record_button.setEnabled(False)
         self.record_button.setSizePolicy(QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Minimum)
@@ -165,6 +286,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.read_button.clicked.connect(self.start_read)
         self.record_button.clicked.connect(self.start_record)
         self.play_button.clicked.connect(self.start_play)
+        self.arm_button.clicked.connect(self.arm_trigger)
         self.choose_file_button.clicked.connect(self.open_file_dialog)
         self.record_mic_button.clicked.connect(self.record_mic)
 
@@ -178,18 +300,20 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                                                        channels=self.param_dict['channels'],
                                                        latency=self.param_dict['latency'],
                                                        blocksize=self.param_dict['block_size'],
+                                                       queue_policy=self.param_dict['queue_policy'],
+                                                       filters=self._new_filters(),
                                                        )
-                self.mic_recorder_thread.signals.result_signal.connect(self._update_canvas)
 
+            # the recorder thread starts and stops the stream itself, outside the audio callback
             self.mic_recorder_thread.is_stopped = False
+            self._show_live_window()
             if not self.mic_recorder_thread.enable:
                 self.threadpool.start(self.mic_recorder_thread)
                 self.mic_recorder_thread.enable = True
-
-            self.mic_recorder_thread.stream.start()
         else:
             if self.mic_recorder_thread:
-                self.mic_recorder_thread.stream.abort()
+                self.mic_recorder_thread.is_stopped = True
+                self.statusbar.showMessage(f'Mic stopped, xruns so far: {self.mic_recorder_thread.xruns}')
 
     def open_file_dialog(self):
         self.read_button.setEnabled(False)
@@ -208,98 +332,306 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         else:
             self.record_file = files[0]
             print('selected file:', self.record_file)
-            self.statusbar.showMessage("Select the samplerate using Port Settings, note: all sounds plays at 48kHz in "
-                                       "Windows")
+            if is_capture_file(self.record_file):
+                # only the header is needed here, the file is opened again for reading
+                with CaptureReader(self.record_file) as reader:
+                    self.statusbar.showMessage(f"{reader.source} capture, {reader.sample_rate:g} Hz, "
+                                               f"{reader.duration:.2f} s, note: all sounds plays at 48kHz in Windows")
+            else:
+                self.statusbar.showMessage("Select the samplerate using Port Settings, note: all sounds plays at 48kHz "
+                                           "in Windows")
 
     def start_read(self):
-        if self.threadpool.activeThreadCount() > 0:
+        if self._serial_readers():
             self.statusbar.showMessage('Please close any active ports before continuing')
             return
 
-        if self.handle is not None:
+        if self.handles:
             self.start_fetcher()
-            self.statusbar.showMessage('Reading')
+            self.statusbar.showMessage(f"Reading {', '.join(self.handles)}")
             print('active thread:', self.threadpool.activeThreadCount())
 
         elif self.record_file:
-            self.statusbar.showMessage('Reading record file')
-            with open(self.record_file, 'rb') as file:
-                byte_packet = file.read()
-
-            print('record file:', byte_packet)
-            self.packet = decode_bytes(byte_packet)
-            self._update_canvas(self.packet)
-
-            # # also enable play button after reading the record successfully
-            # self.start_play()
-            self.play_button.setEnabled(True)
+            if self.mic_recorder_thread and not self.mic_recorder_thread.is_stopped:
+                self.statusbar.showMessage('Stop the mic before reading a recording')
+                return
+
+            self._stop_playback()
+            self._clear_live_streams()
+            # a raw recording needs a pass over the whole file before it can be read, never on the GUI thread
+            self.read_button.setEnabled(False)
+            self.statusbar.showMessage(f'Opening {self.record_file} ...')
+            opener = RecordingOpener(self.record_file, self.param_dict['sample_rate'])
+            opener.signals.result_signal.connect(self._recording_opened)
+            self.threadpool.start(opener)
         else:
             self.statusbar.showMessage('Connect before reading or choose a .bin file')
 
+    def _recording_opened(self, result):
+        path, reader = result
+        self.read_button.setEnabled(True)
+        if isinstance(reader, str):
+            self.statusbar.showMessage(reader)
+            return
+        if path != self.record_file or self.handles or self._serial_readers():
+            # another file was chosen or a port connected meanwhile
+            reader.close()
+            return
+
+        # the recording is memory mapped, only the visible window is decoded and plotted
+        self.reader = reader
+        # zoomed out views come from a min/max pyramid, built once in the background
+        self.pyramid = None
+        pyramid_worker = PyramidWorker(self.reader)
+        pyramid_worker.signals.result_signal.connect(self._pyramid_ready)
+        self.threadpool.start(pyramid_worker)
+        self.statusbar.showMessage(f'Reading record file, {self.reader.n_samples} samples, '
+                                   f'{self.reader.duration:.2f} s')
+        self._freq_ax.set_xlim(0, self.reader.sample_rate / 2)
+        self._freq_ax.figure.canvas.draw()
+        for mark in self._trigger_marks:
+            mark.set_visible(False)
+        self._time_ax.set_xlim(0, max(self.reader.duration, 1 / self.reader.sample_rate))
+        self._load_visible_window()
+
+        # # also enable play button after reading the record successfully
+        # self.start_play()
+        self.play_button.setEnabled(True)
+
     def start_play(self):
-        # audio_thread = AudioPlayer(self.sample_rate, len(self.float_packet), self.float_packet)
-        # self.threadpool.start(audio_thread)
-
-        sd.wait()
-        audio = self.packet
-        # audio /= np.max(np.abs(audio), axis=0) // todo_fixed: check if it is necessary to adjust values
-        print("audio:", audio)
-        self.statusbar.showMessage('Packet is playing now')
-        sd.default.channels = 1
-        # sd.default.dtype = np.float32
-        sd.play(audio, samplerate=self._play_samplerate, blocking=True)
+        """
+        Play / Pause. A recording plays its visible part, clicking into the time plot seeks. Without a recording the
+        first live stream is monitored
+        """
+        if self.player is not None:
+            if self.player.paused:
+                self.player.play()
+                self.play_button.setText('Pause')
+            else:
+                self.player.pause()
+                self.play_button.setText('Play')
+            return
+
+        if self.reader is not None:
+            source = RecordingSource(self.reader, *self._visible_samples())
+        elif self.live_streams:
+            self._monitor_stream = next(iter(self.live_streams))
+            source = self._monitor = LiveSource(self.live_streams[self._monitor_stream].sample_rate)
+        else:
+            return
+
+        try:
+            self.player = AudioPlayer(source, device=self.param_dict['output_device'])
+        except Exception as e:
+            source.close()
+            self._monitor = None
+            self.statusbar.showMessage(f'Cannot open the output device: {e}')
+            return
+        self.player.signals.finish_signal.connect(self._playback_finished)
+        self.player.play()
+        self.play_button.setText('Pause')
+        resampled = ''
+        if self.player.device_rate != source.sample_rate:
+            resampled = f', resampled to {self.player.device_rate:g} Hz'
+        self.statusbar.showMessage(f"{'Playing' if self._monitor is None else 'Monitoring'} at "
+                                   f"{source.sample_rate:g} Hz{resampled}")
+
+    def arm_trigger(self):
+        """
+        wait for the next trigger, the single mode stops after every window
+        """
+        if self.trigger is not None:
+            self.trigger.arm()
+            self.statusbar.showMessage('Trigger armed')
+
+    def _stop_playback(self):
+        if self.player is not None:
+            self.player.stop()
+        self._playback_finished()
+
+    def _playback_finished(self):
+        if self.player is not None:
+            print(f'playback ended, underruns: {self.player.underruns}')
+        self.player = None
+        self._monitor = None
+        self.play_button.setText('Play')
+
+    def _on_time_click(self, event):
+        # only plain clicks, not the ones of the zoom and pan tools
+        if (self.player is not None and self.reader is not None and event.inaxes is self._time_ax
+                and event.xdata is not None and self._time_toolbar.mode == ''):
+            self.player.seek(int(event.xdata * self.reader.sample_rate))
 
     def start_record(self):
-        if self.threadpool.activeThreadCount() > 0:
+        if self._recording_ports:
+            # second click stops the running recordings, the writers flush everything before the threads end
+            for port in self._recording_ports:
+                self.fetcher_threads[port].is_stopped = True
+            self.statusbar.showMessage('Stopping the recording')
+            return
+
+        if self._serial_readers():
             self.statusbar.showMessage('"Please close any active ports before continuing')
             return
 
-        if self.param_dict['record_n_samples'] > 0:
-            fetcher_thread_record = SerialDataFetcher(self.handle, self.param_dict['chunk'],
-                                                      record_n_sample=self.param_dict['record_n_samples'])
-            self.threadpool.start(fetcher_thread_record)
-        else:
-            self.statusbar.showMessage(f'choose an appropriate record sample size! Current: {self.record_n_sample}')
+        if not self.handles:
+            self.statusbar.showMessage('Connect before recording')
+            return
+        self._show_live_window()
+
+        if not self.param_dict['record_file']:
+            self.statusbar.showMessage('Choose a record file in Port Settings')
+            return
+
+        self._reserve_threads()
+        for port, handle in self.handles.items():
+            fetcher = SerialDataFetcher(handle, self.param_dict['chunk'],
+                                        target_latency=self.param_dict['target_latency_ms'] / 1000,
+                                        record_n_sample=self.param_dict['record_n_samples'],
+                                        queue_policy=self.param_dict['queue_policy'],
+                                        record_file=self._record_file_for(port),
+                                        record_seconds=self.param_dict['record_seconds'],
+                                        sample_rate=self.param_dict['sample_rate'], name=port,
+                                        schema=self.frame_schema, filters=self._new_filters())
+            fetcher.signals.finish_signal.connect(lambda port=port: self._record_finished(port))
+            self.fetcher_threads[port] = fetcher
+            self._recording_ports.add(port)
+            self.threadpool.start(fetcher)
+        self.record_button.setText('Stop Recording')
+        self.statusbar.showMessage(f"Recording to {', '.join(f.record_file for f in self.fetcher_threads.values())}")
+
+    def _record_file_for(self, port: str) -> str:
+        """
+        with several ports every one gets its own file, named after the port: recorded_signal_COM8.scap
+        """
+        record_file = self.param_dict['record_file']
+        if len(self.handles) == 1:
+            return record_file
+        root, extension = os.path.splitext(record_file)
+        return f'{root}_{os.path.basename(port)}{extension}'
+
+    def _record_finished(self, port: str):
+        self._recording_ports.discard(port)
+        fetcher = self.fetcher_threads.pop(port, None)
+        if not self._recording_ports:
+            self.record_button.setText('Record')
+        if fetcher is not None:
+            self.statusbar.showMessage(f"Recording saved to {fetcher.record_file}")
 
     def open_serial_port(self):
-        if self.handle is not None:
-            # close the handle and emit finish signal from the thread
+        """
+        connect every port of the comma separated com_port setting (COM8, COM9), or disconnect all of them. Urls
+        like socket://host:port and the /dev/pts/N of replay.py work as well
+        """
+        if self.handles:
+            # close the handles and emit finish signals from the threads
             print('closing fired!')
-            self.handle.close()
-            self.handle = None
             self.close_thread()
+            for handle in self.handles.values():
+                handle.close()
+            self.handles = {}
             self.connect_button.setText("Connect")
             print('active thread:', self.threadpool.activeThreadCount())
 
         else:
+            ports = [port.strip() for port in self.param_dict['com_port'].split(',') if port.strip()]
             try:
-                if self.handle is not None:
-                    if self.handle.is_open:
-                        self.handle.close()
-                        self.handle.flushInput()
-                        self.handle.flushOutput()
-                        print('Previous port closed')
-
-                self.handle = serial.Serial(port=self.param_dict['com_port'], baudrate=self.param_dict['baud_rate'],
-                                            timeout=self.param_dict['timeout'], )
-                print("handle opened!", self.handle)
-                self.statusbar.showMessage(f"Listening {self.param_dict['com_port']}")
+                for port in ports:
+                    self.handles[port] = serial.serial_for_url(port, baudrate=self.param_dict['baud_rate'],
+                                                               timeout=self.param_dict['timeout'])
+                    print("handle opened!", self.handles[port])
+                self.statusbar.showMessage(f"Listening {', '.join(ports)}")
                 self.connect_button.setText("Disconnect")
             except SerialException as e:
-                self.statusbar.showMessage(f"Connection error on {self.param_dict['com_port']}! {e}")
-                self.handle = None
+                self.statusbar.showMessage(f"Connection error on {port}! {e}")
+                for handle in self.handles.values():
+                    handle.close()
+                self.handles = {}
+
+    def _reserve_threads(self):
+        """
+        every reader blocks a pool thread, keep room for the mic and the spectrum / pyramid workers next to them
+        """
+        self.threadpool.setMaxThreadCount(max(self.threadpool.maxThreadCount(), len(self.handles) + 3))
 
     def start_fetcher(self):
-        self.fetcher_thread = SerialDataFetcher(self.handle, self.param_dict['chunk'])
-        self.fetcher_thread.signals.result_signal.connect(self._update_canvas)
-        self.fetcher_thread.signals.finish_signal.connect(self.close_thread)
-        self.threadpool.start(self.fetcher_thread)
+        self._show_live_window()
+        if self.param_dict['serial_io'] == 'asyncio':
+            # one loop thread for all ports, created on first use
+            if self.serial_engine is None:
+                self.serial_engine = AsyncSerialEngine()
+            for port, handle in self.handles.items():
+                self.serial_engine.add(handle, name=port, sample_rate=self.param_dict['sample_rate'],
+                                       queue_policy=self.param_dict['queue_policy'], schema=self.frame_schema,
+                                       filters=self._new_filters())
+            return
+
+        if self.param_dict['serial_io'] == 'processes':
+            # the reader process opens the port itself, a short timeout lets it notice the stop quickly
+            for port, handle in self.handles.items():
+                handle.close()
+                open_handle = functools.partial(serial.serial_for_url, port, baudrate=self.param_dict['baud_rate'],
+                                                timeout=0.1)
+                self.pipelines[port] = PipelinePort(open_handle, port, self.param_dict['sample_rate'],
+                                                    n_fft=self.param_dict['fft_size'],
+                                                    averaging=self.param_dict['averaging'],
+                                                    target_latency=self.param_dict['target_latency_ms'] / 1000,
+                                                    spectrum_fps=self.param_dict['fps'], schema=self.frame_schema,
+                                                    filters=self._new_filters())
+            return
+
+        self._reserve_threads()
+        for port, handle in self.handles.items():
+            fetcher = SerialDataFetcher(handle, self.param_dict['chunk'], queue_policy=self.param_dict['queue_policy'],
+                                        target_latency=self.param_dict['target_latency_ms'] / 1000,
+                                        sample_rate=self.param_dict['sample_rate'], name=port,
+                                        schema=self.frame_schema, filters=self._new_filters())
+            fetcher.signals.finish_signal.connect(lambda port=port: self._fetcher_finished(port))
+            self.fetcher_threads[port] = fetcher
+            self.threadpool.start(fetcher)
+
+    def _new_filters(self):
+        """
+        a fresh filter chain of the setting, the filter state belongs to one stream
+        """
+        return parse_filters(self.param_dict['filters'], self.param_dict['sample_rate'])
+
+    def _fetcher_finished(self, port: str):
+        # one port failing leaves the others running
+        self.fetcher_threads.pop(port, None)
+        print(f'{port} reader stopped')
+
+    def _serial_readers(self) -> list:
+        """
+        every running serial reader: pool threads, async ones and pipelines, they all have a queue of SampleBlocks
+        """
+        async_readers = self.serial_engine.readers.values() if self.serial_engine is not None else []
+        return [*self.fetcher_threads.values(), *async_readers, *self.pipelines.values()]
 
     def close_thread(self):
-        if self.fetcher_thread:
-            self.fetcher_thread.is_stopped = True
+        if self.render_scheduler.timer.isActive():
+            print(f'live capture stopped, {self.render_scheduler.stats()}')
+        for fetcher in self.fetcher_threads.values():
+            fetcher.is_stopped = True
+        if self.serial_engine is not None:
+            for name in list(self.serial_engine.readers):
+                self.serial_engine.remove(name)
+        for pipeline in self.pipelines.values():
+            pipeline.stop()
+        self.pipelines = {}
         self.threadpool.clear()
 
+    def closeEvent(self, event):
+        self._stop_playback()
+        if self.mic_recorder_thread:
+            self.mic_recorder_thread.is_closed = True
+        self.close_thread()
+        if self.serial_engine is not None:
+            self.serial_engine.stop()
+        if self.publisher is not None:
+            self.publisher.close()
+        super().closeEvent(event)
+
     def close_and_restart(self):
         # Close the application
         QApplication.instance().quit()
@@ -319,7 +651,8 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         settings_window = SettingsWindow(self)
         settings_window.setStyleSheet(qdarktheme.load_stylesheet())
         settings_window.setGeometry(self.geometry().right(), self.geometry().top(), 200, 100)
-        settings_window.setFixedSize(QSize(320, 450))
+        # as tall as the screen allows, the form scrolls inside
+        settings_window.resize(360, min(800, self.screen().availableGeometry().height() - 80))
         if settings_window.exec():
             try:
                 self.param_dict = settings_window.get_settings()
@@ -327,34 +660,348 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                     f"{param_name}: {param_value}" for param_name, param_value in self.param_dict.items())
 
                 self.statusbar.showMessage(param_display)
+                self.setup_window()
                 self.buttons_enable(True)
             except ValueError as e:
                 self.statusbar.showMessage(f"Values are not of the correct type\n Try again: \n{e}")
                 self.buttons_enable(False)
                 self.open_settings_window()
 
+    def setup_window(self):
+        """
+        reset the live plots, every stream gets a ring buffer of window_seconds at sample_rate when its first block
+        arrives
+        """
+        if self.param_dict['queue_policy'] not in QUEUE_POLICIES:
+            raise ValueError(f"queue policy must be one of {QUEUE_POLICIES}")
+        if self.param_dict['decimation'] not in DECIMATION_MODES:
+            raise ValueError(f"plot decimation must be one of {DECIMATION_MODES}")
+        if self.param_dict['serial_io'] not in SERIAL_IO_MODES:
+            raise ValueError(f"serial io must be one of {SERIAL_IO_MODES}")
+        if self.param_dict['trigger_mode'] not in TRIGGER_MODES:
+            raise ValueError(f"trigger mode must be one of {TRIGGER_MODES}")
+        if self.param_dict['trigger_edge'] not in TRIGGER_EDGES:
+            raise ValueError(f"trigger edge must be one of {TRIGGER_EDGES}")
+        self.frame_schema = load_schema(self.param_dict['frame_schema'])
+        self.filter_chain = self._new_filters()
+        self._setup_publisher()
+
+        # the live streams come at the rate after the filters' decimation
+        sample_rate = self.filter_chain.output_rate
+        n_samples = max(int(self.param_dict['window_seconds'] * sample_rate), 1)
+        self._stop_playback()
+        self._clear_live_streams()
+
+        # the axes of a fixed size window never change, compute them once
+        self.time_indices = np.arange(n_samples) / sample_rate
+        self._setup_trigger(sample_rate)
+        self._time_ax.set_xlim(self._live_time_xlim())
+        self._time_ax.figure.canvas.draw()
+
+        engine = SpectralEngine(self.param_dict['fft_size'], sample_rate, averaging=self.param_dict['averaging'])
+        self.spectrum_worker = SpectrumWorker(engine)
+        self.spectrum_worker.signals.result_signal.connect(self._update_spectrum)
+        self._freq_ax.set_xlim(0, sample_rate / 2)
+        self._freq_ax.figure.canvas.draw()
+        self._setup_spectrogram(sample_rate)
+
+        self.render_scheduler.set_fps(self.param_dict['fps'])
+        self.render_scheduler.start()
+
+    def _setup_spectrogram(self, sample_rate: float):
+        """
+        a fresh STFT for spectrogram_seconds of history, or hide the panel if that is 0
+        """
+        seconds = self.param_dict['spectrogram_seconds']
+        self.stft = None
+        self._new_stft_frames = 0
+        if seconds > 0:
+            hop = max(int(seconds * sample_rate / SPECTROGRAM_FRAMES), 1)
+            self.stft = IncrementalSTFT(self.param_dict['fft_size'], hop, sample_rate, SPECTROGRAM_FRAMES,
+                                        floor_db=SPECTROGRAM_DB_RANGE[0])
+            self._spectrogram_image.set_data(self.stft.image().T)
+            self._spectrogram_image.set_extent((-SPECTROGRAM_FRAMES * hop / sample_rate, 0, 0, sample_rate / 2))
+            self._spectrogram_ax.figure.canvas.draw()
+        self._spectrogram_widget.setVisible(self.stft is not None)
+
+    def _setup_publisher(self):
+        address = self.param_dict['publish']
+        if self.publisher is not None and self.publisher.address == address:
+            return
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
+        if address:
+            try:
+                self.publisher = Publisher(address)
+            except OSError as e:
+                raise ValueError(f'cannot publish on {address}: {e}') from e
+
+    def _setup_trigger(self, sample_rate: float):
+        """
+        a fresh trigger engine with a window of window_seconds, TRIGGER_POSITION of it before the trigger point, or
+        none if the trigger is off. The trigger point and level are marked in the time plot
+        """
+        for mark in self._trigger_marks:
+            mark.remove()
+        self._trigger_marks = []
+        self.trigger = None
+        self._trigger_ready = False
+        if self.param_dict['trigger_mode'] != 'off':
+            n_samples = len(self.time_indices)
+            self.trigger = TriggerEngine(n_samples, sample_rate, pre_trigger=int(TRIGGER_POSITION * n_samples),
+                                         mode=self.param_dict['trigger_mode'], edge=self.param_dict['trigger_edge'],
+                                         level=self.param_dict['trigger_level'],
+                                         hysteresis=self.param_dict['trigger_hysteresis'],
+                                         min_width=self.param_dict['pulse_min_ms'] / 1000,
+                                         max_width=self.param_dict['pulse_max_ms'] / 1000)
+            self._trigger_times = self.time_indices - self.trigger.pre_trigger / sample_rate
+            self._trigger_marks = [self._time_ax.axvline(0, color='gray', linestyle='--', linewidth=0.8),
+                                   self._time_ax.axhline(self.trigger.level, color='gray', linestyle='--',
+                                                         linewidth=0.8)]
+        self.arm_button.setEnabled(self.trigger is not None and self.trigger.mode == 'single')
+
+    def _live_time_xlim(self) -> tuple:
+        if self.trigger is not None:
+            return self._trigger_times[0], self._trigger_times[-1]
+        return 0, self.time_indices[-1]
+
     def buttons_enable(self, enable):
         self.connect_button.setEnabled(enable)
         self.record_button.setEnabled(enable)
         self.read_button.setEnabled(enable)
 
-    def _update_canvas(self, packet, freqs=None):
-        # print("update canvas fired")
-        packet_len = len(packet)
-        if (self.time_indices is None) or len(self.time_indices) != packet_len:
-            # print("generating indices")
-            self.time_indices = np.linspace(0, 1 / self.param_dict['sample_rate'] * packet_len, packet_len)
-            self.freqs = fftfreq(packet_len, 1 / self.param_dict['sample_rate'])
-            # print('time_indices:', self.time_indices)
-            # print('freqs:', self.freqs)
-            # print('packet:', packet)
-
-        self._line_t.set_data(self.time_indices, packet)
-        self._line_t.figure.canvas.draw()
-
-        fft_packet = fft(packet, axis=0)
-        self._line_freq.set_data(self.freqs if freqs is None else freqs, np.abs(fft_packet))
-        self._line_freq.figure.canvas.draw()
+    def _drain_capture_queues(self):
+        """
+        move every block the capture threads queued since the last frame into the ring buffer of its stream,
+        returns True if any window changed
+        """
+        if self.time_indices is None:
+            return False
+
+        changed = False
+        for capture in [*self._serial_readers(), self.mic_recorder_thread]:
+            if capture is not None:
+                for block in capture.queue.get_all():
+                    stream = self._live_stream(block.stream)
+                    stream.write(block)
+                    self._measurements[block.stream].update(block.samples, stream.end_time)
+                    if self.publisher is not None:
+                        self.publisher.publish(block)
+                    # the spectrogram follows the first stream, only the frames the block completes are computed
+                    if self.stft is not None and block.stream == next(iter(self.live_streams)):
+                        self._new_stft_frames += self.stft.feed(block.samples)
+                    if self.trigger is not None and block.stream == next(iter(self.live_streams)):
+                        self._trigger_ready |= self.trigger.feed(block.samples)
+                    if self._monitor is not None and block.stream == self._monitor_stream:
+                        self._monitor.write(block.samples)
+                    changed = True
+
+        return changed
+
+    def _live_stream(self, name: str) -> StreamBuffer:
+        stream = self.live_streams.get(name)
+        if stream is None:
+            # the first stream reuses the time line, every further one gets its own line and a legend entry
+            if self.live_streams:
+                line, = self._time_ax.plot([], [])
+                line.set_animated(True)
+                self._time_blit.artists.append(line)
+            else:
+                line = self._line_t
+            line.set_label(name)
+            stream = self.live_streams[name] = StreamBuffer(name, len(self.time_indices),
+                                                            self.filter_chain.output_rate)
+            self._stream_lines[name] = line
+            self._measurements[name] = StreamMeasurements(self.filter_chain.output_rate)
+            if len(self.live_streams) > 1:
+                self._time_ax.legend(loc='upper left')
+                self._time_ax.figure.canvas.draw()
+            # live streams can be monitored
+            self.play_button.setEnabled(True)
+        return stream
+
+    def _clear_live_streams(self):
+        for name, line in self._stream_lines.items():
+            if line is not self._line_t:
+                line.remove()
+                self._time_blit.artists.remove(line)
+        if self._time_ax.get_legend() is not None:
+            self._time_ax.get_legend().remove()
+        self._line_t.set_label('time domain')
+        if self.stft is not None:
+            self.stft.reset()
+            self._new_stft_frames = 0
+            self._spectrogram_image.set_data(self.stft.image().T)
+            self._spectrogram_blit.blit()
+        if self.trigger is not None:
+            self.trigger.reset()
+            self._trigger_ready = False
+        self.live_streams = {}
+        self._stream_lines = {}
+        self._measurements = {}
+        self._spectrum = None
+        self.measurements_label.clear()
+        self._rate_samples = {}
+
+    def _update_window(self):
+        """
+        plot the sliding window of every stream, new samples enter from the right. Called by the render scheduler
+
+        the streams are aligned on their host timestamps: the newest sample of all sits at the right edge and every
+        other stream is shifted left by how far its newest sample lags behind
+        """
+        if not self.live_streams:
+            return
+
+        if self.trigger is not None:
+            # the window around the last trigger of the first stream, the plot stays as it is until the next one
+            if self._trigger_ready:
+                positions, values = decimate(self.trigger.window, self._plot_points(), self.param_dict['decimation'])
+                self._line_t.set_data(self._trigger_times[positions], values)
+                self._time_blit.blit()
+                self._trigger_ready = False
+        else:
+            newest = max(stream.end_time for stream in self.live_streams.values())
+            for name, stream in self.live_streams.items():
+                positions, values = decimate(stream.ring.view(), self._plot_points(), self.param_dict['decimation'])
+                self._stream_lines[name].set_data(self.time_indices[positions] + (stream.end_time - newest), values)
+            self._time_blit.blit()
+
+        # one set_data per frame and only if the STFT produced new columns
+        if self._new_stft_frames:
+            self._spectrogram_image.set_data(self.stft.image().T)
+            self._spectrogram_blit.blit()
+            self._new_stft_frames = 0
+
+        # the spectrum (of the first stream) is computed on the pool, a frame is skipped while the previous one is
+        # still running. A pipeline computes it in its decoder process, for its first channel if there are several
+        first = next(iter(self.live_streams))
+        pipeline = self.pipelines.get(first) or self.pipelines.get(first.rpartition('/')[0])
+        if pipeline is not None:
+            spectrum = pipeline.spectrum()
+            if spectrum is not None:
+                self._update_spectrum(spectrum)
+        elif not self.spectrum_worker.busy:
+            ring = next(iter(self.live_streams.values())).ring
+            self.spectrum_worker.submit(self.threadpool, ring.latest(self.spectrum_worker.engine.n_fft).copy())
+
+    def _show_stream_rates(self):
+        """
+        samples per second of every live stream since the last call, shown next to the status bar messages
+        """
+        now = time.monotonic()
+        elapsed, self._rate_time = now - self._rate_time, now
+        rates = []
+        for name, stream in self.live_streams.items():
+            rate = (stream.n_samples - self._rate_samples.get(name, 0)) / elapsed
+            self._rate_samples[name] = stream.n_samples
+            rates.append(f'{name}: {rate / 1e3:.1f} kS/s')
+            fetcher = self.fetcher_threads.get(name)
+            if fetcher is not None and fetcher.sizer is not None:
+                rates[-1] += f' ({fetcher.sizer.size} B reads, {fetcher.sizer.latency * 1e3:.0f} ms)'
+
+        if self.render_scheduler.timer.isActive():
+            rates.append(self.render_scheduler.stats())
+        if self.trigger is not None:
+            rates.append(f'trigger {self.trigger.stats()}')
+        if self.publisher is not None:
+            rates.append(f'publisher {self.publisher.stats()}')
+
+        # payload, frames lost and crc errors of every serial port, the usb readers have no decoder
+        readers = {reader.name: reader for reader in self._serial_readers() if hasattr(reader, 'decoder')}
+        for name in set(self._link_monitors) - set(readers):
+            del self._link_monitors[name]
+        for name, reader in readers.items():
+            monitor = self._link_monitors.get(name)
+            if monitor is None or monitor.decoder is not reader.decoder:
+                monitor = self._link_monitors[name] = LinkMonitor(reader.decoder)
+            rates.append(f'{name}: {monitor.report()}')
+        self.rate_label.setText(' | '.join(rates))
+
+    def _show_measurements(self):
+        lines = [f'{name}: {measurements.report()}' for name, measurements in self._measurements.items()]
+        if lines and self._spectrum is not None:
+            lines[0] += f'  {format_spectral_metrics(spectral_metrics(*self._spectrum))}'
+        self.measurements_label.setText('\n'.join(lines))
+
+    def _update_spectrum(self, result):
+        self._spectrum = result
+        freqs, magnitude = result
+        self._line_freq.set_data(freqs, magnitude)
+        self._freq_blit.blit()
+
+    def _show_live_window(self):
+        """
+        leave a recording and go back to the live sliding window
+        """
+        self._stop_playback()
+        self.reader = None
+        self.pyramid = None
+        self.play_button.setEnabled(bool(self.live_streams))
+        for mark in self._trigger_marks:
+            mark.set_visible(True)
+        self._time_ax.set_xlim(self._live_time_xlim())
+        self._time_ax.figure.canvas.draw()
+        self._freq_ax.set_xlim(0, self.filter_chain.output_rate / 2)
+        self._freq_ax.figure.canvas.draw()
+
+    def _on_time_xlim_changed(self, _ax):
+        if self.reader is not None:
+            self._recording_timer.start()
+
+    def _pyramid_ready(self, result):
+        reader, pyramid = result
+        if reader is self.reader:
+            self.pyramid = pyramid
+            self._load_visible_window()
+
+    def _plot_points(self):
+        """
+        about two points per horizontal pixel of the time plot, more would not be visible
+        """
+        return max(int(2 * self._time_ax.bbox.width), 2)
+
+    def _visible_samples(self):
+        x_min, x_max = self._time_ax.get_xlim()
+        start = min(max(int(x_min * self.reader.sample_rate), 0), self.reader.n_samples)
+        stop = min(max(int(np.ceil(x_max * self.reader.sample_rate)) + 1, start), self.reader.n_samples)
+        return start, stop
+
+    def _load_visible_window(self):
+        """
+        plot the min/max envelope of the visible part of the recording, about two points per pixel.
+        Zoomed out it comes from the pyramid, zoomed in the samples are read and reduced
+        """
+        if self.reader is None:
+            return
+
+        start, stop = self._visible_samples()
+        n_points = self._plot_points()
+        envelope = self.pyramid.query(start, stop, n_points // 2) if self.pyramid is not None else None
+        if envelope is None and stop - start > MAX_RAW_READ:
+            # the pyramid is still being built, a strided read stands in until it is ready
+            step = -(-(stop - start) // n_points)
+            samples = self.reader.read(start, stop - start, step)
+            envelope = start + np.arange(len(samples)) * step, samples
+        elif envelope is None:
+            samples = self.reader.read(start, stop - start)
+            positions, values = decimate(samples[:, 0] if samples.ndim > 1 else samples, n_points,
+                                         self.param_dict['decimation'])
+            envelope = start + positions, values
+        positions, values = envelope
+        if values.ndim > 1:
+            values = values[:, 0]
+        self._line_t.set_data(positions / self.reader.sample_rate, values)
+        self._time_blit.blit()
+
+        # spectrum of fft_size samples at full rate around the centre of the window
+        engine = SpectralEngine(self.param_dict['fft_size'], self.reader.sample_rate)
+        frame = self.reader.read(max((start + stop - engine.n_fft) // 2, 0), engine.n_fft)
+        if frame.ndim > 1:
+            frame = frame[:, 0]
+        self._line_freq.set_data(engine.freqs, engine.process(frame))
+        self._freq_blit.blit()
 
 
 def apply_dark_theme():
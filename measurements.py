@@ -0,0 +1,189 @@
+"""
+measurements of the live streams for the panel under the plots
+
+RunningStats and RateEstimator take every block as it is drained, with a few numpy reductions per block and a fixed
+number of accumulators, nothing grows with the stream. The spectral metrics are computed from the magnitude spectrum
+the plot already has (Hann window, dsp.SpectralEngine), only when the panel is refreshed
+"""
+import numpy as np
+
+
+class RunningStats:
+    """
+    mean, rms, peak and crest factor of the samples since the last reset. Every block is reduced on its own (mean,
+    sum of squared deviations, min, max) and merged into the totals with Chan's formula, so long runs of float32
+    samples lose no precision
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n_samples = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+
+    def update(self, block: np.ndarray):
+        n_block = len(block)
+        if not n_block:
+            return
+        block_mean = float(block.mean(dtype=np.float64))
+        deviations = block - np.float32(block_mean)
+        block_m2 = float(np.dot(deviations, deviations))
+
+        n_total = self.n_samples + n_block
+        delta = block_mean - self.mean
+        self.mean += delta * n_block / n_total
+        self._m2 += block_m2 + delta * delta * self.n_samples * n_block / n_total
+        self.n_samples = n_total
+        self.minimum = min(self.minimum, float(block.min()))
+        self.maximum = max(self.maximum, float(block.max()))
+
+    @property
+    def std(self) -> float:
+        return np.sqrt(self._m2 / self.n_samples) if self.n_samples else 0.0
+
+    @property
+    def rms(self) -> float:
+        return np.sqrt(self._m2 / self.n_samples + self.mean ** 2) if self.n_samples else 0.0
+
+    @property
+    def peak(self) -> float:
+        return max(abs(self.minimum), abs(self.maximum)) if self.n_samples else 0.0
+
+    @property
+    def crest_factor(self) -> float:
+        rms = self.rms
+        return self.peak / rms if rms else 0.0
+
+
+class RateEstimator:
+    """
+    the real sample rate of a stream from the host time of its blocks: a least squares line through (samples so far,
+    host time at the end of the block), updated online. The jitter of single reads averages out, drift_ppm is how far
+    the board's clock is from the nominal rate
+    """
+
+    def __init__(self, nominal_rate: float):
+        self.nominal_rate = nominal_rate
+        self.reset()
+
+    def reset(self):
+        self.n_samples = 0
+        self.n_blocks = 0
+        self._first_time = None
+        self._mean_x = 0.0
+        self._mean_y = 0.0
+        self._m2_x = 0.0
+        self._c_xy = 0.0
+
+    def update(self, n_samples: int, end_time: float):
+        if self._first_time is None:
+            self._first_time = end_time
+        self.n_samples += n_samples
+        x, y = float(self.n_samples), end_time - self._first_time
+        self.n_blocks += 1
+        dx = x - self._mean_x
+        self._mean_x += dx / self.n_blocks
+        self._mean_y += (y - self._mean_y) / self.n_blocks
+        self._m2_x += dx * (x - self._mean_x)
+        self._c_xy += dx * (y - self._mean_y)
+
+    @property
+    def rate(self) -> float | None:
+        """
+        samples per second, None until a few blocks are in
+        """
+        if self.n_blocks < 8 or self._c_xy <= 0:
+            return None
+        return self._m2_x / self._c_xy
+
+    @property
+    def drift_ppm(self) -> float | None:
+        rate = self.rate
+        return None if rate is None else (rate / self.nominal_rate - 1) * 1e6
+
+
+def spectral_metrics(freqs: np.ndarray, magnitude: np.ndarray, n_harmonics: int = 5, half_width: int = 8,
+                     dc_bins: int = 3) -> dict:
+    """
+    dominant frequency, SNR and THD of a Hann windowed magnitude spectrum
+
+    the fundamental is the largest bin above the dc_bins, its frequency is refined by a parabola through the log
+    magnitudes around it. Its power is the sum over +- half_width bins, the main lobe of the window and enough of its
+    leakage skirt for an SNR up to about 55 dB, the same for harmonics 2..n_harmonics below Nyquist. SNR is the
+    fundamental against everything else but DC and the harmonics, THD the harmonics against the fundamental, in dB
+    """
+    power = magnitude.astype(np.float64) ** 2
+    n_bins = len(power)
+    if n_bins <= dc_bins + 2 or not power[dc_bins:].any():
+        return {}
+
+    bin_width = freqs[1] - freqs[0]
+    peak = dc_bins + int(np.argmax(power[dc_bins:]))
+    offset = 0.0
+    if peak < n_bins - 1:
+        a, b, c = np.log(magnitude[peak - 1:peak + 2].astype(np.float64) + 1e-30)
+        denominator = a - 2 * b + c
+        offset = 0.5 * (a - c) / denominator if denominator else 0.0
+    fundamental = (peak + offset) * bin_width
+
+    def band(center: int) -> slice:
+        return slice(max(center - half_width, dc_bins), min(center + half_width + 1, n_bins))
+
+    used = np.zeros(n_bins, dtype=bool)
+    used[:dc_bins] = True
+    signal_band = band(peak)
+    signal_power = power[signal_band].sum()
+    used[signal_band] = True
+
+    harmonic_power = 0.0
+    for harmonic in range(2, n_harmonics + 1):
+        center = int(round(harmonic * fundamental / bin_width))
+        if center + half_width >= n_bins:
+            break
+        harmonic_band = band(center)
+        harmonic_power += power[harmonic_band][~used[harmonic_band]].sum()
+        used[harmonic_band] = True
+
+    noise_power = power[~used].sum()
+    return {
+        'frequency': fundamental,
+        'snr_db': 10 * np.log10(signal_power / noise_power) if noise_power else np.inf,
+        'thd_db': 10 * np.log10(harmonic_power / signal_power) if harmonic_power else -np.inf,
+    }
+
+
+class StreamMeasurements:
+    """
+    the panel line of one stream: RunningStats over the last refresh interval, the rate over the whole stream
+    """
+
+    def __init__(self, nominal_rate: float):
+        self.stats = RunningStats()
+        self.rate = RateEstimator(nominal_rate)
+
+    def update(self, samples: np.ndarray, end_time: float):
+        self.stats.update(samples)
+        self.rate.update(len(samples), end_time)
+
+    def report(self) -> str:
+        """
+        the line of the panel, starts the next interval
+        """
+        stats = self.stats
+        line = (f'mean {stats.mean:+.4g}  rms {stats.rms:.4g}  peak {stats.peak:.4g}  '
+                f'crest {stats.crest_factor:.2f}')
+        if self.rate.rate is not None:
+            line += f'  rate {self.rate.rate:.1f} Hz ({self.rate.drift_ppm:+.0f} ppm)'
+        stats.reset()
+        return line
+
+
+def format_spectral_metrics(metrics: dict) -> str:
+    if not metrics:
+        return ''
+    return (f'f0 {metrics["frequency"]:.2f} Hz  SNR {metrics["snr_db"]:.1f} dB  '
+            f'THD {metrics["thd_db"]:.1f} dB')
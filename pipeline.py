@@ -0,0 +1,338 @@
+"""
+multiprocess capture pipeline for high baud rates, the GIL of the GUI process is not shared with reading and decoding
+
+per port:
+reader process: serial port -> byte ring, adaptive read sizes like SerialCapture
+decoder process: byte ring -> decoder of the frame schema -> filters -> sample ring, plus the spectrum of the newest
+samples (of the first channel) at the plot rate
+
+the rings and the spectrum live in multiprocessing.shared_memory, nothing is pickled on the way. The GUI process
+only copies new samples out of the sample ring and draws.
+
+the processes never fork the GUI process, that would copy its Qt and audio threads in a state they can not continue
+from. They fork from a forkserver that imported the entry script and this module once, so a port starts without
+importing scipy again; Windows has no forkserver and spawns. Everything handed to them is pickled once at the start,
+so the entry scripts keep their `if __name__ == '__main__'` guard.
+"""
+import multiprocessing as mp
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from capture import AdaptiveReadSizer
+from dsp import SpectralEngine
+from filters import FilterChain
+from frames import SCHEMAS
+from utility import RingBuffer, channel_blocks
+
+_CONTEXT = mp.get_context('forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn')
+if _CONTEXT.get_start_method() == 'forkserver':
+    _CONTEXT.set_forkserver_preload(['__main__', __name__])
+
+
+class SharedRing:
+    """
+    single producer, single consumer ring buffer in shared memory
+
+    the producer copies the data in and then advances the write counter, the consumer copies out and advances the
+    read counter, so neither needs a lock. When the ring is full the producer drops what does not fit and counts it.
+    end_time is the time.monotonic() right after the newest item, written by the producer. With channels > 1 an item
+    is a row of one sample per channel
+    """
+    _HEADER_SIZE = 64
+
+    def __init__(self, capacity: int, dtype=np.float32, name: str | None = None, channels: int = 1):
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True,
+                                                   size=self._HEADER_SIZE + capacity * channels * self.dtype.itemsize)
+            self._owner = True
+        else:
+            # the pipeline processes are started by the creator and share its resource tracker, attaching is safe
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+
+        # written, read, dropped
+        self._counters = np.ndarray(3, dtype=np.int64, buffer=self._shm.buf)
+        self._end_time = np.ndarray(1, dtype=np.float64, buffer=self._shm.buf, offset=32)
+        shape = (capacity,) if channels == 1 else (capacity, channels)
+        self._data = np.ndarray(shape, dtype=self.dtype, buffer=self._shm.buf, offset=self._HEADER_SIZE)
+        if self._owner:
+            self._counters[:] = 0
+            self._end_time[0] = 0
+
+    def spec(self) -> tuple:
+        """
+        what another process needs to attach: SharedRing(*ring.spec())
+        """
+        return self.capacity, self.dtype.str, self._shm.name, self.channels
+
+    @property
+    def dropped(self) -> int:
+        return int(self._counters[2])
+
+    @property
+    def end_time(self) -> float:
+        return float(self._end_time[0])
+
+    def __len__(self):
+        return int(self._counters[0] - self._counters[1])
+
+    def write(self, items: np.ndarray, end_time: float | None = None) -> int:
+        written, read = int(self._counters[0]), int(self._counters[1])
+        n_items = min(len(items), self.capacity - (written - read))
+        if n_items < len(items):
+            self._counters[2] += len(items) - n_items
+
+        start = written % self.capacity
+        first = min(n_items, self.capacity - start)
+        self._data[start:start + first] = items[:first]
+        self._data[:n_items - first] = items[first:n_items]
+        if end_time is not None:
+            self._end_time[0] = end_time
+        # publish only after the data is in place
+        self._counters[0] = written + n_items
+        return n_items
+
+    def read(self, max_items: int | None = None) -> np.ndarray:
+        """
+        copy of everything written since the last read (at most max_items), oldest first
+        """
+        written, read = int(self._counters[0]), int(self._counters[1])
+        n_items = written - read if max_items is None else min(written - read, max_items)
+        start = read % self.capacity
+        first = min(n_items, self.capacity - start)
+        items = np.concatenate((self._data[start:start + first], self._data[:n_items - first]))
+        self._counters[1] = read + n_items
+        return items
+
+    def close(self):
+        # the arrays point into the mapping, let go of them before closing it
+        self._counters = self._end_time = self._data = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class SharedSpectrum:
+    """
+    latest magnitude spectrum in shared memory, guarded by a sequence counter: odd while the producer writes, the
+    reader retries later if it changed while copying
+    """
+
+    def __init__(self, n_bins: int, name: str | None = None):
+        self.n_bins = n_bins
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=8 + n_bins * 8)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self._sequence = np.ndarray(1, dtype=np.int64, buffer=self._shm.buf)
+        self._magnitude = np.ndarray(n_bins, dtype=np.float64, buffer=self._shm.buf, offset=8)
+        if self._owner:
+            self._sequence[0] = 0
+        self._last_read = 0
+
+    def spec(self) -> tuple:
+        return self.n_bins, self._shm.name
+
+    def publish(self, magnitude: np.ndarray):
+        self._sequence[0] += 1
+        self._magnitude[:] = magnitude
+        self._sequence[0] += 1
+
+    def read(self) -> np.ndarray | None:
+        """
+        a copy of the spectrum if a new one was published since the last read, else None
+        """
+        sequence = int(self._sequence[0])
+        if sequence == self._last_read or sequence % 2:
+            return None
+        magnitude = self._magnitude.copy()
+        if int(self._sequence[0]) != sequence:
+            return None
+        self._last_read = sequence
+        return magnitude
+
+    def close(self):
+        self._sequence = self._magnitude = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+# slots of the per port stats array
+(STAT_BYTES, STAT_READS, STAT_READ_SIZE, STAT_RESYNC_BYTES, STAT_SAMPLES, STAT_DECODED_BYTES, STAT_PAYLOAD_BYTES,
+ STAT_FRAMES, STAT_FRAMES_LOST, STAT_CRC_FAILURES) = range(10)
+
+
+def _reader_main(open_handle, byte_ring_spec: tuple, stop, stats, target_latency: float):
+    handle = open_handle()
+    byte_ring = SharedRing(*byte_ring_spec)
+    sizer = AdaptiveReadSizer(target_latency)
+    try:
+        while not stop.is_set():
+            byte_packet = handle.read(sizer.next_size(handle.in_waiting))
+            sizer.update(len(byte_packet))
+            if byte_packet:
+                byte_ring.write(np.frombuffer(byte_packet, dtype=np.uint8), time.monotonic())
+            stats[STAT_BYTES] += len(byte_packet)
+            stats[STAT_READS] += 1
+            stats[STAT_READ_SIZE] = sizer.size
+    except KeyboardInterrupt:
+        pass
+    finally:
+        handle.close()
+        byte_ring.close()
+
+
+def _decoder_main(byte_ring_spec: tuple, sample_ring_spec: tuple, spectrum_spec: tuple, stop, stats,
+                  sample_rate: float, n_fft: int, averaging: str, spectrum_interval: float, poll_interval: float,
+                  schema, filters, max_read: int = 1 << 20):
+    byte_ring = SharedRing(*byte_ring_spec)
+    sample_ring = SharedRing(*sample_ring_spec)
+    spectrum = SharedSpectrum(*spectrum_spec)
+    decoder = schema.decoder()
+    engine = SpectralEngine(n_fft, sample_rate, averaging=averaging)
+    history = RingBuffer(n_fft)
+    next_spectrum = time.perf_counter()
+    try:
+        # whatever the reader left in the ring is still decoded after the stop
+        while not stop.is_set() or len(byte_ring):
+            byte_packet = byte_ring.read(max_read)
+            if not len(byte_packet):
+                time.sleep(poll_interval)
+                continue
+
+            samples = filters.process(decoder.feed(byte_packet))
+            sample_ring.write(samples, byte_ring.end_time)
+            history.write(samples if samples.ndim == 1 else samples[:, 0])
+            stats[STAT_RESYNC_BYTES] = decoder.resync_bytes
+            stats[STAT_SAMPLES] = decoder.n_samples
+            stats[STAT_DECODED_BYTES] = decoder.n_bytes
+            stats[STAT_PAYLOAD_BYTES] = decoder.payload_bytes
+            # only frame schemas have these
+            stats[STAT_FRAMES] = getattr(decoder, 'n_frames', 0)
+            stats[STAT_FRAMES_LOST] = getattr(decoder, 'frames_lost', 0)
+            stats[STAT_CRC_FAILURES] = getattr(decoder, 'crc_failures', 0)
+
+            now = time.perf_counter()
+            if now >= next_spectrum:
+                spectrum.publish(engine.process(history.view()))
+                next_spectrum = now + spectrum_interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        byte_ring.close()
+        sample_ring.close()
+        spectrum.close()
+
+
+class _DecoderCounters:
+    """
+    the counters of the decoder process read from the stats array, with the attributes of a decoder for LinkMonitor
+    """
+
+    def __init__(self, stats, framed: bool):
+        self._stats = stats
+        self.framed = framed
+
+    @property
+    def n_bytes(self) -> int:
+        return self._stats[STAT_DECODED_BYTES]
+
+    @property
+    def payload_bytes(self) -> int:
+        return self._stats[STAT_PAYLOAD_BYTES]
+
+    def stats(self) -> str:
+        if not self.framed:
+            return f'{self._stats[STAT_SAMPLES]} samples, resync bytes: {self._stats[STAT_RESYNC_BYTES]}'
+        return (f'frames ok: {self._stats[STAT_FRAMES]}, lost: {self._stats[STAT_FRAMES_LOST]}, '
+                f'crc errors: {self._stats[STAT_CRC_FAILURES]}, resync bytes: {self._stats[STAT_RESYNC_BYTES]}')
+
+
+class _SampleRingQueue:
+    """
+    get_all() of a BlockQueue on top of a sample ring, so the GUI drains a pipeline like any other capture
+    """
+
+    def __init__(self, ring: SharedRing, name: str, sample_rate: float, channels: tuple):
+        self.ring = ring
+        self.name = name
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    def get_all(self) -> list:
+        end_time = self.ring.end_time
+        samples = self.ring.read()
+        if not len(samples):
+            return []
+        return channel_blocks(self.name, end_time - len(samples) / self.sample_rate, samples, self.channels)
+
+
+class PipelinePort:
+    """
+    reader and decoder process of one port and the shared memory between them and this process
+
+    open_handle is a picklable callable returning an open serial handle in the reader process, e.g.
+    functools.partial(serial.serial_for_url, 'COM8', baudrate=12_000_000, timeout=0.1). Use a short timeout, the
+    reader notices a stop only between reads. schema is the FrameSchema of the board, legacy by default. filters (a
+    FilterChain) run in the decoder process, the queue and the spectrum are at its output rate
+    """
+
+    def __init__(self, open_handle, name: str, sample_rate: float, n_fft: int = 4096, averaging: str = 'welch',
+                 target_latency: float = 0.01, spectrum_fps: float = 30, byte_capacity: int = 1 << 24,
+                 sample_capacity: int = 1 << 22, poll_interval: float = 0.001, schema=None, filters=None):
+        schema = schema or SCHEMAS['legacy']
+        filters = filters or FilterChain([], sample_rate)
+        sample_rate = filters.output_rate
+        self.name = name
+        self.sample_rate = sample_rate
+        self.byte_ring = SharedRing(byte_capacity, np.uint8)
+        self.sample_ring = SharedRing(sample_capacity, np.float32, channels=len(schema.channels))
+        self.freqs = np.fft.rfftfreq(n_fft, 1 / sample_rate)
+        self._spectrum = SharedSpectrum(len(self.freqs))
+        self.queue = _SampleRingQueue(self.sample_ring, name, sample_rate, schema.channels)
+        self.stats_array = _CONTEXT.Array('q', 10, lock=False)
+        self.decoder = _DecoderCounters(self.stats_array, schema.payload != 'stream')
+        self._stop = _CONTEXT.Event()
+
+        self.processes = [
+            _CONTEXT.Process(target=_reader_main, name=f'{name} reader', daemon=True,
+                             args=(open_handle, self.byte_ring.spec(), self._stop, self.stats_array, target_latency)),
+            _CONTEXT.Process(target=_decoder_main, name=f'{name} decoder', daemon=True,
+                             args=(self.byte_ring.spec(), self.sample_ring.spec(), self._spectrum.spec(), self._stop,
+                                   self.stats_array, sample_rate, n_fft, averaging, 1 / spectrum_fps, poll_interval,
+                                   schema, filters)),
+        ]
+        for process in self.processes:
+            process.start()
+
+    def spectrum(self):
+        """
+        (freqs, magnitude) of the newest samples if the decoder published a new one since the last call, else None
+        """
+        magnitude = self._spectrum.read()
+        return None if magnitude is None else (self.freqs, magnitude)
+
+    def stats(self) -> str:
+        return (f'{self.name}: {self.stats_array[STAT_BYTES] / 1e6:.2f} MB in {self.stats_array[STAT_READS]} reads '
+                f'(last {self.stats_array[STAT_READ_SIZE]} B), {self.decoder.stats()}, '
+                f'dropped bytes: {self.byte_ring.dropped}, dropped samples: {self.sample_ring.dropped}')
+
+    def stop(self, timeout: float = 2):
+        self._stop.set()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        print(f'pipeline stopped, {self.stats()}')
+        self.byte_ring.close()
+        self.sample_ring.close()
+        self._spectrum.close()
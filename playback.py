@@ -0,0 +1,270 @@
+"""
+audio playback through a callback sounddevice OutputStream: the audio thread pulls float32 blocks from a source when
+the sound card needs them, the GUI only starts, pauses and seeks and never waits for the device
+
+sources:
+RecordingSource: a range of a recording (CaptureReader / RawCaptureReader), decoded ahead of the playback position
+by a thread of its own
+LiveSource: the newest samples of a live stream, written as blocks arrive, for monitoring
+
+a source hands out samples at the device rate: PlaybackEngine calls prepare(device rate) and the source resamples
+where its samples come in (the read ahead thread, the thread that drains the capture queue). The audio callback only
+copies out of the source's preallocated ring with read_into(), it never reads the file, decodes or resamples
+"""
+import threading
+
+import numpy as np
+
+from dsp import StreamResampler
+from utility import RingBuffer
+
+
+class RecordingSource:
+    """
+    samples [start, stop) of a recording, the first channel only
+
+    prepare() starts a thread that walks through the recording with reader.blocks() (one decoder for a raw file),
+    resamples to the output rate and keeps up to read_ahead seconds in a ring, read_into() from the audio callback
+    copies out of it. A seek starts a new ring at the new position, whatever the thread decoded for the old one is
+    thrown away. close() ends the thread
+    """
+    seekable = True
+
+    def __init__(self, reader, start: int = 0, stop: int | None = None, read_ahead: float = 1.0):
+        self.reader = reader
+        self.sample_rate = reader.sample_rate
+        self.start = start
+        self.stop = reader.n_samples if stop is None else min(stop, reader.n_samples)
+        self.block = max(int(read_ahead * self.sample_rate) // 4, 256)
+        self.output_rate = self.sample_rate
+        self._step = 1.0  # source samples per output sample
+        self._block_out = self.block
+        self._ring = RingBuffer(4 * self.block)
+        self._consumed = 0  # n_written of the ring at the playback position
+        self._seek_to = start
+        self._exhausted = False  # the thread reached stop for the current ring
+        self._closed = False
+        self._wake = threading.Condition()
+        self._thread = None
+
+    def prepare(self, output_rate: float):
+        """
+        start filling the ring at output_rate, before the first read
+        """
+        self.output_rate = output_rate
+        self._step = self.sample_rate / output_rate
+        # the most a resampled block can grow to
+        self._block_out = int(self.block / self._step) + 2
+        self._ring = RingBuffer(4 * self._block_out)
+        self._thread = threading.Thread(target=self._decode_ahead, name='playback read ahead', daemon=True)
+        self._thread.start()
+
+    @property
+    def position(self) -> int:
+        """
+        sample of the recording that plays next
+        """
+        return min(self._seek_to + int(self._consumed * self._step), self.stop)
+
+    @property
+    def at_end(self) -> bool:
+        return self._exhausted and self._ring.n_written == self._consumed
+
+    def seek(self, position: int):
+        with self._wake:
+            self._seek_to = min(max(position, self.start), self.stop)
+            self._ring = RingBuffer(self._ring.capacity)
+            self._consumed = 0
+            self._exhausted = False
+            self._wake.notify()
+
+    def read_into(self, out: np.ndarray) -> int:
+        """
+        copy the next samples into out, returns how many there were
+        """
+        with self._wake:
+            n_samples, self._consumed = self._ring.read_into(self._consumed, out)
+            self._wake.notify()
+        return n_samples
+
+    def read(self, n_samples: int) -> np.ndarray:
+        out = np.empty(n_samples, dtype=np.float32)
+        return out[:self.read_into(out)]
+
+    def close(self):
+        with self._wake:
+            self._closed = True
+            self._wake.notify()
+
+    def _ring_full(self) -> bool:
+        # no room for another resampled block next to what was not played yet
+        return self._ring.n_written - self._consumed > self._ring.capacity - self._block_out
+
+    def _decode_ahead(self):
+        resampler = StreamResampler(self.sample_rate, self.output_rate)
+        blocks = ring = None
+        while True:
+            with self._wake:
+                while not self._closed and ring is self._ring and (blocks is None or self._ring_full()):
+                    self._wake.wait()
+                if self._closed:
+                    return
+                if ring is not self._ring:
+                    # started or seeked
+                    ring = self._ring
+                    blocks = self.reader.blocks(self._seek_to, self.stop, self.block)
+                    resampler.reset()
+
+            # decoding, file access and resampling happen outside the lock, the callback never waits for them
+            samples = next(blocks, None)
+            if samples is not None:
+                samples = resampler.process(samples[:, 0] if samples.ndim > 1 else samples)
+            with self._wake:
+                if ring is not self._ring:
+                    continue
+                if samples is None:
+                    self._exhausted = True
+                    blocks = None
+                else:
+                    ring.write(samples)
+
+
+class LiveSource:
+    """
+    the newest samples of a live stream: write() from the thread that drains the capture queue, read_into() from the
+    audio callback. write() resamples to the output rate of prepare(), what was written before it is not played.
+    The ring, the read position and skipped are changed under _lock on both sides, held for a copy at most
+
+    playback starts once target_lag seconds are buffered and again after every underrun. A reader more than max_lag
+    behind (the sound card clock is a little slower than the stream's) skips ahead to target_lag, so the monitor
+    never drifts away from real time. skipped counts output samples
+    """
+    seekable = False
+    at_end = False
+
+    def __init__(self, sample_rate: float, target_lag: float = 0.05, max_lag: float = 0.25):
+        self.sample_rate = sample_rate
+        self.target_lag_seconds = target_lag
+        self.max_lag_seconds = max_lag
+        self._lock = threading.Lock()
+        self.prepare(sample_rate)
+
+    def prepare(self, output_rate: float):
+        with self._lock:
+            self.output_rate = output_rate
+            self.target_lag = int(self.target_lag_seconds * output_rate)
+            self.max_lag = int(self.max_lag_seconds * output_rate)
+            self.ring = RingBuffer(max(2 * self.max_lag, 1))
+            self.skipped = 0
+            self._position = 0
+            self._primed = False
+            self._resampler = StreamResampler(self.sample_rate, output_rate)
+
+    def write(self, samples: np.ndarray):
+        # only the writing thread uses the resampler, it runs outside the lock
+        samples = self._resampler.process(samples)
+        with self._lock:
+            self.ring.write(samples)
+
+    def seek(self, position: int):
+        pass
+
+    def close(self):
+        pass
+
+    def read_into(self, out: np.ndarray) -> int:
+        with self._lock:
+            lag = self.ring.n_written - self._position
+            if lag > self.max_lag:
+                self.skipped += lag - self.target_lag
+                self._position = self.ring.n_written - self.target_lag
+            elif not self._primed and lag < self.target_lag:
+                return 0
+
+            n_samples, self._position = self.ring.read_into(self._position, out)
+            self._primed = n_samples == len(out)
+        return n_samples
+
+    def read(self, n_samples: int) -> np.ndarray:
+        out = np.empty(n_samples, dtype=np.float32)
+        return out[:self.read_into(out)]
+
+
+class PlaybackEngine:
+    """
+    plays a source on a mono float32 OutputStream
+
+    the source is played at its own rate if the device supports it, else at the device's default rate, the source
+    resamples to it. pause() keeps the stream open and writes silence, seek() takes effect with the next block.
+    finished() is called from the audio thread when the stream ended, at the end of a recording or after stop()
+    """
+
+    def __init__(self, source, device: str | int | None = None, blocksize: int = 0, latency: str = 'high'):
+        # imported here so UART only captures do not need PortAudio
+        import sounddevice as sd
+
+        self.source = source
+        self.device = device
+        self.device_rate = self._device_rate(sd, device, source.sample_rate)
+        self.paused = True
+        self.underruns = 0
+        self._callback_stop = sd.CallbackStop
+        source.prepare(self.device_rate)
+        self.stream = sd.OutputStream(device=device, samplerate=self.device_rate, blocksize=blocksize,
+                                      dtype='float32', latency=latency, channels=1, callback=self.callback,
+                                      finished_callback=self._stream_finished)
+
+    @staticmethod
+    def _device_rate(sd, device, sample_rate: float) -> float:
+        try:
+            sd.check_output_settings(device=device, samplerate=sample_rate, channels=1, dtype='float32')
+            return sample_rate
+        except Exception:
+            return sd.query_devices(device, 'output')['default_samplerate']
+
+    @property
+    def position(self) -> float:
+        """
+        seconds into the source of the next sample handed to the device
+        """
+        return self.source.position / self.source.sample_rate if self.source.seekable else 0.0
+
+    def callback(self, outdata, frames, time, status):
+        if status.output_underflow:
+            self.underruns += 1
+        if self.paused:
+            outdata.fill(0)
+            return
+
+        n_samples = self.source.read_into(outdata[:, 0])
+        outdata[n_samples:] = 0
+        if n_samples < frames:
+            if self.source.at_end:
+                raise self._callback_stop
+            self.underruns += 1
+
+    def play(self):
+        self.paused = False
+        if not self.stream.active:
+            self.stream.start()
+
+    def pause(self):
+        self.paused = True
+
+    def seek(self, position: int):
+        """
+        continue at sample `position` of the source
+        """
+        self.source.seek(position)
+
+    def stop(self):
+        self.stream.abort()
+        self.stream.close()
+        self.source.close()
+
+    def _stream_finished(self):
+        self.source.close()
+        self.finished()
+
+    def finished(self):
+        pass
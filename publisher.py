@@ -0,0 +1,187 @@
+"""
+fan-out of the decoded sample blocks to local subscribers (analysis scripts, notebooks) over a unix domain socket or
+TCP, while the app holds the port
+
+    unix:/tmp/serial.sock     unix domain socket (posix)
+    tcp:5555                  TCP on 127.0.0.1:5555, tcp:host:port for another interface
+
+every block goes out as one message:
+
+    header (BLOCK_HEADER) | stream name (utf-8) | samples (float32, n_samples x channels, little endian)
+
+the header is built once per block and the samples are sent straight from the block's buffer with sendmsg, the same
+buffers for every subscriber. Sockets are non blocking: a subscriber whose socket buffer is full misses the block (the
+sequence number of the stream shows the gap), one that misses max_skipped blocks in a row is dropped. send_buffer
+bounds the socket buffer of a subscriber, so a slow one is skipped instead of falling seconds behind. Capture never
+waits for a subscriber. See publisher_client.py for the reading side
+"""
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+
+# magic, version, dtype (0: float32), channels, samples, name length, wall clock time of the first sample, sequence
+BLOCK_HEADER = struct.Struct('<4sBBHIIdQ')
+MAGIC = b'SMPL'
+VERSION = 1
+DTYPE_FLOAT32 = 0
+
+
+def parse_address(address: str) -> tuple:
+    """
+    (family, socket address) of 'unix:path', 'tcp:port', 'tcp:host:port' or a bare port number
+    """
+    kind, _, rest = address.partition(':')
+    if kind == 'unix':
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ValueError('unix domain sockets are not available here, use tcp:port')
+        return socket.AF_UNIX, rest
+    if kind == 'tcp':
+        host, _, port = rest.rpartition(':')
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    if kind.isdigit() and not rest:
+        return socket.AF_INET, ('127.0.0.1', int(kind))
+    raise ValueError(f"bad publish address '{address}', use unix:path or tcp:port")
+
+
+class _Subscriber:
+    def __init__(self, sock: socket.socket, peer: str):
+        self.sock = sock
+        self.peer = peer
+        self.sent_blocks = 0
+        self.skipped = 0
+        self.skipped_in_row = 0
+        # the unsent tail of a message after a partial send, the next blocks are skipped until it is out
+        self.pending = b''
+
+
+class Publisher:
+    """
+    accepts subscribers on a background thread, publish() sends a block to all of them from the caller's thread
+    """
+
+    def __init__(self, address: str, max_skipped: int = 256, send_buffer: int = 1 << 18):
+        self.address = address
+        self.max_skipped = max_skipped
+        self.send_buffer = send_buffer
+        self.family, self.sock_address = parse_address(address)
+        self.subscribers = []
+        self.n_dropped = 0
+        self._sequences = {}
+        # blocks carry time.monotonic(), subscribers get wall clock time
+        self._clock_offset = time.time() - time.monotonic()
+        self._lock = threading.Lock()
+        self._sendmsg = hasattr(socket.socket, 'sendmsg')
+
+        if self.family == socket.AF_UNIX and os.path.exists(self.sock_address):
+            # left over from an earlier run
+            os.unlink(self.sock_address)
+        self._server = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_INET:
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(self.sock_address)
+        self._server.listen()
+        self._server.setblocking(False)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._accept_loop, name=f'publisher {address}', daemon=True)
+        self._thread.start()
+        print(f'publishing sample blocks on {address}')
+
+    def _accept_loop(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._server, selectors.EVENT_READ)
+        while not self._closed.is_set():
+            if not selector.select(timeout=0.2):
+                continue
+            try:
+                sock, peer = self._server.accept()
+            except OSError:
+                continue
+            sock.setblocking(False)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+            if self.family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self.subscribers.append(_Subscriber(sock, str(peer) or 'unix'))
+            print(f'publisher: subscriber {peer or "on " + self.address} connected')
+        selector.close()
+
+    def _drop(self, subscriber: _Subscriber, reason: str):
+        subscriber.sock.close()
+        self.subscribers.remove(subscriber)
+        self.n_dropped += 1
+        print(f'publisher: dropped subscriber {subscriber.peer} ({reason}), it got {subscriber.sent_blocks} blocks, '
+              f'skipped {subscriber.skipped}')
+
+    def _send(self, subscriber: _Subscriber, buffers: list, size: int):
+        """
+        one message to one subscriber without blocking, returns False if it was skipped
+        """
+        if subscriber.pending:
+            sent = subscriber.sock.send(subscriber.pending)
+            subscriber.pending = subscriber.pending[sent:]
+            if subscriber.pending:
+                return False
+
+        sent = subscriber.sock.sendmsg(buffers) if self._sendmsg else subscriber.sock.send(b''.join(buffers))
+        if sent < size:
+            # the receiver must get whole messages, keep the rest (copied, only in this rare case)
+            subscriber.pending = b''.join(bytes(buffer) for buffer in buffers)[sent:]
+        return True
+
+    def publish(self, block):
+        """
+        send a SampleBlock to every subscriber, never waits for one
+        """
+        samples = np.ascontiguousarray(block.samples, dtype='<f4')
+        sequence = self._sequences.get(block.stream, 0)
+        self._sequences[block.stream] = sequence + 1
+        if not self.subscribers:
+            return
+
+        name = block.stream.encode()
+        channels = samples.shape[1] if samples.ndim > 1 else 1
+        header = BLOCK_HEADER.pack(MAGIC, VERSION, DTYPE_FLOAT32, channels, len(samples), len(name),
+                                   block.timestamp + self._clock_offset, sequence)
+        buffers = [header, name, memoryview(samples).cast('B')]
+        size = len(header) + len(name) + samples.nbytes
+
+        with self._lock:
+            for subscriber in list(self.subscribers):
+                try:
+                    delivered = self._send(subscriber, buffers, size)
+                except BlockingIOError:
+                    delivered = False
+                except OSError as e:
+                    self._drop(subscriber, f'{type(e).__name__}: {e}')
+                    continue
+
+                if delivered:
+                    subscriber.sent_blocks += 1
+                    subscriber.skipped_in_row = 0
+                else:
+                    subscriber.skipped += 1
+                    subscriber.skipped_in_row += 1
+                    if subscriber.skipped_in_row > self.max_skipped:
+                        self._drop(subscriber, f'{subscriber.skipped_in_row} blocks behind')
+
+    def stats(self) -> str:
+        with self._lock:
+            skipped = sum(subscriber.skipped for subscriber in self.subscribers)
+            return f'{len(self.subscribers)} subscribers, skipped blocks: {skipped}, dropped: {self.n_dropped}'
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+        with self._lock:
+            for subscriber in self.subscribers:
+                subscriber.sock.close()
+            self.subscribers = []
+        self._server.close()
+        if self.family == socket.AF_UNIX and os.path.exists(self.sock_address):
+            os.unlink(self.sock_address)
@@ -0,0 +1,105 @@
+"""
+reference subscriber of publisher.py: connects to the app (or headless.py) and yields the sample blocks it publishes
+
+    python publisher_client.py unix:/tmp/serial.sock
+    python publisher_client.py tcp:5555 --seconds 10
+
+prints the rate and the missed blocks of every stream once a second. In a script or notebook:
+
+    from publisher_client import Subscriber
+    for stream, timestamp, sequence, samples in Subscriber('tcp:5555'):
+        ...
+
+numpy is the only dependency, the file can be copied next to the analysis scripts together with publisher.py
+"""
+import argparse
+import socket
+import time
+
+import numpy as np
+
+from publisher import BLOCK_HEADER, DTYPE_FLOAT32, MAGIC, VERSION, parse_address
+
+
+class Subscriber:
+    """
+    iterating yields (stream, wall clock time of the first sample, sequence, samples) until the publisher closes.
+    missed counts the blocks of every stream the publisher skipped for this subscriber (gaps in the sequence)
+    """
+
+    def __init__(self, address: str, timeout: float | None = None):
+        family, sock_address = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(sock_address)
+        self.missed = {}
+        self._next_sequence = {}
+        self._header = bytearray(BLOCK_HEADER.size)
+
+    def _read_into(self, buffer) -> bool:
+        view = memoryview(buffer).cast('B')
+        while len(view):
+            n_bytes = self.sock.recv_into(view)
+            if not n_bytes:
+                return False
+            view = view[n_bytes:]
+        return True
+
+    def read_block(self):
+        """
+        the next block, None when the publisher closed the connection
+        """
+        if not self._read_into(self._header):
+            return None
+        magic, version, dtype, channels, n_samples, name_length, timestamp, sequence = \
+            BLOCK_HEADER.unpack(self._header)
+        if magic != MAGIC or version != VERSION or dtype != DTYPE_FLOAT32:
+            raise ValueError(f'not a sample block: {magic}, version {version}, dtype {dtype}')
+
+        name = bytearray(name_length)
+        samples = np.empty((n_samples, channels) if channels > 1 else n_samples, dtype='<f4')
+        if not (self._read_into(name) and self._read_into(samples)):
+            return None
+
+        stream = name.decode()
+        expected = self._next_sequence.get(stream, sequence)
+        self.missed[stream] = self.missed.get(stream, 0) + sequence - expected
+        self._next_sequence[stream] = sequence + 1
+        return stream, timestamp, sequence, samples
+
+    def __iter__(self):
+        while (block := self.read_block()) is not None:
+            yield block
+
+    def close(self):
+        self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('address', help='unix:path or tcp:port of the publisher')
+    parser.add_argument('--seconds', type=float, default=0, help='stop after this long, 0 = never')
+    args = parser.parse_args(argv)
+
+    subscriber = Subscriber(args.address)
+    counts = {}
+    start = last_report = time.monotonic()
+    try:
+        for stream, timestamp, sequence, samples in subscriber:
+            counts[stream] = counts.get(stream, 0) + len(samples)
+            now = time.monotonic()
+            if now - last_report >= 1:
+                print(', '.join(f'{name}: {count / (now - last_report) / 1e3:.1f} kS/s, '
+                                f'missed blocks: {subscriber.missed[name]}' for name, count in counts.items()))
+                counts = {}
+                last_report = now
+            if 0 < args.seconds <= now - start:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        subscriber.close()
+
+
+if __name__ == '__main__':
+    main()
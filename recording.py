@@ -0,0 +1,490 @@
+import argparse
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from utility import BlockQueue, StreamDecoder
+
+# writev takes at most IOV_MAX buffers per call (1024 on Linux and macOS)
+IOV_MAX = 1024
+
+# capture container, all little endian:
+# header | block 0 | block 1 | ... | block n-1 | index
+# every block holds block_samples frames of `channels` samples, the last one is zero padded. The index has one
+# (first sample, host time) entry per block and is written when the capture is closed.
+CAPTURE_MAGIC = b'SCAP'
+CAPTURE_EXTENSION = '.scap'
+CAPTURE_VERSION = 1
+CAPTURE_HEADER = struct.Struct('<4sHH d 8s H 8s d I Q Q Q')
+CAPTURE_INDEX_DTYPE = np.dtype([('sample', '<u8'), ('time', '<f8')])
+# the chunk index of a raw recording is cached in '<recording>.index.npz'
+INDEX_SUFFIX = '.index.npz'
+
+
+class RecordWriter:
+    """
+    streams byte blocks to a file from a background thread, so a recording can run for hours with constant memory
+
+    write() only queues the block; the writer thread collects everything queued since its last pass and hands it to
+    the OS in one os.writev call (one joined os.write where writev is not available, e.g. Windows). At most
+    buffer_bytes are held in memory, counted in bytes since the blocks of an adaptive read size vary from a few bytes
+    to 64 kB. A producer that outruns the disk waits in write(), a single block larger than the whole buffer is taken
+    once everything before it is written.
+
+    bytes_written: bytes already handed to the OS
+    write_seconds: time spent inside the write calls, bytes_written / write_seconds is the disk throughput
+    """
+
+    def __init__(self, path: str, buffer_bytes: int = 4 * 2 ** 20):
+        self.path = path
+        self.buffer_bytes = buffer_bytes
+        self.bytes_written = 0
+        self.write_seconds = 0.0
+        self.queued_bytes = 0
+        self.dropped_blocks = 0
+        # every block has at least one byte, so the byte bound is always hit before this one
+        self._queue = BlockQueue(maxsize=buffer_bytes, policy='drop_newest')
+        self._space = threading.Condition()
+        self._data_ready = threading.Event()
+        self._closing = False
+        self._error = None
+
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0))
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name=f'RecordWriter({path})', daemon=True)
+        self._thread.start()
+
+    def write(self, data: bytes, timeout: float | None = 5) -> bool:
+        """
+        queue a block for writing, returns False if the writer could not keep up within timeout
+        """
+        if self._error is not None:
+            raise self._error
+        if not data:
+            return True
+
+        with self._space:
+            if not self._space.wait_for(lambda: not self.queued_bytes
+                                        or self.queued_bytes + len(data) <= self.buffer_bytes, timeout):
+                self.dropped_blocks += 1
+                return False
+            self.queued_bytes += len(data)
+        self._queue.put(data)
+        self._data_ready.set()
+        return True
+
+    def close(self):
+        """
+        write everything still queued, flush it to the disk and close the file
+        """
+        self._closing = True
+        self._data_ready.set()
+        self._thread.join()
+        os.fsync(self._fd)
+        os.close(self._fd)
+        if self._error is not None:
+            raise self._error
+
+    def throughput(self) -> float:
+        """
+        sustained write rate in bytes per second since the file was opened
+        """
+        return self.bytes_written / max(time.perf_counter() - self._started, 1e-9)
+
+    def stats(self) -> str:
+        disk_rate = self.bytes_written / self.write_seconds if self.write_seconds else 0.0
+        return (f'written: {self.bytes_written / 1e6:.2f} MB, sustained: {self.throughput() / 1e6:.3f} MB/s, '
+                f'disk: {disk_rate / 1e6:.1f} MB/s, dropped blocks: {self.dropped_blocks}')
+
+    def _run(self):
+        while True:
+            self._data_ready.wait(timeout=0.5)
+            self._data_ready.clear()
+            blocks = self._queue.get_all()
+            if blocks:
+                n_bytes = sum(len(block) for block in blocks)
+                try:
+                    tic = time.perf_counter()
+                    _write_blocks(self._fd, blocks)
+                    self.write_seconds += time.perf_counter() - tic
+                    self.bytes_written += n_bytes
+                except OSError as e:
+                    self._error = e
+                    return
+                finally:
+                    with self._space:
+                        self.queued_bytes -= n_bytes
+                        self._space.notify_all()
+            elif self._closing:
+                return
+
+
+def _write_blocks(fd: int, blocks: list):
+    if not hasattr(os, 'writev'):
+        _write_all(fd, memoryview(b''.join(blocks)))
+        return
+
+    for i in range(0, len(blocks), IOV_MAX):
+        batch = blocks[i:i + IOV_MAX]
+        n_written = os.writev(fd, batch)
+        if n_written < sum(len(block) for block in batch):
+            # short write (disk full, signal), finish the rest the slow way
+            _write_all(fd, memoryview(b''.join(batch))[n_written:])
+
+
+def _write_all(fd: int, data: memoryview):
+    while len(data):
+        data = data[os.write(fd, data):]
+
+
+def is_capture_file(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC
+
+
+class CaptureWriter:
+    """
+    writes decoded samples into the indexed capture container, the blocks are streamed by a RecordWriter
+
+    sample_rate, dtype, channels, source ('UART', 'USB', ...) and the start time are stored in the header, so a
+    recording can be replayed without entering its settings again. Every block gets the host time of its first sample
+    in the index; when write() is not given a timestamp the time is derived from the sample rate. Without an explicit
+    start_time the capture starts at the timestamp of the first write.
+    """
+
+    def __init__(self, path: str, sample_rate: float, dtype='<f4', channels: int = 1, source: str = 'UART',
+                 block_samples: int = 4096, start_time: float | None = None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.channels = channels
+        self.source = source
+        self.block_samples = block_samples
+        self.start_time = time.time() if start_time is None else start_time
+        self._start_at_first_write = start_time is None
+        self.n_samples = 0
+
+        self._block = np.zeros((block_samples, channels), dtype=self.dtype)
+        self._block_fill = 0
+        self._block_time = None
+        self._index = []
+
+        self._writer = RecordWriter(path)
+        self._writer.write(self._pack_header(index_offset=0))
+
+    def _pack_header(self, index_offset: int) -> bytes:
+        return CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, CAPTURE_HEADER.size, self.sample_rate,
+                                   self.dtype.str.encode(), self.channels, self.source.encode(), self.start_time,
+                                   self.block_samples, index_offset, len(self._index), self.n_samples)
+
+    def write(self, samples: np.ndarray, timestamp: float | None = None):
+        """
+        append samples (shape (n,) or (n, channels)), timestamp is the host time.time() of the first one
+        """
+        samples = samples.reshape(len(samples), self.channels)
+        if self._start_at_first_write and timestamp is not None:
+            self.start_time = timestamp
+        self._start_at_first_write = False
+        if timestamp is None:
+            timestamp = self.start_time + self.n_samples / self.sample_rate
+
+        position = 0
+        while position < len(samples):
+            if self._block_fill == 0:
+                self._block_time = timestamp + position / self.sample_rate
+            n_copy = min(len(samples) - position, self.block_samples - self._block_fill)
+            self._block[self._block_fill:self._block_fill + n_copy] = samples[position:position + n_copy]
+            self._block_fill += n_copy
+            position += n_copy
+            if self._block_fill == self.block_samples:
+                self._flush_block()
+
+        self.n_samples += len(samples)
+
+    def _flush_block(self):
+        self._index.append((len(self._index) * self.block_samples, self._block_time - self.start_time))
+        self._writer.write(self._block.tobytes())
+        self._block_fill = 0
+
+    def close(self):
+        if self._block_fill:
+            self._block[self._block_fill:] = 0
+            self._flush_block()
+        self._writer.write(np.array(self._index, dtype=CAPTURE_INDEX_DTYPE).tobytes())
+        index_offset = CAPTURE_HEADER.size + len(self._index) * self._block.nbytes
+        self._writer.close()
+
+        # the header is rewritten last, a capture that was never closed still reads back through its blocks
+        with open(self.path, 'r+b') as f:
+            f.write(self._pack_header(index_offset))
+
+    def stats(self) -> str:
+        return self._writer.stats()
+
+
+class CaptureReader:
+    """
+    random access to a capture file: any sample or time range is found from the header and index without scanning
+
+    the samples are memory mapped, only the pages of the windows that are actually read are loaded. Captures that were
+    not closed properly (no index) are read up to their last complete block, with block times derived from the sample
+    rate
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(CAPTURE_HEADER.size)
+            if len(header) < CAPTURE_HEADER.size or not header.startswith(CAPTURE_MAGIC):
+                raise ValueError(f'{path} is not a capture file')
+
+            (_, self.version, header_size, self.sample_rate, dtype, self.channels, source, self.start_time,
+             self.block_samples, index_offset, n_blocks, n_samples) = CAPTURE_HEADER.unpack(header)
+            if self.version > CAPTURE_VERSION:
+                raise ValueError(f'{path} is capture format version {self.version}, this reader knows up to '
+                                 f'{CAPTURE_VERSION}')
+
+            self.dtype = np.dtype(dtype.rstrip(b'\0').decode())
+            self.source = source.rstrip(b'\0').decode()
+            self.data_offset = header_size
+            self.block_bytes = self.block_samples * self.channels * self.dtype.itemsize
+
+            if index_offset:
+                f.seek(index_offset)
+                self.index = np.frombuffer(f.read(n_blocks * CAPTURE_INDEX_DTYPE.itemsize), dtype=CAPTURE_INDEX_DTYPE)
+                self.n_samples = n_samples
+            else:
+                n_blocks = (os.fstat(f.fileno()).st_size - header_size) // self.block_bytes
+                self.index = np.zeros(n_blocks, dtype=CAPTURE_INDEX_DTYPE)
+                self.index['sample'] = np.arange(n_blocks) * self.block_samples
+                self.index['time'] = self.index['sample'] / self.sample_rate
+                self.n_samples = n_blocks * self.block_samples
+
+        if self.n_samples:
+            self._samples = np.memmap(path, dtype=self.dtype, mode='r', offset=self.data_offset,
+                                      shape=(self.n_samples, self.channels))
+        else:
+            self._samples = np.zeros((0, self.channels), dtype=self.dtype)
+
+    def close(self):
+        """
+        release the memory map and the file, the reader is empty afterwards
+        """
+        self._samples = np.zeros((0, self.channels), dtype=self.dtype)
+        self.n_samples = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def duration(self) -> float:
+        return self.n_samples / self.sample_rate
+
+    def read(self, start: int = 0, n_samples: int | None = None, step: int = 1) -> np.ndarray:
+        """
+        copy of every step-th sample in [start, start + n_samples), shape (n,) for one channel and (n, channels)
+        otherwise
+        """
+        start = min(max(start, 0), self.n_samples)
+        stop = self.n_samples if n_samples is None else min(start + n_samples, self.n_samples)
+        samples = np.array(self._samples[start:stop:step])
+        return samples[:, 0] if self.channels == 1 else samples
+
+    def sample_at(self, seconds: float) -> int:
+        """
+        index of the sample recorded at `seconds` after the start, from the block times in the index
+        """
+        if not len(self.index):
+            return 0
+        block = max(int(np.searchsorted(self.index['time'], seconds, side='right')) - 1, 0)
+        offset = int((seconds - self.index['time'][block]) * self.sample_rate)
+        return min(max(int(self.index['sample'][block]) + offset, 0), self.n_samples)
+
+    def read_time(self, t_start: float, t_stop: float) -> np.ndarray:
+        start = self.sample_at(t_start)
+        return self.read(start, self.sample_at(t_stop) - start)
+
+    def blocks(self, start: int = 0, stop: int | None = None, n_samples: int = 65536):
+        """
+        the samples of [start, stop) in consecutive blocks of at most n_samples, e.g. for playback
+        """
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        for position in range(max(start, 0), stop, n_samples):
+            yield self.read(position, min(n_samples, stop - position))
+
+
+class RawCaptureReader:
+    """
+    random access to an old raw UART recording through a memory map
+
+    raw files have no index, so one pass over the file (chunk by chunk, constant memory) notes for every chunk how many
+    samples came before it and where the decoder stood. A read then only decodes the chunks its window covers, exactly
+    the way the indexing pass did.
+
+    the pass takes seconds for a file of gigabytes: the GUI opens raw recordings on a pool thread (RecordingOpener)
+    and the chunk index is cached next to the file (INDEX_SUFFIX), so the next open of the same file skips the pass
+    """
+
+    source = 'UART raw'
+    channels = 1
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, path: str, sample_rate: float, chunk: int = 2 ** 20):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.chunk = chunk
+        self._bytes = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, np.uint8)
+        if not self._load_index():
+            self._build_index()
+            self._save_index()
+
+    def _index_key(self) -> np.ndarray:
+        """
+        what the cached index was built from, it is rebuilt if the file or the chunk size changed
+        """
+        status = os.stat(self.path)
+        return np.array([status.st_size, status.st_mtime_ns, self.chunk], dtype=np.int64)
+
+    def _build_index(self):
+        n_chunks = -(-len(self._bytes) // self.chunk)
+        self._chunk_samples = np.zeros(n_chunks, dtype=np.int64)
+        self._chunk_pending = np.zeros(n_chunks, dtype=np.int64)
+        self._chunk_synced = np.zeros(n_chunks, dtype=bool)
+        decoder = StreamDecoder()
+        for k in range(n_chunks):
+            self._chunk_samples[k] = decoder.n_samples
+            self._chunk_pending[k] = decoder.pending_bytes
+            self._chunk_synced[k] = decoder.synced
+            decoder.feed(self._bytes[k * self.chunk:(k + 1) * self.chunk])
+        self.n_samples = decoder.n_samples
+        self.resync_bytes = decoder.resync_bytes
+
+    def _load_index(self) -> bool:
+        try:
+            with np.load(self.path + INDEX_SUFFIX) as index:
+                if not np.array_equal(index['key'], self._index_key()):
+                    return False
+                self._chunk_samples = index['samples']
+                self._chunk_pending = index['pending']
+                self._chunk_synced = index['synced']
+                self.n_samples, self.resync_bytes = (int(value) for value in index['totals'])
+        except (OSError, KeyError, ValueError):
+            return False
+        return True
+
+    def _save_index(self):
+        # a read only directory just means the pass runs again next time
+        try:
+            with open(self.path + INDEX_SUFFIX, 'wb') as f:
+                np.savez(f, key=self._index_key(), samples=self._chunk_samples, pending=self._chunk_pending,
+                         synced=self._chunk_synced, totals=np.array([self.n_samples, self.resync_bytes]))
+        except OSError as e:
+            print(f'could not cache the index of {self.path}: {e}')
+
+    def close(self):
+        """
+        release the memory map and the file, the reader is empty afterwards
+        """
+        self._bytes = np.zeros(0, np.uint8)
+        self.n_samples = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def duration(self) -> float:
+        return self.n_samples / self.sample_rate
+
+    def read(self, start: int = 0, n_samples: int | None = None, step: int = 1) -> np.ndarray:
+        """
+        every step-th sample in [start, start + n_samples), decoded chunk by chunk
+        """
+        start = min(max(start, 0), self.n_samples)
+        stop = self.n_samples if n_samples is None else min(start + n_samples, self.n_samples)
+        samples = np.empty(-(-(stop - start) // step), dtype=np.float32)
+        n_filled = 0
+        for sample_position, block in self._decoded_chunks(start, stop):
+            # first sample of the block that is >= start and on the step grid
+            first = max(start - sample_position, 0)
+            first += -(sample_position + first - start) % step
+            selected = block[first:stop - sample_position:step]
+            samples[n_filled:n_filled + len(selected)] = selected
+            n_filled += len(selected)
+        return samples[:n_filled]
+
+    def blocks(self, start: int = 0, stop: int | None = None, n_samples: int = 65536):
+        """
+        the samples of [start, stop) in consecutive blocks of at most n_samples, e.g. for playback. One decoder runs
+        through the file, a read() per block would decode its chunk again from the beginning every time
+        """
+        start = min(max(start, 0), self.n_samples)
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        for sample_position, block in self._decoded_chunks(start, stop):
+            block = block[max(start - sample_position, 0):stop - sample_position]
+            for first in range(0, len(block), n_samples):
+                yield block[first:first + n_samples]
+
+    def _decoded_chunks(self, start: int, stop: int):
+        """
+        (index of the first sample, samples) of every chunk that holds samples of [start, stop)
+        """
+        if stop <= start:
+            return
+        # restart the decoder the way it was at the beginning of the chunk holding `start`
+        k = int(np.searchsorted(self._chunk_samples, start, side='right')) - 1
+        decoder = StreamDecoder()
+        decoder.synced = bool(self._chunk_synced[k])
+        sample_position = int(self._chunk_samples[k])
+        byte_position = k * self.chunk - int(self._chunk_pending[k])
+
+        while sample_position < stop:
+            block_end = (k + 1) * self.chunk
+            block = decoder.feed(self._bytes[byte_position:block_end])
+            k, byte_position = k + 1, block_end
+            yield sample_position, block
+            sample_position += len(block)
+
+
+def open_recording(path: str, sample_rate: float):
+    """
+    reader for a capture file or an old raw recording, sample_rate is only used for raw files
+    """
+    return CaptureReader(path) if is_capture_file(path) else RawCaptureReader(path, sample_rate)
+
+
+def convert_raw(raw_path: str, capture_path: str, sample_rate: float, source: str = 'UART',
+                chunk: int = 2 ** 20) -> CaptureReader:
+    """
+    turn an old raw UART recording (e.g. recorded_signal) into a capture file, the raw file is read in chunks
+    """
+    # raw files carry no time, estimate the start from the modification time and the size (4 bytes per sample)
+    start_time = os.path.getmtime(raw_path) - os.path.getsize(raw_path) / 4 / sample_rate
+    decoder = StreamDecoder()
+    writer = CaptureWriter(capture_path, sample_rate, source=source, start_time=start_time)
+    with open(raw_path, 'rb') as f:
+        while byte_packet := f.read(chunk):
+            writer.write(decoder.feed(byte_packet))
+    writer.close()
+
+    print(f'{raw_path} -> {capture_path}: {writer.n_samples} samples, {decoder.resync_bytes} bytes skipped')
+    return CaptureReader(capture_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert a raw UART recording into a capture file')
+    parser.add_argument('raw_path')
+    parser.add_argument('capture_path')
+    parser.add_argument('--sample-rate', type=float, required=True)
+    parser.add_argument('--source', default='UART')
+    args = parser.parse_args()
+
+    convert_raw(args.raw_path, args.capture_path, args.sample_rate, source=args.source)
@@ -0,0 +1,97 @@
+import time
+
+from PyQt6.QtCore import QObject, QTimer
+
+
+class BlitCanvas:
+    """
+    redraws only the given (animated) artists of a matplotlib canvas over a cached background
+
+    the background is grabbed again on every full draw (resize, zoom, limit changes through the toolbar), so the
+    axes, ticks and grid are rendered only when they actually change.
+    """
+
+    def __init__(self, canvas, artists):
+        self.canvas = canvas
+        self.artists = artists
+        self._background = None
+
+        for artist in self.artists:
+            artist.set_animated(True)
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _on_draw(self, _event):
+        self._background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for artist in self.artists:
+            artist.axes.draw_artist(artist)
+
+    def blit(self):
+        if self._background is None:
+            # nothing cached yet, a full draw fills the background through the draw_event
+            self.canvas.draw()
+            return
+
+        self.canvas.restore_region(self._background)
+        self._draw_artists()
+        self.canvas.blit(self.canvas.figure.bbox)
+
+
+class RenderScheduler(QObject):
+    """
+    calls render() from a QTimer at a fixed frame rate, independent of how fast packets arrive
+
+    has_new_data() is asked on every tick and the frame is skipped if nothing changed since the last one.
+    frames_rendered: frames actually drawn
+    frames_skipped: ticks without new data
+    frames_dropped: ticks lost because the GUI thread was busy for longer than one frame period
+    the counters start from 0 with every start(), stats() shows them
+    """
+
+    def __init__(self, fps: int, render, has_new_data, parent=None):
+        super().__init__(parent)
+        self.render = render
+        self.has_new_data = has_new_data
+        self.frames_rendered = 0
+        self.frames_skipped = 0
+        self.frames_dropped = 0
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self._tick)
+        self._last_tick = None
+        self.set_fps(fps)
+
+    def set_fps(self, fps: int):
+        self.fps = max(fps, 1)
+        self.timer.setInterval(int(1000 / self.fps))
+
+    def start(self):
+        self._last_tick = None
+        self.reset_counters()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def reset_counters(self):
+        self.frames_rendered = self.frames_skipped = self.frames_dropped = 0
+
+    def stats(self) -> str:
+        return (f'frames rendered: {self.frames_rendered}, dropped: {self.frames_dropped}, '
+                f'skipped: {self.frames_skipped}')
+
+    def _tick(self):
+        now = time.perf_counter()
+        if self._last_tick is not None:
+            missed = int((now - self._last_tick) * self.fps) - 1
+            self.frames_dropped += max(missed, 0)
+        self._last_tick = now
+
+        if not self.has_new_data():
+            self.frames_skipped += 1
+            return
+
+        self.render()
+        self.frames_rendered += 1
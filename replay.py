@@ -0,0 +1,426 @@
+"""
+replay of a recording (or a generated signal) into a virtual serial port, so the whole capture -> decode -> plot chain
+runs like with a board, on any Linux box and without hardware
+
+    python replay.py recorded_signal                       raw bytes as they were recorded, real time at 48 kHz
+    python replay.py run.scap --speed 4                    a capture file re-framed, 4 x its sample rate
+    python replay.py sine:1000 --speed 0                   a generated 1 kHz sine, as fast as the reader takes it
+    python replay.py run.scap --jitter-ms 2 --burst-every 1 --burst-ms 50 --corrupt 1e-5
+
+the default target is a pseudo terminal pair: the name of its slave side (/dev/pts/N) is printed, put it in the COM
+Ports setting or pass it to headless.py --port. Any pyserial url works as a target too, loop:// for a reader in the
+same process (Replayer.target.handle), but pyserial moves every byte of it through a queue.Queue, so it is only good
+for functional checks, not for throughput.
+
+sources:
+raw recording (any file that is not a capture) the bytes as they are, in the schema they were recorded with
+.scap capture                                   the decoded samples, framed again with --schema
+sine:f[:amplitude[:noise]]                      generated, framed with --schema, every channel gets the same signal
+
+pacing: real time is the sample rate (of the capture file, or --sample-rate), the samples that the decoder finds in the
+bytes written so far set the deadline of the next write. --baud paces by bytes instead, like a UART at that line rate.
+--speed multiplies the rate, 0 writes as fast as the reader takes it. What of a paced pty write does not fit into the
+pty buffer within OVERFLOW_WAIT (the reader is late or not connected) is lost like in the port buffer of a real UART
+and counted.
+
+--jitter-ms delays every write by a random half normal time, --burst-every / --burst-ms hold the writes back for a
+while now and then (a stalled USB bridge) and then write everything that was due at once, --corrupt flips random bytes
+with that probability per byte. The schedule stays the same, so the average rate does not change.
+
+every write is logged with its time.monotonic() and the number of samples written so far, sent_time() turns the
+sample count a reader received into the time the bytes of it hit the port, see benchmark.bench_replay. With corrupted
+bytes the reader loses samples and the latency comes out a bit too high
+"""
+import argparse
+import os
+import select
+import threading
+import time
+
+import numpy as np
+import serial
+
+from frames import FrameSchema, SCHEMAS, crc, load_schema
+from recording import CaptureReader, is_capture_file
+from utility import HEADER, RingBuffer
+
+# samples per channel of every frame of the legacy protocol, like the boards send them
+LEGACY_PACKET = 32
+# write log entries kept for sent_time(), at 1 kB writes and 12 Mbaud that is about a minute
+LOG_SIZE = 1 << 16
+# how long a paced write waits for a reader that is behind before the rest is lost
+OVERFLOW_WAIT = 0.02
+
+
+def encode_frames(schema: FrameSchema, rows: np.ndarray, sequence: int = 0) -> bytes:
+    """
+    the wire bytes of samples ((n,) or (n, channels), scaled like the decoder scales them) in schema's layout, the
+    inverse of its decoder. Legacy frames hold LEGACY_PACKET samples, the last one is shorter; fixed and length
+    prefixed frames hold frame_samples per channel, the last one is zero padded. The sequence field counts on from
+    `sequence`, the crc is filled in if the schema has one
+    """
+    rows = np.asarray(rows, dtype=np.float64)
+    if rows.ndim == 1:
+        rows = rows[:, None]
+    if rows.shape[1] != len(schema.channels):
+        raise ValueError(f'{rows.shape[1]} channels do not fit the schema {schema.name} with {len(schema.channels)}')
+    n_rows = len(rows)
+
+    if schema.payload == 'stream':
+        n_frames = -(-n_rows // LEGACY_PACKET)
+        samples = np.zeros((n_frames, LEGACY_PACKET), dtype='<f4')
+        samples.reshape(-1)[:n_rows] = rows[:, 0]
+        header = np.frombuffer(HEADER, dtype=np.uint8)
+        frames = np.hstack([np.tile(header, (n_frames, 1)), samples.view(np.uint8)])
+        # the padding of the last frame is cut off again, the decoder takes a blob of any length
+        return frames.tobytes()[:frames.size - (n_frames * LEGACY_PACKET - n_rows) * samples.itemsize]
+
+    n_frames = -(-n_rows // schema.frame_samples)
+    frames = np.zeros(n_frames, dtype=schema.frame_dtype)
+    frames['header']['sync'] = list(schema.sync)
+    if schema.length_field is not None:
+        frames['header'][schema.length_field] = schema.frame_samples
+    if schema.sequence_field is not None:
+        # the counter wraps at its size like on the board
+        field = schema.header_dtype[schema.sequence_field]
+        frames['header'][schema.sequence_field] = (sequence + np.arange(n_frames)) % (1 << 8 * field.itemsize)
+
+    values = np.zeros((n_frames * schema.frame_samples, len(schema.channels)))
+    values[:n_rows] = rows / schema.scale
+    if schema.sample_dtype.kind in 'iu':
+        limits = np.iinfo(schema.sample_dtype)
+        values = np.clip(np.rint(values), limits.min, limits.max)
+    for i, channel in enumerate(schema.channels):
+        frames['rows'][channel] = values[:, i].reshape(n_frames, schema.frame_samples)
+
+    if schema.crc is not None:
+        first = 0 if schema.crc_includes_sync else len(schema.sync)
+        covered = frames.view(np.uint8).reshape(n_frames, -1)[:, first:-schema.trailer_size]
+        frames['crc'] = crc(covered, schema.crc)
+    return frames.tobytes()
+
+
+def _frame_rows(schema: FrameSchema) -> int:
+    return LEGACY_PACKET if schema.payload == 'stream' else schema.frame_samples
+
+
+def raw_source(path: str, loop: bool = False, block: int = 1 << 16):
+    """
+    the bytes of a raw recording, read block by block so a recording of hours is never loaded at once
+    """
+    while True:
+        with open(path, 'rb') as f:
+            while data := f.read(block):
+                yield data
+        if not loop:
+            return
+
+
+def capture_source(reader: CaptureReader, schema: FrameSchema, loop: bool = False, block_samples: int = 4096):
+    """
+    the samples of a capture file, framed in schema's layout. Blocks are whole frames, so only the very last frame of
+    the file is padded
+    """
+    block_samples -= block_samples % _frame_rows(schema)
+    sequence = 0
+    while True:
+        for start in range(0, reader.n_samples, block_samples):
+            rows = reader.read(start, block_samples)
+            yield encode_frames(schema, rows, sequence)
+            sequence += -(-len(rows) // _frame_rows(schema))
+        if not loop:
+            return
+
+
+def signal_source(spec: str, sample_rate: float, schema: FrameSchema, block_samples: int = 4096, seed: int = 0):
+    """
+    an endless generated signal, 'sine:f[:amplitude[:noise]]' with white noise of the given rms on top
+    """
+    name, *args = spec.split(':')
+    if name != 'sine' or not args:
+        raise ValueError(f"unknown signal '{spec}', use sine:f[:amplitude[:noise]]")
+    frequency, amplitude, noise = [float(arg) for arg in args] + [1.0, 0.0][len(args) - 1:]
+
+    rng = np.random.default_rng(seed)
+    block_samples -= block_samples % _frame_rows(schema)
+    step = 2 * np.pi * frequency / sample_rate
+    ramp = step * np.arange(block_samples)
+    phase = 0.0
+    sequence = 0
+    while True:
+        samples = amplitude * np.sin(ramp + phase)
+        if noise:
+            samples += rng.normal(0, noise, block_samples)
+        yield encode_frames(schema, np.repeat(samples[:, None], len(schema.channels), axis=1), sequence)
+        sequence += block_samples // _frame_rows(schema)
+        # wrapped, so the phase stays exact for days
+        phase = (phase + step * block_samples) % (2 * np.pi)
+
+
+def open_source(name: str, schema: FrameSchema, sample_rate: float | None = None, loop: bool = False):
+    """
+    (byte block iterator, sample rate) of a recording or a signal spec, a capture file brings its own sample rate
+    """
+    if name.startswith('sine:'):
+        sample_rate = sample_rate or 48_000
+        return signal_source(name, sample_rate, schema), sample_rate
+    if is_capture_file(name):
+        reader = CaptureReader(name)
+        return capture_source(reader, schema, loop), sample_rate or reader.sample_rate
+    return raw_source(name, loop), sample_rate or 48_000
+
+
+class PtyPort:
+    """
+    a pseudo terminal pair, the replay writes to the master side and the app opens `port` (the slave side,
+    /dev/pts/N) like any serial port. The slave is kept open here as well, so the port stays usable while the app
+    reconnects
+    """
+
+    def __init__(self):
+        import tty
+
+        self._master, self._slave = os.openpty()
+        # no echo, no line editing, no newline translation: a byte pipe like a UART
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+        self.blocking = False
+
+    def write(self, data) -> int:
+        return os.write(self._master, data)
+
+    def wait_writable(self, timeout: float):
+        select.select([], [self._master], [], timeout)
+
+    def close(self):
+        os.close(self._master)
+        os.close(self._slave)
+
+
+class SerialPort:
+    """
+    a pyserial url or port as the target, e.g. loop:// or one side of a null modem pair. Writes block until the
+    port takes them, so pacing can fall behind but nothing is lost
+    """
+
+    def __init__(self, url: str, baud_rate: int = 12_000_000, timeout: float = 0.1):
+        self.handle = serial.serial_for_url(url, baudrate=baud_rate, timeout=timeout)
+        self.port = url
+        self.blocking = True
+
+    def write(self, data) -> int:
+        return self.handle.write(data)
+
+    def wait_writable(self, timeout: float):
+        pass
+
+    def close(self):
+        self.handle.close()
+
+
+def open_target(target: str, baud_rate: int = 12_000_000):
+    return PtyPort() if target == 'pty' else SerialPort(target, baud_rate)
+
+
+class Replayer:
+    """
+    writes the byte blocks of a source to a target on a background thread, paced and disturbed as set, see the module
+    docstring. chunk is the size of every write
+
+    the schema is the one the bytes are in, its decoder counts the samples written so far
+    """
+
+    def __init__(self, source, target, sample_rate: float = 48_000, schema: FrameSchema | None = None,
+                 speed: float = 1.0, baud_rate: int = 0, chunk: int = 1024, jitter: float = 0.0,
+                 burst_every: float = 0.0, burst_hold: float = 0.0, corrupt: float = 0.0, seed: int = 0):
+        self.source = source
+        self.target = target
+        self.sample_rate = sample_rate
+        self.decoder = (schema or SCHEMAS['legacy']).decoder()
+        self.speed = speed
+        self.baud_rate = baud_rate
+        self.chunk = chunk
+        self.jitter = jitter
+        self.burst_every = burst_every
+        self.burst_hold = burst_hold
+        self.corrupt = corrupt
+        self.rng = np.random.default_rng(seed)
+
+        self.n_bytes = 0
+        self.overflow_bytes = 0
+        self.corrupted_bytes = 0
+        self.n_bursts = 0
+        self.late_writes = 0
+        self._overflowing = False
+        self.finished = threading.Event()
+        # (time.monotonic() after the write, samples written so far) of every write
+        self._log = RingBuffer(LOG_SIZE, dtype=np.float64, item_shape=(2,))
+        self._log_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.run, name=f'Replayer({target.port})', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _due(self, n_bytes: int, n_samples: int) -> float:
+        """
+        seconds after the start at which the bytes so far are due, 0 without pacing
+        """
+        if not self.speed:
+            return 0.0
+        if self.baud_rate:
+            # 8N1, 10 bits a byte
+            return n_bytes * 10 / (self.baud_rate * self.speed)
+        return n_samples / (self.sample_rate * self.speed)
+
+    def _pieces(self):
+        for block in self.source:
+            view = memoryview(block)
+            for start in range(0, len(view), self.chunk):
+                yield view[start:start + self.chunk]
+
+    def _corrupt(self, piece) -> bytes:
+        n_flips = self.rng.binomial(len(piece), self.corrupt)
+        if not n_flips:
+            return piece
+        data = np.frombuffer(piece, dtype=np.uint8).copy()
+        data[self.rng.integers(0, len(data), n_flips)] ^= self.rng.integers(1, 256, n_flips, dtype=np.uint8)
+        self.corrupted_bytes += n_flips
+        return data.tobytes()
+
+    def _write(self, data):
+        view = memoryview(data)
+        # no waiting while the reader is gone, the schedule would fall behind
+        deadline = time.monotonic() + (0 if self._overflowing else OVERFLOW_WAIT)
+        while len(view) and not self._stopped.is_set():
+            try:
+                view = view[self.target.write(view):]
+            except BlockingIOError:
+                pass
+            if not len(view):
+                break
+            if self.speed and not self.target.blocking and time.monotonic() > deadline:
+                # paced like a UART: what does not fit into the port buffer is gone
+                self.overflow_bytes += len(view)
+                break
+            self.target.wait_writable(min(max(deadline - time.monotonic(), 0.001), 0.1) if self.speed else 0.1)
+        self._overflowing = bool(len(view))
+
+    def run(self):
+        start = time.monotonic()
+        next_burst = self.rng.exponential(self.burst_every) if self.burst_every and self.burst_hold else np.inf
+        held = []
+        try:
+            for piece in self._pieces():
+                if self._stopped.is_set():
+                    break
+                self.n_bytes += len(piece)
+                self.decoder.feed(piece)
+                due = self._due(self.n_bytes, self.decoder.n_samples)
+
+                if due >= next_burst:
+                    # a stall: everything due until its end goes out in one write
+                    held.append(bytes(piece))
+                    if due < next_burst + self.burst_hold:
+                        continue
+                    piece = b''.join(held)
+                    held = []
+                    self.n_bursts += 1
+                    next_burst = due + self.rng.exponential(self.burst_every)
+
+                if self.jitter:
+                    due += abs(self.rng.normal(0, self.jitter))
+                delay = start + due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                elif self.speed and delay < -0.01:
+                    self.late_writes += 1
+
+                if self.corrupt:
+                    piece = self._corrupt(piece)
+                self._write(piece)
+                with self._log_lock:
+                    self._log.write(np.array([[time.monotonic(), self.decoder.n_samples]]))
+            if held and not self._stopped.is_set():
+                self._write(b''.join(held))
+        finally:
+            self.finished.set()
+
+    def sent_time(self, n_samples: int) -> float | None:
+        """
+        time.monotonic() of the write that completed the first n_samples, None if it is not logged (not written yet,
+        or longer ago than LOG_SIZE writes)
+        """
+        with self._log_lock:
+            log = self._log.latest(min(self._log.n_written, self._log.capacity)).copy()
+        index = int(np.searchsorted(log[:, 1], n_samples))
+        if index == len(log) or (index == 0 and self._log.n_written > self._log.capacity):
+            return None
+        return float(log[index, 0])
+
+    def stats(self) -> str:
+        line = f'{self.n_bytes / 1e6:.2f} MB, {self.decoder.n_samples} samples'
+        if self.overflow_bytes:
+            line += f', lost in the port buffer: {self.overflow_bytes} B'
+        if self.corrupted_bytes:
+            line += f', corrupted: {self.corrupted_bytes} B'
+        if self.n_bursts:
+            line += f', bursts: {self.n_bursts}'
+        if self.late_writes:
+            line += f', late writes: {self.late_writes}'
+        return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='raw recording, .scap capture or sine:f[:amplitude[:noise]]')
+    parser.add_argument('--target', default='pty', help='pty or a pyserial url, default: a new pty pair')
+    parser.add_argument('--schema', default='legacy', help='frame schema name or .json file of the bytes')
+    parser.add_argument('--sample-rate', dest='sample_rate', type=float,
+                        help='samples/s of real time, default: from the capture file or 48000')
+    parser.add_argument('--baud', type=int, default=0, help='pace by bytes at this line rate instead of by samples')
+    parser.add_argument('--speed', type=float, default=1.0, help='times real time, 0 = as fast as possible')
+    parser.add_argument('--chunk', type=int, default=1024, help='bytes per write')
+    parser.add_argument('--loop', action='store_true', help='start over at the end of the recording')
+    parser.add_argument('--jitter-ms', dest='jitter_ms', type=float, default=0, help='rms delay of every write')
+    parser.add_argument('--burst-every', dest='burst_every', type=float, default=0,
+                        help='mean seconds between stalls, 0 = none')
+    parser.add_argument('--burst-ms', dest='burst_ms', type=float, default=50, help='length of a stall')
+    parser.add_argument('--corrupt', type=float, default=0, help='probability of a flipped byte')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    schema = load_schema(args.schema)
+    source, sample_rate = open_source(args.source, schema, args.sample_rate, args.loop)
+    target = open_target(args.target, args.baud or 12_000_000)
+    replayer = Replayer(source, target, sample_rate, schema, speed=args.speed, baud_rate=args.baud, chunk=args.chunk,
+                        jitter=args.jitter_ms / 1000, burst_every=args.burst_every, burst_hold=args.burst_ms / 1000,
+                        corrupt=args.corrupt, seed=args.seed)
+    pace = 'as fast as possible' if not args.speed else \
+        f'{args.speed:g} x {f"{args.baud} baud" if args.baud else f"{sample_rate:g} Hz"}'
+    print(f'replaying {args.source} to {target.port}, {pace}', flush=True)
+
+    replayer.start()
+    start = time.monotonic()
+    last_bytes = 0
+    try:
+        while not replayer.finished.wait(1):
+            print(f'[{time.monotonic() - start:7.1f} s] {(replayer.n_bytes - last_bytes) / 1e3:.1f} kB/s, '
+                  f'{replayer.stats()}', flush=True)
+            last_bytes = replayer.n_bytes
+    except KeyboardInterrupt:
+        pass
+    finally:
+        replayer.stop()
+        target.close()
+    print(f'replay finished after {time.monotonic() - start:.1f} s: {replayer.stats()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import sys
 
-from PyQt6.QtWidgets import QPushButton, QSizePolicy, QDialog, QLabel, QLineEdit, QVBoxLayout, QHBoxLayout
+from PyQt6.QtWidgets import QPushButton, QSizePolicy, QDialog, QLabel, QLineEdit, QVBoxLayout, QHBoxLayout, \
+    QScrollArea, QWidget
 
 
 class SettingsWindow(QDialog):
@@ -10,7 +11,7 @@ class SettingsWindow(QDialog):
         self.setGeometry(200, 200, 160, 160)  # useless?
 
         # uart settings
-        self.com_port_label = QLabel('COM Port:\t')
+        self.com_port_label = QLabel('COM Ports:\t')
         self.com_port_input = QLineEdit(self)
 
         self.baud_rate_label = QLabel('Baud Rate:\t')
@@ -19,12 +20,27 @@ class SettingsWindow(QDialog):
         self.chunk_label = QLabel('Chunk:\t\t')
         self.chunk_input = QLineEdit(self)
 
+        self.latency_target_label = QLabel('Latency [ms]:\t')
+        self.latency_target_input = QLineEdit(self)
+
+        self.serial_io_label = QLabel('Serial io:\t\t')
+        self.serial_io_input = QLineEdit(self)
+
+        self.frame_schema_label = QLabel('Frame schema:\t')
+        self.frame_schema_input = QLineEdit(self)
+
         self.timeout_label = QLabel('Timeout:\t\t')
         self.timeout_input = QLineEdit(self)
 
         self.record_label = QLabel('Record n_sample:\t')
         self.record_input = QLineEdit(self)
 
+        self.record_seconds_label = QLabel('Record seconds:\t')
+        self.record_seconds_input = QLineEdit(self)
+
+        self.record_file_label = QLabel('Record file:\t')
+        self.record_file_input = QLineEdit(self)
+
         # general settings
         self.sample_rate_label = QLabel('Sample Rate:\t')
         self.sample_rate_input = QLineEdit(self)
@@ -35,6 +51,51 @@ class SettingsWindow(QDialog):
         self.out_device_label = QLabel('output device\t')
         self.out_device_input = QLineEdit(self)
 
+        self.window_label = QLabel('plot window [s]\t')
+        self.window_input = QLineEdit(self)
+
+        self.fps_label = QLabel('plot fps\t\t')
+        self.fps_input = QLineEdit(self)
+
+        self.decimation_label = QLabel('plot decimation\t')
+        self.decimation_input = QLineEdit(self)
+
+        self.fft_size_label = QLabel('fft size\t\t')
+        self.fft_size_input = QLineEdit(self)
+
+        self.averaging_label = QLabel('fft averaging\t')
+        self.averaging_input = QLineEdit(self)
+
+        self.spectrogram_label = QLabel('spectrogram [s]\t')
+        self.spectrogram_input = QLineEdit(self)
+
+        self.filters_label = QLabel('filters\t\t')
+        self.filters_input = QLineEdit(self)
+
+        self.trigger_mode_label = QLabel('trigger mode\t')
+        self.trigger_mode_input = QLineEdit(self)
+
+        self.trigger_edge_label = QLabel('trigger edge\t')
+        self.trigger_edge_input = QLineEdit(self)
+
+        self.trigger_level_label = QLabel('trigger level\t')
+        self.trigger_level_input = QLineEdit(self)
+
+        self.trigger_hysteresis_label = QLabel('trigger hysteresis\t')
+        self.trigger_hysteresis_input = QLineEdit(self)
+
+        self.pulse_min_label = QLabel('pulse min [ms]\t')
+        self.pulse_min_input = QLineEdit(self)
+
+        self.pulse_max_label = QLabel('pulse max [ms]\t')
+        self.pulse_max_input = QLineEdit(self)
+
+        self.queue_policy_label = QLabel('queue policy\t')
+        self.queue_policy_input = QLineEdit(self)
+
+        self.publish_label = QLabel('publish\t\t')
+        self.publish_input = QLineEdit(self)
+
         # usb settings
         self.n_channels_label = QLabel('channels\t\t')
         self.n_channels_input = QLineEdit(self)
@@ -77,6 +138,111 @@ class SettingsWindow(QDialog):
         out_device_layout.addStretch()
         layout.addLayout(out_device_layout)
 
+        window_layout = QHBoxLayout()
+        window_layout.addStretch()
+        window_layout.addWidget(self.window_label)
+        window_layout.addWidget(self.window_input)
+        window_layout.addStretch()
+        layout.addLayout(window_layout)
+
+        fps_layout = QHBoxLayout()
+        fps_layout.addStretch()
+        fps_layout.addWidget(self.fps_label)
+        fps_layout.addWidget(self.fps_input)
+        fps_layout.addStretch()
+        layout.addLayout(fps_layout)
+
+        decimation_layout = QHBoxLayout()
+        decimation_layout.addStretch()
+        decimation_layout.addWidget(self.decimation_label)
+        decimation_layout.addWidget(self.decimation_input)
+        decimation_layout.addStretch()
+        layout.addLayout(decimation_layout)
+
+        fft_size_layout = QHBoxLayout()
+        fft_size_layout.addStretch()
+        fft_size_layout.addWidget(self.fft_size_label)
+        fft_size_layout.addWidget(self.fft_size_input)
+        fft_size_layout.addStretch()
+        layout.addLayout(fft_size_layout)
+
+        averaging_layout = QHBoxLayout()
+        averaging_layout.addStretch()
+        averaging_layout.addWidget(self.averaging_label)
+        averaging_layout.addWidget(self.averaging_input)
+        averaging_layout.addStretch()
+        layout.addLayout(averaging_layout)
+
+        spectrogram_layout = QHBoxLayout()
+        spectrogram_layout.addStretch()
+        spectrogram_layout.addWidget(self.spectrogram_label)
+        spectrogram_layout.addWidget(self.spectrogram_input)
+        spectrogram_layout.addStretch()
+        layout.addLayout(spectrogram_layout)
+
+        filters_layout = QHBoxLayout()
+        filters_layout.addStretch()
+        filters_layout.addWidget(self.filters_label)
+        filters_layout.addWidget(self.filters_input)
+        filters_layout.addStretch()
+        layout.addLayout(filters_layout)
+
+        trigger_mode_layout = QHBoxLayout()
+        trigger_mode_layout.addStretch()
+        trigger_mode_layout.addWidget(self.trigger_mode_label)
+        trigger_mode_layout.addWidget(self.trigger_mode_input)
+        trigger_mode_layout.addStretch()
+        layout.addLayout(trigger_mode_layout)
+
+        trigger_edge_layout = QHBoxLayout()
+        trigger_edge_layout.addStretch()
+        trigger_edge_layout.addWidget(self.trigger_edge_label)
+        trigger_edge_layout.addWidget(self.trigger_edge_input)
+        trigger_edge_layout.addStretch()
+        layout.addLayout(trigger_edge_layout)
+
+        trigger_level_layout = QHBoxLayout()
+        trigger_level_layout.addStretch()
+        trigger_level_layout.addWidget(self.trigger_level_label)
+        trigger_level_layout.addWidget(self.trigger_level_input)
+        trigger_level_layout.addStretch()
+        layout.addLayout(trigger_level_layout)
+
+        trigger_hysteresis_layout = QHBoxLayout()
+        trigger_hysteresis_layout.addStretch()
+        trigger_hysteresis_layout.addWidget(self.trigger_hysteresis_label)
+        trigger_hysteresis_layout.addWidget(self.trigger_hysteresis_input)
+        trigger_hysteresis_layout.addStretch()
+        layout.addLayout(trigger_hysteresis_layout)
+
+        pulse_min_layout = QHBoxLayout()
+        pulse_min_layout.addStretch()
+        pulse_min_layout.addWidget(self.pulse_min_label)
+        pulse_min_layout.addWidget(self.pulse_min_input)
+        pulse_min_layout.addStretch()
+        layout.addLayout(pulse_min_layout)
+
+        pulse_max_layout = QHBoxLayout()
+        pulse_max_layout.addStretch()
+        pulse_max_layout.addWidget(self.pulse_max_label)
+        pulse_max_layout.addWidget(self.pulse_max_input)
+        pulse_max_layout.addStretch()
+        layout.addLayout(pulse_max_layout)
+
+        queue_policy_layout = QHBoxLayout()
+        queue_policy_layout.addStretch()
+        queue_policy_layout.addWidget(self.queue_policy_label)
+        queue_policy_layout.addWidget(self.queue_policy_input)
+        queue_policy_layout.addStretch()
+        layout.addLayout(queue_policy_layout)
+
+        publish_layout = QHBoxLayout()
+        publish_layout.addStretch()
+        publish_layout.addWidget(self.publish_label)
+        publish_layout.addWidget(self.publish_input)
+        publish_layout.addStretch()
+        layout.addLayout(publish_layout)
+
         layout.addWidget(QLabel('\t\t--- USB settings ---'))
         n_channels_layout = QHBoxLayout()
         n_channels_layout.addStretch()
@@ -121,6 +287,27 @@ class SettingsWindow(QDialog):
         chunk_layout.addStretch()
         layout.addLayout(chunk_layout)
 
+        latency_target_layout = QHBoxLayout()
+        latency_target_layout.addStretch()
+        latency_target_layout.addWidget(self.latency_target_label)
+        latency_target_layout.addWidget(self.latency_target_input)
+        latency_target_layout.addStretch()
+        layout.addLayout(latency_target_layout)
+
+        serial_io_layout = QHBoxLayout()
+        serial_io_layout.addStretch()
+        serial_io_layout.addWidget(self.serial_io_label)
+        serial_io_layout.addWidget(self.serial_io_input)
+        serial_io_layout.addStretch()
+        layout.addLayout(serial_io_layout)
+
+        frame_schema_layout = QHBoxLayout()
+        frame_schema_layout.addStretch()
+        frame_schema_layout.addWidget(self.frame_schema_label)
+        frame_schema_layout.addWidget(self.frame_schema_input)
+        frame_schema_layout.addStretch()
+        layout.addLayout(frame_schema_layout)
+
         timeout_layout = QHBoxLayout()
         timeout_layout.addStretch()
         timeout_layout.addWidget(self.timeout_label)
@@ -135,46 +322,124 @@ class SettingsWindow(QDialog):
         record_layout.addStretch()
         layout.addLayout(record_layout)
 
-        layout.addWidget(self.save_button)
+        record_seconds_layout = QHBoxLayout()
+        record_seconds_layout.addStretch()
+        record_seconds_layout.addWidget(self.record_seconds_label)
+        record_seconds_layout.addWidget(self.record_seconds_input)
+        record_seconds_layout.addStretch()
+        layout.addLayout(record_seconds_layout)
+
+        record_file_layout = QHBoxLayout()
+        record_file_layout.addStretch()
+        record_file_layout.addWidget(self.record_file_label)
+        record_file_layout.addWidget(self.record_file_input)
+        record_file_layout.addStretch()
+        layout.addLayout(record_file_layout)
+
         layout.addStretch()
-        self.setLayout(layout)
 
-        self.param_names = ['sample_rate', 'input_device', 'output_device', 'channels', 'block_size', 'latency',
-                            'com_port', 'baud_rate', 'chunk', 'timeout', 'record_n_samples']
+        # the form scrolls, so the dialog fits small screens however many settings there are; Save stays visible
+        form = QWidget()
+        form.setLayout(layout)
+        scroll_area = QScrollArea(self)
+        scroll_area.setWidgetResizable(True)
+        scroll_area.setWidget(form)
+
+        dialog_layout = QVBoxLayout()
+        dialog_layout.addWidget(scroll_area)
+        dialog_layout.addWidget(self.save_button)
+        self.setLayout(dialog_layout)
+
+        self.param_names = ['sample_rate', 'input_device', 'output_device', 'window_seconds', 'fps', 'decimation',
+                            'fft_size', 'averaging', 'spectrogram_seconds', 'filters', 'trigger_mode', 'trigger_edge',
+                            'trigger_level', 'trigger_hysteresis', 'pulse_min_ms', 'pulse_max_ms', 'queue_policy',
+                            'publish', 'channels', 'block_size', 'latency', 'com_port', 'baud_rate', 'chunk',
+                            'target_latency_ms', 'serial_io', 'frame_schema', 'timeout', 'record_n_samples',
+                            'record_seconds', 'record_file']
         self.param_dict = {}
 
     def set_default_values(self):
         self.sample_rate_input.setText('48_000')
         self.in_device_input.setText('-1')
         self.out_device_input.setText('35')
+        self.window_input.setText('0.5')
+        self.fps_input.setText('30')
+        self.decimation_input.setText('minmax')
+        self.fft_size_input.setText('4096')
+        self.averaging_input.setText('welch')
+        # 0 hides the spectrogram
+        self.spectrogram_input.setText('10')
+        # a chain like 'dc, lowpass:5000, decimate:4', see filters.py. Empty: the samples as they come
+        self.filters_input.setText('')
+        # off, auto, normal or single; a pulse min or max other than 0 makes it a pulse width trigger
+        self.trigger_mode_input.setText('off')
+        self.trigger_edge_input.setText('rising')
+        self.trigger_level_input.setText('0')
+        self.trigger_hysteresis_input.setText('0.1')
+        self.pulse_min_input.setText('0')
+        self.pulse_max_input.setText('0')
+        self.queue_policy_input.setText('drop_oldest')
+        # unix:path or tcp:port to serve the live blocks to other programs (publisher_client.py), empty: off
+        self.publish_input.setText('')
         self.latency_input.setText('high')
         self.n_channels_input.setText('1')
         self.block_size_input.setText('0')
         self.com_port_input.setText('COM8')
         self.baud_rate_input.setText('12_000_000')
-        self.chunk_input.setText('256')
+        # 0: the read size follows the byte rate and the latency target
+        self.chunk_input.setText('0')
+        self.latency_target_input.setText('10')
+        self.serial_io_input.setText('threads')
+        # a name from frames.SCHEMAS or a .json schema file
+        self.frame_schema_input.setText('legacy')
         self.timeout_input.setText('400')
         self.record_input.setText('50_000')
+        self.record_seconds_input.setText('0')
+        self.record_file_input.setText('recorded_signal.scap')
 
     def get_settings(self):
+        """
+        the settings as typed, raises ValueError if one of them is not a number where it has to be
+        """
         try:
             param_values = [
                 int(self.sample_rate_input.text()),
                 int(self.in_device_input.text()),
                 int(self.out_device_input.text()),
+                float(self.window_input.text()),
+                int(self.fps_input.text()),
+                str(self.decimation_input.text().strip().lower()),
+                int(self.fft_size_input.text()),
+                str(self.averaging_input.text().strip().lower()),
+                float(self.spectrogram_input.text()),
+                str(self.filters_input.text()).strip(),
+                str(self.trigger_mode_input.text().strip().lower()),
+                str(self.trigger_edge_input.text().strip().lower()),
+                float(self.trigger_level_input.text()),
+                float(self.trigger_hysteresis_input.text()),
+                float(self.pulse_min_input.text()),
+                float(self.pulse_max_input.text()),
+                str(self.queue_policy_input.text().strip().lower()),
+                str(self.publish_input.text()).strip(),
                 int(self.n_channels_input.text()),
                 int(self.block_size_input.text()),
                 str(self.latency_input.text().strip().lower()),
-                str(self.com_port_input.text()).strip().upper(),
+                # as typed, /dev/pts/3 (replay.py) is case sensitive and Windows does not care
+                str(self.com_port_input.text()).strip(),
                 int(self.baud_rate_input.text()),
                 int(self.chunk_input.text()),
+                float(self.latency_target_input.text()),
+                str(self.serial_io_input.text().strip().lower()),
+                str(self.frame_schema_input.text()).strip(),
                 int(self.timeout_input.text()),
-                int(self.record_input.text())
+                int(self.record_input.text()),
+                float(self.record_seconds_input.text()),
+                str(self.record_file_input.text()).strip()
             ]
 
         except ValueError as e:
             print(f"Invalid input(s): {e}", file=sys.stderr)
-            return {}
+            raise
 
         self.param_dict = {param_name: param_value for (param_name, param_value) in zip(self.param_names, param_values)}
 
@@ -0,0 +1,111 @@
+"""
+AsyncSerialEngine on Linux: a pty pair goes through add_reader and os.readv, pyserial loop:// (no file descriptor)
+through polling. Samples arrive in order and remove() / stop() cancel the readers right away and close the handles
+"""
+import threading
+import time
+
+import numpy as np
+import pytest
+import serial
+
+from async_serial import AsyncSerialEngine
+from frames import SCHEMAS
+from replay import PtyPort, encode_frames
+
+N_SAMPLES = 50_000
+
+
+def write_all(target: PtyPort, data: bytes, piece: int = 1024):
+    """
+    the pty master is non blocking and holds only a few kB, write as the reader makes room
+    """
+    view = memoryview(data)
+    while len(view):
+        try:
+            view = view[target.write(view[:piece]):]
+        except BlockingIOError:
+            target.wait_writable(0.1)
+
+
+def drain(reader, n_samples: int, timeout: float = 10) -> np.ndarray:
+    received = []
+    deadline = time.monotonic() + timeout
+    while sum(map(len, received)) < n_samples and time.monotonic() < deadline:
+        received.extend(block.samples for block in reader.queue.get_all())
+        time.sleep(0.005)
+    return np.concatenate(received) if received else np.empty(0, dtype=np.float32)
+
+
+def wait_closed(handle, timeout: float = 0.5) -> float:
+    tic = time.perf_counter()
+    while handle.is_open and time.perf_counter() - tic < timeout:
+        time.sleep(0.001)
+    return time.perf_counter() - tic
+
+
+@pytest.fixture
+def engine():
+    engine = AsyncSerialEngine()
+    yield engine
+    engine.stop()
+
+
+@pytest.fixture
+def stream():
+    samples = np.arange(N_SAMPLES, dtype=np.float32)
+    return samples, encode_frames(SCHEMAS['legacy'], samples)
+
+
+def test_pty_samples_arrive_in_order(engine, stream):
+    samples, data = stream
+    pty = PtyPort()
+    try:
+        handle = serial.Serial(pty.port, timeout=0.1)
+        # a large queue, nothing may be dropped while the test drains
+        reader = engine.add(handle, name='pty', queue_size=4096)
+        writer = threading.Thread(target=write_all, args=(pty, data))
+        writer.start()
+        received = drain(reader, N_SAMPLES)
+        writer.join(5)
+        assert np.array_equal(received, samples)
+        assert reader.queue.dropped == 0
+        # readv wakes up per burst, not per byte
+        assert reader.n_reads < len(data) // 64
+
+        engine.remove('pty')
+        assert wait_closed(handle) < 0.1
+        assert not handle.is_open
+    finally:
+        pty.close()
+
+
+def test_loop_url_is_polled(engine, stream):
+    samples, data = stream
+    handle = serial.serial_for_url('loop://', timeout=0.1)
+    reader = engine.add(handle, name='loop', queue_size=4096)
+    handle.write(data)
+    assert np.array_equal(drain(reader, N_SAMPLES), samples)
+
+    engine.remove('loop')
+    assert wait_closed(handle) < 0.1
+    assert 'loop' not in engine.readers
+
+
+def test_stop_cancels_every_reader_without_waiting_for_timeouts():
+    engine = AsyncSerialEngine()
+    pty = PtyPort()
+    try:
+        # long read timeouts: a reader blocked in read() would hold stop() for seconds
+        handles = [serial.Serial(pty.port, timeout=5), serial.serial_for_url('loop://', timeout=5)]
+        for i, handle in enumerate(handles):
+            engine.add(handle, name=f'port {i}')
+        time.sleep(0.05)
+
+        tic = time.perf_counter()
+        engine.stop()
+        assert time.perf_counter() - tic < 0.5
+        assert not engine._thread.is_alive()
+        assert not any(handle.is_open for handle in handles)
+    finally:
+        pty.close()
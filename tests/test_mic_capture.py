@@ -0,0 +1,192 @@
+"""
+MicCapture.callback driven directly with synthetic blocks, sounddevice is replaced by a stub so no audio device or
+PortAudio is needed
+"""
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+import numpy as np
+import pytest
+
+from capture import MicCapture
+
+SAMPLE_RATE = 48_000
+BLOCK = 64
+CHANNELS = 2
+
+
+class FakeFlags:
+    def __init__(self, input_overflow=False, input_underflow=False, output_overflow=False, output_underflow=False):
+        self.input_overflow = input_overflow
+        self.input_underflow = input_underflow
+        self.output_overflow = output_overflow
+        self.output_underflow = output_underflow
+
+    def __bool__(self):
+        return self.input_overflow or self.input_underflow or self.output_overflow or self.output_underflow
+
+    def __ior__(self, other):
+        for name in ('input_overflow', 'input_underflow', 'output_overflow', 'output_underflow'):
+            setattr(self, name, getattr(self, name) or getattr(other, name))
+        return self
+
+
+class FakeStream:
+    """
+    records every control call, the callback must never make one
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.active = False
+        self.calls = []
+
+    def start(self):
+        self.calls.append('start')
+        self.active = True
+
+    def stop(self):
+        self.calls.append('stop')
+        self.active = False
+
+
+@pytest.fixture
+def mic(monkeypatch):
+    sounddevice = types.ModuleType('sounddevice')
+    sounddevice.CallbackFlags = FakeFlags
+    sounddevice.Stream = FakeStream
+    monkeypatch.setitem(sys.modules, 'sounddevice', sounddevice)
+    return MicCapture(in_device=0, out_device=1, samplerate=SAMPLE_RATE, channels=CHANNELS, latency='low',
+                      blocksize=BLOCK)
+
+
+def make_blocks(n_blocks: int, frames: int = BLOCK) -> list:
+    rng = np.random.default_rng(0)
+    return [rng.integers(-2 ** 15, 2 ** 15, (frames, CHANNELS), dtype=np.int16) for _ in range(n_blocks)]
+
+
+def test_ring_holds_first_channel_in_order(mic):
+    blocks = make_blocks(100)
+    outdata = np.empty((BLOCK, CHANNELS), dtype=np.int16)
+    for block in blocks:
+        mic.callback(block, outdata, BLOCK, None, FakeFlags())
+        assert np.array_equal(outdata, block)
+
+    expected = np.concatenate([block[:, 0] for block in blocks]).astype(np.float32)
+    assert mic.ring.n_written == len(expected)
+    assert np.array_equal(mic.ring.latest(len(expected)), expected)
+    assert mic.xruns == 0
+
+
+def test_ring_keeps_order_across_wraparound(mic):
+    n_blocks = mic.ring.capacity // BLOCK + 10
+    blocks = make_blocks(n_blocks)
+    outdata = np.empty((BLOCK, CHANNELS), dtype=np.int16)
+    for block in blocks:
+        mic.callback(block, outdata, BLOCK, None, FakeFlags())
+
+    expected = np.concatenate([block[:, 0] for block in blocks]).astype(np.float32)
+    assert np.array_equal(mic.ring.view(), expected[-mic.ring.capacity:])
+
+
+def test_xruns_are_counted_from_status(mic):
+    outdata = np.empty((BLOCK, CHANNELS), dtype=np.int16)
+    block = make_blocks(1)[0]
+    mic.callback(block, outdata, BLOCK, None, FakeFlags(input_overflow=True))
+    mic.callback(block, outdata, BLOCK, None, FakeFlags(output_underflow=True))
+    mic.callback(block, outdata, BLOCK, None, FakeFlags(input_underflow=True, output_overflow=True))
+    mic.callback(block, outdata, BLOCK, None, FakeFlags())
+
+    assert (mic.input_overflows, mic.input_underflows, mic.output_overflows, mic.output_underflows) == (1, 1, 1, 1)
+    assert mic.xruns == 4
+    assert mic.callback_status.input_overflow and mic.callback_status.output_underflow
+    # the block of an xrun still goes into the ring
+    assert mic.ring.n_written == 4 * BLOCK
+
+
+def test_callback_does_not_allocate(mic):
+    # larger blocks than the stream's, so a copy of a block stands out from the few hundred bytes of view objects
+    frames = 1024
+    blocks = make_blocks(200, frames)
+    outdata = np.empty((frames, CHANNELS), dtype=np.int16)
+    status = FakeFlags()
+    # warm up, numpy caches its small helpers on first use
+    for block in blocks[:10]:
+        mic.callback(block, outdata, frames, None, status)
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for block in blocks:
+            mic.callback(block, outdata, frames, None, status)
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # nothing is kept, and no temporary holds as much as a block: only numpy's slice views come and go
+    assert after - before < 1024
+    assert peak - before < frames * np.dtype(np.int16).itemsize
+
+
+def test_callback_does_not_block(mic):
+    blocks = make_blocks(2000)
+    outdata = np.empty((BLOCK, CHANNELS), dtype=np.int16)
+    status = FakeFlags()
+
+    # the consumer side holds its lock the whole time, the callback must not wait for it
+    with mic.queue._space:
+        durations = []
+        for block in blocks:
+            tic = time.perf_counter()
+            mic.callback(block, outdata, BLOCK, None, status)
+            durations.append(time.perf_counter() - tic)
+
+    assert mic.stream.calls == []
+    assert len(mic.queue) == 0
+    # a block is 1.3 ms of audio, a callback must stay far below that
+    assert np.median(durations) < 1e-4
+    assert max(durations) < 1e-2
+
+
+def test_stream_control_and_forwarding_run_on_the_polling_side(mic):
+    outdata = np.empty((BLOCK, CHANNELS), dtype=np.int16)
+    for block in make_blocks(10):
+        mic.callback(block, outdata, BLOCK, None, FakeFlags())
+    assert mic.stream.calls == []
+
+    mic.stream_status_check()
+    mic.forward_samples()
+    assert mic.stream.calls == ['start']
+    assert sum(len(block.samples) for block in mic.queue.get_all()) == 10 * BLOCK
+
+    mic.is_stopped = True
+    mic.stream_status_check()
+    assert mic.stream.calls == ['start', 'stop']
+
+
+def test_callback_runs_while_polling_thread_reads(mic):
+    blocks = make_blocks(500)
+    outdata = np.empty((BLOCK, CHANNELS), dtype=np.int16)
+    received = []
+    done = threading.Event()
+
+    def poll():
+        while not done.is_set() or mic.ring.n_written > mic._read_position:
+            samples, mic._read_position = mic.ring.read_since(mic._read_position)
+            received.append(samples)
+            time.sleep(0.0005)
+
+    thread = threading.Thread(target=poll)
+    thread.start()
+    for block in blocks:
+        mic.callback(block, outdata, BLOCK, None, FakeFlags())
+        time.sleep(0.0001)
+    done.set()
+    thread.join()
+
+    expected = np.concatenate([block[:, 0] for block in blocks]).astype(np.float32)
+    assert np.array_equal(np.concatenate(received), expected)
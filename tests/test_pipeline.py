@@ -0,0 +1,75 @@
+"""
+PipelinePort in forkserver (or spawned) processes: the handle factory, schema and filters are pickled to them and the
+samples come back through shared memory
+"""
+import functools
+import time
+from multiprocessing.context import ForkProcess
+
+import numpy as np
+
+from filters import parse_filters
+from frames import SCHEMAS
+from pipeline import PipelinePort
+from replay import encode_frames
+
+
+class OnceHandle:
+    """
+    serial handle that returns a byte stream once and then times out on every read
+    """
+
+    def __init__(self, stream: bytes, timeout: float = 0.01):
+        self._stream = stream
+        self._position = 0
+        self.timeout = timeout
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._stream) - self._position
+
+    def read(self, size: int) -> bytes:
+        if self._position >= len(self._stream):
+            time.sleep(self.timeout)
+        byte_packet = self._stream[self._position:self._position + size]
+        self._position += len(byte_packet)
+        return byte_packet
+
+    def close(self):
+        pass
+
+
+def drain(port: PipelinePort, n_samples: int, timeout: float = 20) -> np.ndarray:
+    received = []
+    deadline = time.monotonic() + timeout
+    while sum(map(len, received)) < n_samples and time.monotonic() < deadline:
+        received.extend(block.samples for block in port.queue.get_all())
+        time.sleep(0.01)
+    return np.concatenate(received) if received else np.empty(0, dtype=np.float32)
+
+
+def test_samples_arrive_through_started_processes():
+    ramp = np.arange(100_000, dtype=np.float32)
+    stream = encode_frames(SCHEMAS['legacy'], ramp)
+    port = PipelinePort(functools.partial(OnceHandle, stream), 'test', 48_000, n_fft=256)
+    try:
+        # never a fork of this process
+        assert not any(isinstance(process, ForkProcess) for process in port.processes)
+        samples = drain(port, len(ramp))
+    finally:
+        port.stop()
+    assert np.array_equal(samples, ramp)
+    assert port.stats_array[0] == len(stream)
+
+
+def test_filters_run_in_the_decoder_process():
+    ramp = np.ones(40_000, dtype=np.float32)
+    stream = encode_frames(SCHEMAS['legacy'], ramp)
+    port = PipelinePort(functools.partial(OnceHandle, stream), 'test', 48_000, n_fft=256,
+                        filters=parse_filters('decimate:4', 48_000))
+    try:
+        samples = drain(port, len(ramp) // 4)
+    finally:
+        port.stop()
+    assert port.sample_rate == 12_000
+    assert len(samples) == len(ramp) // 4
@@ -0,0 +1,234 @@
+"""
+RecordingSource: the audio callback copies samples a thread decoded ahead, it never decodes or reads the file itself.
+PlaybackEngine with a device at another rate: the sources resample, the callback only copies
+"""
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+import pytest
+
+import dsp
+import utility
+from dsp import StreamResampler
+from playback import LiveSource, PlaybackEngine, RecordingSource
+from recording import CaptureReader, CaptureWriter, RawCaptureReader
+from utility import HEADER
+
+
+def write_raw(path, n_samples: int, packet: int = 64) -> np.ndarray:
+    samples = np.arange(n_samples, dtype=np.float32)
+    with open(path, 'wb') as f:
+        for first in range(0, n_samples, packet):
+            f.write(HEADER + samples[first:first + packet].tobytes())
+    return samples
+
+
+def play(source: RecordingSource, frames: int = 512, timeout: float = 10) -> np.ndarray:
+    """
+    read like the audio callback until the end, an empty read is an underrun and just tried again later
+    """
+    played = []
+    deadline = time.monotonic() + timeout
+    while not source.at_end and time.monotonic() < deadline:
+        samples = source.read(frames)
+        if len(samples):
+            played.append(samples)
+        else:
+            time.sleep(0.001)
+    return np.concatenate(played) if played else np.empty(0, dtype=np.float32)
+
+
+def test_raw_recording_plays_in_order(tmp_path):
+    expected = write_raw(str(tmp_path / 'raw'), 200_000)
+    reader = RawCaptureReader(str(tmp_path / 'raw'), 8000, chunk=64 * 1024)
+    source = RecordingSource(reader, 1000, 150_000, read_ahead=0.5)
+    source.prepare(8000)
+    try:
+        assert np.array_equal(play(source), expected[1000:150_000])
+        assert source.position == 150_000
+    finally:
+        source.close()
+
+
+def test_seek_drops_what_was_decoded_ahead(tmp_path):
+    expected = write_raw(str(tmp_path / 'raw'), 100_000)
+    source = RecordingSource(RawCaptureReader(str(tmp_path / 'raw'), 8000, chunk=16 * 1024), read_ahead=0.5)
+    source.prepare(8000)
+    try:
+        time.sleep(0.05)
+        source.seek(70_000)
+        assert source.position == 70_000
+        assert np.array_equal(play(source), expected[70_000:])
+        source.seek(-5)
+        assert np.array_equal(play(source)[:1000], expected[:1000])
+    finally:
+        source.close()
+
+
+def test_reads_never_decode(tmp_path, monkeypatch):
+    write_raw(str(tmp_path / 'raw'), 100_000)
+    decoding_threads = set()
+    feed = utility.StreamDecoder.feed
+
+    def recording_feed(self, byte_packet, out=None):
+        decoding_threads.add(threading.current_thread())
+        return feed(self, byte_packet, out)
+
+    reader = RawCaptureReader(str(tmp_path / 'raw'), 8000, chunk=16 * 1024)
+    monkeypatch.setattr(utility.StreamDecoder, 'feed', recording_feed)
+    source = RecordingSource(reader, read_ahead=0.5)
+    source.prepare(8000)
+    try:
+        assert len(play(source)) == 100_000
+    finally:
+        source.close()
+    assert decoding_threads and threading.current_thread() not in decoding_threads
+
+
+def test_capture_plays_its_first_channel_and_close_ends_the_thread(tmp_path):
+    rows = np.arange(30_000, dtype=np.float32)[:, None] * [1, -1]
+    writer = CaptureWriter(str(tmp_path / 'capture.scap'), 8000, channels=2)
+    writer.write(rows.astype(np.float32))
+    writer.close()
+    source = RecordingSource(CaptureReader(str(tmp_path / 'capture.scap')), read_ahead=0.25)
+    source.prepare(8000)
+    assert np.array_equal(play(source), rows[:, 0])
+    source.close()
+    source._thread.join(1)
+    assert not source._thread.is_alive()
+
+
+class FakeOutputStream:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.active = False
+
+    def start(self):
+        self.active = True
+
+    def abort(self):
+        self.active = False
+
+    def close(self):
+        pass
+
+
+class CallbackStop(Exception):
+    pass
+
+
+@pytest.fixture
+def sounddevice_44k(monkeypatch):
+    """
+    an output device that only runs at 44.1 kHz
+    """
+    sounddevice = types.ModuleType('sounddevice')
+    sounddevice.OutputStream = FakeOutputStream
+    sounddevice.CallbackStop = CallbackStop
+
+    def check_output_settings(samplerate=None, **kwargs):
+        if samplerate != 44_100:
+            raise ValueError('Invalid sample rate')
+
+    sounddevice.check_output_settings = check_output_settings
+    sounddevice.query_devices = lambda device, kind: {'default_samplerate': 44_100.0}
+    monkeypatch.setitem(sys.modules, 'sounddevice', sounddevice)
+
+
+class Status:
+    output_underflow = False
+
+
+def run_callback(engine: PlaybackEngine, frames: int = 512, timeout: float = 10) -> np.ndarray:
+    """
+    call the engine's callback like PortAudio until it stops the stream, returns what went to the device
+    """
+    played = []
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        outdata = np.full((frames, 1), np.nan, dtype=np.float32)
+        played.append(outdata)
+        try:
+            engine.callback(outdata, frames, None, Status())
+        except CallbackStop:
+            break
+        time.sleep(0.001)
+    return np.concatenate(played)[:, 0]
+
+
+def test_recording_is_resampled_before_the_callback(tmp_path, sounddevice_44k, monkeypatch):
+    expected = write_raw(str(tmp_path / 'raw'), 48_000)
+    resampled = StreamResampler(48_000, 44_100).process(expected)
+    resampling_threads = set()
+    process = dsp.StreamResampler.process
+
+    def recording_process(self, samples):
+        resampling_threads.add(threading.current_thread())
+        return process(self, samples)
+
+    monkeypatch.setattr(dsp.StreamResampler, 'process', recording_process)
+    engine = PlaybackEngine(RecordingSource(RawCaptureReader(str(tmp_path / 'raw'), 48_000), read_ahead=0.25))
+    assert engine.device_rate == 44_100
+    engine.play()
+    time.sleep(0.05)
+    played = run_callback(engine)
+    engine.stop()
+
+    assert np.allclose(played[:len(resampled)], resampled)
+    # the end of the last callback block is silence, not leftovers
+    assert not np.any(played[len(resampled):])
+    assert engine.underruns == 0
+    assert resampling_threads and threading.current_thread() not in resampling_threads
+    assert abs(engine.position - 1.0) < 1e-3
+
+
+def test_live_source_is_resampled_when_written(sounddevice_44k):
+    source = LiveSource(48_000, target_lag=0.01)
+    engine = PlaybackEngine(source)
+    engine.play()
+    source.write(np.ones(4800, dtype=np.float32))
+    outdata = np.zeros((4410, 1), dtype=np.float32)
+    engine.callback(outdata, 4410, None, Status())
+    # 0.1 s in, 0.1 s at the device rate out, less the few samples the resampler carries over
+    assert source.ring.n_written >= 4400
+    # after the start of the anti aliasing filter
+    assert np.allclose(outdata[64:source.ring.n_written], 1, atol=1e-3)
+    engine.stop()
+
+
+def test_live_source_concurrent_write_and_read():
+    """
+    a ramp written in blocks from one thread and read from another: every read is a run of consecutive samples and
+    the reads only ever jump ahead by what skipped counts
+    """
+    source = LiveSource(48_000, target_lag=0.005, max_lag=0.02)
+    n_blocks, block = 2000, 48
+    stop = threading.Event()
+
+    def write():
+        for i in range(n_blocks):
+            source.write(np.arange(i * block, (i + 1) * block, dtype=np.float32))
+            if i % 20 == 0:
+                time.sleep(0.0005)
+        stop.set()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    out = np.empty(100, dtype=np.float32)
+    n_read = 0
+    next_sample = 0
+    while not stop.is_set() or source.ring.n_written - source._position > source.target_lag:
+        n_samples = source.read_into(out)
+        if n_samples:
+            samples = out[:n_samples]
+            assert np.array_equal(samples, samples[0] + np.arange(n_samples, dtype=np.float32))
+            assert samples[0] >= next_sample
+            next_sample = int(samples[-1]) + 1
+            n_read += n_samples
+    writer.join()
+
+    assert n_read > 0
+    assert next_sample == n_read + source.skipped
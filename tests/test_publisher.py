@@ -0,0 +1,110 @@
+"""
+Publisher with local subscribers: the ones that keep up get every block, a stalled one is skipped and then dropped,
+and publish() never waits for any of them
+"""
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from publisher import Publisher
+from publisher_client import Subscriber
+from utility import SampleBlock
+
+N_BLOCKS = 600
+BLOCK = 256
+
+
+def collect(subscriber: Subscriber, blocks: list, delay: float = 0):
+    try:
+        for block in subscriber:
+            blocks.append(block)
+            time.sleep(delay)
+    except OSError:
+        pass
+
+
+def publish_blocks(publisher: Publisher, interval: float = 0.0005, block: int = BLOCK) -> float:
+    """
+    N_BLOCKS blocks whose samples count on from block to block, returns the longest publish() call
+    """
+    longest = 0.0
+    for i in range(N_BLOCKS):
+        samples = np.arange(i * block, (i + 1) * block, dtype=np.float32)
+        tic = time.perf_counter()
+        publisher.publish(SampleBlock('uart', time.monotonic(), samples))
+        longest = max(longest, time.perf_counter() - tic)
+        time.sleep(interval)
+    return longest
+
+
+def wait_for_subscribers(publisher: Publisher, n_subscribers: int):
+    deadline = time.monotonic() + 5
+    while len(publisher.subscribers) < n_subscribers and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(publisher.subscribers) == n_subscribers
+
+
+@pytest.fixture(params=['unix', 'tcp'])
+def address(request, tmp_path):
+    if request.param == 'unix':
+        return f'unix:{tmp_path}/publisher.sock'
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return f'tcp:{probe.getsockname()[1]}'
+
+
+def test_fast_subscribers_get_everything_and_a_stalled_one_is_dropped(address):
+    publisher = Publisher(address, max_skipped=50, send_buffer=1 << 16)
+    fast = [Subscriber(address, timeout=10) for _ in range(2)]
+    stalled = Subscriber(address, timeout=10)
+    received = [[] for _ in fast]
+    threads = [threading.Thread(target=collect, args=(s, r), daemon=True) for s, r in zip(fast, received)]
+    for thread in threads:
+        thread.start()
+    wait_for_subscribers(publisher, 3)
+
+    longest = publish_blocks(publisher)
+    time.sleep(0.2)
+    assert publisher.n_dropped == 1
+    assert len(publisher.subscribers) == 2
+    publisher.close()
+    for thread in threads:
+        thread.join(5)
+
+    for subscriber, blocks in zip(fast, received):
+        assert [sequence for _, _, sequence, _ in blocks] == list(range(N_BLOCKS))
+        assert subscriber.missed == {'uart': 0}
+        assert np.array_equal(np.concatenate([samples for *_, samples in blocks]),
+                              np.arange(N_BLOCKS * BLOCK, dtype=np.float32))
+        subscriber.close()
+    stalled.close()
+    # a full socket buffer is skipped right away, publish() never waits for the stalled subscriber
+    assert longest < 0.05
+
+
+def test_slow_subscriber_gets_whole_blocks_with_gaps(address):
+    # blocks about as large as the socket buffer, so sends are often partial
+    block = 4096
+    publisher = Publisher(address, max_skipped=N_BLOCKS, send_buffer=1 << 14)
+    slow = Subscriber(address, timeout=10)
+    received = []
+    thread = threading.Thread(target=collect, args=(slow, received, 0.005), daemon=True)
+    thread.start()
+    wait_for_subscribers(publisher, 1)
+
+    publish_blocks(publisher, block=block)
+    time.sleep(0.5)
+    publisher.close()
+    thread.join(10)
+
+    # partial sends are completed before the next block, so every block read is whole and in order
+    sequences = [sequence for _, _, sequence, _ in received]
+    assert sequences == sorted(sequences)
+    assert slow.missed['uart'] > 0
+    assert len(received) + slow.missed['uart'] == sequences[-1] + 1
+    for _, _, sequence, samples in received:
+        assert np.array_equal(samples, np.arange(sequence * block, (sequence + 1) * block, dtype=np.float32))
+    slow.close()
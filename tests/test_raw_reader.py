@@ -0,0 +1,64 @@
+"""
+RawCaptureReader: the chunk index of a raw recording is built once and cached next to the file
+"""
+import os
+
+import numpy as np
+
+import recording
+from recording import INDEX_SUFFIX, RawCaptureReader
+from utility import HEADER, StreamDecoder
+
+
+def write_raw(path, n_packets: int = 2000, packet: int = 16):
+    """
+    headers, packets of float32 and a little garbage in between, like an old UART recording
+    """
+    rng = np.random.default_rng(1)
+    with open(path, 'wb') as f:
+        for k in range(n_packets):
+            f.write(HEADER + rng.standard_normal(packet).astype(np.float32).tobytes())
+            if k % 97 == 0:
+                f.write(b'\x01\x02\x03')
+    with open(path, 'rb') as f:
+        return StreamDecoder().feed(f.read())
+
+
+def test_cached_index_reads_the_same_samples(tmp_path, monkeypatch):
+    path = str(tmp_path / 'recorded_signal')
+    expected = write_raw(path)
+
+    with RawCaptureReader(path, 1000, chunk=4096) as reader:
+        assert reader.n_samples == len(expected)
+        assert np.array_equal(reader.read(), expected)
+    assert os.path.exists(path + INDEX_SUFFIX)
+
+    # a second open must not decode the whole file again
+    def no_pass(self):
+        raise AssertionError('index rebuilt')
+
+    monkeypatch.setattr(RawCaptureReader, '_build_index', no_pass)
+    with RawCaptureReader(path, 1000, chunk=4096) as reader:
+        assert reader.n_samples == len(expected)
+        assert np.array_equal(reader.read(5000, 3000, step=3), expected[5000:8000:3])
+
+
+def test_index_is_rebuilt_when_the_file_changes(tmp_path):
+    path = str(tmp_path / 'recorded_signal')
+    write_raw(path, n_packets=500)
+    RawCaptureReader(path, 1000, chunk=4096).close()
+
+    expected = write_raw(path, n_packets=800)
+    with RawCaptureReader(path, 1000, chunk=4096) as reader:
+        assert reader.n_samples == len(expected)
+    # a different chunk size needs its own index
+    with RawCaptureReader(path, 1000, chunk=1024) as reader:
+        assert np.array_equal(reader.read(), expected)
+
+
+def test_unwritable_directory_still_opens(tmp_path, monkeypatch):
+    path = str(tmp_path / 'recorded_signal')
+    expected = write_raw(path, n_packets=100)
+    monkeypatch.setattr(recording, 'INDEX_SUFFIX', '/missing/dir.npz')
+    with RawCaptureReader(path, 1000) as reader:
+        assert np.array_equal(reader.read(), expected)
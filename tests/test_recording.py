@@ -0,0 +1,59 @@
+"""
+RecordWriter against a stalled disk: the memory it holds is bounded in bytes, whatever the size of the blocks
+"""
+import threading
+
+import recording
+from recording import RecordWriter
+
+
+def stall_disk(monkeypatch):
+    """
+    the writer thread hangs in its write call until the returned event is set
+    """
+    release = threading.Event()
+    write_blocks = recording._write_blocks
+
+    def stalled(fd, blocks):
+        release.wait(5)
+        write_blocks(fd, blocks)
+
+    monkeypatch.setattr(recording, '_write_blocks', stalled)
+    return release
+
+
+def test_queued_bytes_are_bounded_with_large_blocks(tmp_path, monkeypatch):
+    release = stall_disk(monkeypatch)
+    writer = RecordWriter(str(tmp_path / 'raw'), buffer_bytes=256 * 1024)
+    block = bytes(64 * 1024)
+
+    accepted = sum(writer.write(block, timeout=0.05) for _ in range(16))
+    # the first block may already be in the (stalled) write call, everything else waits in the queue
+    assert accepted <= 5
+    assert writer.queued_bytes <= 256 * 1024
+    assert writer.dropped_blocks == 16 - accepted
+
+    release.set()
+    writer.close()
+    assert (tmp_path / 'raw').stat().st_size == accepted * len(block)
+    assert writer.queued_bytes == 0
+
+
+def test_waiting_producer_continues_when_the_disk_catches_up(tmp_path, monkeypatch):
+    release = stall_disk(monkeypatch)
+    writer = RecordWriter(str(tmp_path / 'raw'), buffer_bytes=4096)
+    assert writer.write(bytes(4096), timeout=0)
+
+    threading.Timer(0.1, release.set).start()
+    assert writer.write(bytes(4096), timeout=2)
+    writer.close()
+    assert (tmp_path / 'raw').stat().st_size == 8192
+
+
+def test_block_larger_than_the_buffer_is_written(tmp_path):
+    writer = RecordWriter(str(tmp_path / 'raw'), buffer_bytes=1024)
+    assert writer.write(bytes(10_000), timeout=1)
+    assert writer.write(bytes(10_000), timeout=1)
+    writer.close()
+    assert (tmp_path / 'raw').stat().st_size == 20_000
+    assert writer.dropped_blocks == 0
@@ -0,0 +1,37 @@
+"""
+RenderScheduler counters: rendered, skipped and dropped frames, reset with every start()
+"""
+import pytest
+from PyQt6.QtCore import QCoreApplication
+
+from render_scheduler import RenderScheduler
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QCoreApplication.instance() or QCoreApplication([])
+
+
+def test_counters_and_stats(app):
+    new_data = [True, False, True]
+    rendered = []
+    scheduler = RenderScheduler(50, lambda: rendered.append(1), lambda: new_data.pop(0))
+    scheduler.start()
+    for _ in range(3):
+        scheduler._tick()
+        # the next tick comes right on time
+        scheduler._last_tick -= 1 / scheduler.fps
+    assert (scheduler.frames_rendered, scheduler.frames_skipped, scheduler.frames_dropped) == (2, 1, 0)
+    assert len(rendered) == 2
+
+    # the GUI thread was busy for 5 frame periods, 4 ticks were lost
+    scheduler._last_tick -= 4 / scheduler.fps
+    new_data.append(True)
+    scheduler._tick()
+    assert scheduler.frames_dropped == 4
+    assert scheduler.stats() == 'frames rendered: 3, dropped: 4, skipped: 1'
+    scheduler.stop()
+
+    scheduler.start()
+    assert scheduler.stats() == 'frames rendered: 0, dropped: 0, skipped: 0'
+    scheduler.stop()
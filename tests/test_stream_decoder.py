@@ -0,0 +1,65 @@
+"""
+StreamDecoder: large reads are decoded in place after the carried bytes, with the same result as decoding the carried
+bytes and the read in one piece
+"""
+import numpy as np
+import pytest
+
+import utility
+from utility import HEADER, StreamDecoder
+
+
+def make_stream(rng, n_parts: int) -> bytes:
+    """
+    frames of any length, runs of 0xFF and garbage that breaks segments
+    """
+    parts = []
+    for _ in range(n_parts):
+        kind = rng.random()
+        if kind < 0.3:
+            parts.append(b'\xff' * int(rng.integers(1, 10)))
+        elif kind < 0.5:
+            parts.append(rng.integers(0, 256, int(rng.integers(1, 7)), dtype=np.uint8).tobytes())
+        else:
+            parts.append(HEADER + rng.standard_normal(int(rng.integers(1, 300))).astype(np.float32).tobytes())
+    return b''.join(parts)
+
+
+def decode_reads(reads, use_out: bool) -> tuple:
+    decoder = StreamDecoder()
+    decoded = []
+    for read in reads:
+        out = np.empty((len(read) + 8) // 4, dtype=np.float32) if use_out else None
+        samples = decoder.feed(read, out)
+        if use_out:
+            assert np.shares_memory(samples, out) or not len(samples)
+        decoded.append(samples.view(np.uint32).copy())
+    return decoded, decoder.synced, decoder.resync_bytes, decoder.n_samples, decoder.pending_bytes
+
+
+@pytest.mark.parametrize('use_out', [False, True])
+def test_in_place_decoding_matches_the_copy(monkeypatch, use_out):
+    rng = np.random.default_rng(2)
+    for _ in range(100):
+        stream = make_stream(rng, int(rng.integers(20, 200)))
+        cuts = np.sort(rng.integers(0, len(stream), int(rng.integers(1, 8))))
+        reads = [memoryview(stream)[a:b] for a, b in zip(np.r_[0, cuts], np.r_[cuts, len(stream)])]
+
+        with monkeypatch.context() as patch:
+            patch.setattr(utility, 'CARRY_COPY_MAX_BYTES', 0)
+            in_place = decode_reads(reads, use_out)
+        with monkeypatch.context() as patch:
+            patch.setattr(utility, 'CARRY_COPY_MAX_BYTES', len(stream))
+            copied = decode_reads(reads, use_out)
+
+        assert in_place[1:] == copied[1:]
+        for a, b in zip(in_place[0], copied[0]):
+            assert np.array_equal(a, b)
+
+
+def test_read_without_header_is_carried_over():
+    frame = HEADER + np.arange(3000, dtype=np.float32).tobytes()
+    decoder = StreamDecoder()
+    first = decoder.feed(frame[:4098])
+    second = decoder.feed(frame[4098:] + HEADER)
+    assert np.array_equal(np.concatenate([first, second]), np.arange(3000, dtype=np.float32))
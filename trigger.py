@@ -0,0 +1,175 @@
+"""
+oscilloscope style trigger for the live time plot: instead of the newest samples the plot shows a window around the
+last trigger, so periodic signals stand still and single events stay on screen
+
+every block is scanned with array operations: a comparator with hysteresis turns the samples into high / low events,
+the trigger points are where the state flips (edge) or where a pulse of the right width ends (pulse width). The window
+around a trigger is copied out of a ring buffer into a preallocated array once its post trigger samples arrived
+
+modes:
+auto: like normal, but a window of the newest samples is shown if nothing triggered for auto_timeout seconds
+normal: a new window for every trigger, the plot keeps the last one while nothing triggers
+single: stops after the first window until arm() is called
+"""
+import numpy as np
+
+from utility import RingBuffer
+
+
+TRIGGER_MODES = ('off', 'auto', 'normal', 'single')
+TRIGGER_EDGES = ('rising', 'falling')
+
+
+class TriggerEngine:
+    """
+    window: samples per trigger window, pre_trigger of them before the trigger point
+
+    edge: 'rising' or 'falling'. The hysteresis band lies on the armed side of the level: a rising edge needs the
+    signal below level - hysteresis before it crosses level, so noise around the level does not trigger again.
+    With min_width or max_width (seconds, 0 = no limit) it is a pulse width trigger instead: positive pulses for
+    'rising', negative ones for 'falling', the trigger point is the end of the pulse
+
+    a trigger is only accepted after the window of the previous one is complete
+    """
+
+    def __init__(self, window: int, sample_rate: float, pre_trigger: int | None = None, mode: str = 'auto',
+                 edge: str = 'rising', level: float = 0.0, hysteresis: float = 0.0, min_width: float = 0.0,
+                 max_width: float = 0.0, auto_timeout: float = 0.1):
+        if mode not in TRIGGER_MODES[1:]:
+            raise ValueError(f"trigger mode must be one of {TRIGGER_MODES[1:]}")
+        if edge not in TRIGGER_EDGES:
+            raise ValueError(f"trigger edge must be one of {TRIGGER_EDGES}")
+
+        self.window_size = max(int(window), 1)
+        self.sample_rate = sample_rate
+        self.pre_trigger = self.window_size // 2 if pre_trigger is None else min(max(pre_trigger, 0), self.window_size)
+        self.mode = mode
+        self.edge = edge
+        self.level = level
+        self.hysteresis = abs(hysteresis)
+        self.min_width = int(min_width * sample_rate)
+        self.max_width = int(max_width * sample_rate)
+        self.pulse = self.min_width > 0 or self.max_width > 0
+        self.auto_timeout = max(int(auto_timeout * sample_rate), 1)
+
+        self.window = np.zeros(self.window_size, dtype=np.float32)
+        self.trigger_position = None
+        self.triggered = False
+        self.n_triggers = 0
+        self.n_auto = 0
+        self.reset()
+
+    def reset(self):
+        # a window completes at most window_size samples after it started, the blocks are scanned in pieces of
+        # window_size, so twice that is always enough history
+        self.ring = RingBuffer(2 * self.window_size)
+        self.window.fill(0)
+        self.armed = True
+        # comparator state of the last sample (1 high, -1 low, 0 not known yet) and the last state change
+        self._state = 0
+        self._last_transition = -1
+        self._pending = None
+        self._rearm = 0
+        self._last_window = 0
+
+    def arm(self):
+        """
+        wait for the next trigger, needed after every window in single mode
+        """
+        self.armed = True
+        self._pending = None
+        self._rearm = self._last_window = self.ring.n_written
+
+    def stats(self) -> str:
+        return f'{self.mode} {self.edge}, triggers: {self.n_triggers}, auto: {self.n_auto}'
+
+    def _candidates(self, samples: np.ndarray, offset: int) -> np.ndarray:
+        """
+        absolute positions of the trigger points in samples, which start at sample `offset` of the stream
+        """
+        if self.edge == 'rising':
+            high, low = samples >= self.level, samples < self.level - self.hysteresis
+        else:
+            high, low = samples > self.level + self.hysteresis, samples <= self.level
+        events = high.astype(np.int8) - low
+
+        # only the samples outside the hysteresis band change the state, it flips where the event differs from the
+        # one before (the first event of all just sets it)
+        indices = np.flatnonzero(events)
+        if not len(indices):
+            return indices
+        values = events[indices]
+        previous = np.concatenate(([self._state], values[:-1]))
+        flips = (values != previous) & (previous != 0)
+        self._state = int(values[-1])
+        positions, values = indices[flips] + offset, values[flips]
+
+        # rising: low -> high, falling: high -> low
+        end_value = 1 if self.edge == 'rising' else -1
+        if not self.pulse:
+            return positions[values == end_value]
+
+        # the state alternates, so every pulse ends at a flip back and started at the flip before it
+        starts = np.concatenate(([self._last_transition], positions[:-1]))
+        if len(positions):
+            self._last_transition = int(positions[-1])
+        ends = (values == -end_value) & (starts >= 0)
+        widths = positions - starts
+        if self.min_width:
+            ends &= widths >= self.min_width
+        if self.max_width:
+            ends &= widths <= self.max_width
+        return positions[ends]
+
+    def _next_trigger(self, candidates: np.ndarray):
+        index = np.searchsorted(candidates, self._rearm)
+        return int(candidates[index]) if index < len(candidates) else None
+
+    def _copy_window(self, start: int):
+        view = self.ring.view()
+        offset = start - (self.ring.n_written - self.ring.capacity)
+        self.window[:] = view[offset:offset + self.window_size]
+        self._last_window = self.ring.n_written
+
+    def feed(self, samples: np.ndarray) -> bool:
+        """
+        scan the next samples of the stream, True if a new window is ready
+        """
+        ready = False
+        post_trigger = self.window_size - self.pre_trigger
+        for start in range(0, len(samples), self.window_size):
+            piece = samples[start:start + self.window_size]
+            offset = self.ring.n_written
+            self.ring.write(piece)
+            candidates = self._candidates(piece, offset)
+            if not self.armed:
+                continue
+
+            # one step per window, not per sample: take the first trigger after the rearm point, complete its window
+            # if the samples are there and look for the next one behind it
+            completed = None
+            if self._pending is None:
+                self._pending = self._next_trigger(candidates)
+            while self._pending is not None and self._pending + post_trigger <= self.ring.n_written:
+                completed, self._pending = self._pending, None
+                self._rearm = completed + post_trigger
+                self.n_triggers += 1
+                if self.mode == 'single':
+                    self.armed = False
+                    break
+                self._pending = self._next_trigger(candidates)
+
+            if completed is not None:
+                self._copy_window(completed - self.pre_trigger)
+                self.trigger_position = completed
+                self.triggered = ready = True
+            elif (self.mode == 'auto' and self._pending is None
+                  and self.ring.n_written - self._last_window >= self.auto_timeout):
+                # free running: the newest samples, untriggered
+                self._copy_window(self.ring.n_written - self.window_size)
+                self._rearm = self.ring.n_written
+                self.trigger_position = None
+                self.triggered = False
+                self.n_auto += 1
+                ready = True
+        return ready
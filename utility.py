@@ -1,40 +1,442 @@
+import threading
+from collections import deque
+from typing import NamedTuple
+
 import numpy as np
-from PyQt6.QtCore import pyqtSignal, QObject
 
 
-class FetcherSignals(QObject):
+class EmptyError(Exception):
+    pass
+
+
+HEADER = b'\xff\xff\xff\xff'
+HEADER_LEN = len(HEADER)
+SAMPLE_SIZE = 4  # float32
+# decode_bytes splits reads up to this size with bytes.split, larger ones only if their segments are at least
+# SPLIT_MIN_SEGMENT bytes long on average; below that the per segment list work costs more than the array path
+SPLIT_MAX_BYTES = 4096
+SPLIT_MIN_SEGMENT = 32
+# StreamDecoder.feed prepends the carried bytes to reads up to this size, larger reads are decoded in place once the
+# frame the carried bytes belong to is complete (looked for in the first CARRY_HEAD_BYTES, then 4x more each time)
+CARRY_COPY_MAX_BYTES = 4096
+CARRY_HEAD_BYTES = 256
+
+
+def find_headers(buffer: np.ndarray) -> np.ndarray:
     """
-    These signals are used with threads of this program to communicate through the lifecycle
-    contains 'result' and 'finish' signals of the DataFetcher
-    result_signal: send data to matplotlib to plot the data
-    finish_signal: pause or terminate the thread
+    start indices of the 4 x 0xFF headers inside a contiguous uint8 buffer
+
+    headers are matched the same way bytes.split() does it: greedy and non-overlapping from the left, so a run of
+    k >= 4 0xFF bytes holds k // 4 headers and the remaining k % 4 bytes belong to the next segment.
     """
-    result_signal = pyqtSignal(object)
-    finish_signal = pyqtSignal()
+    if len(buffer) < HEADER_LEN:
+        return np.empty(0, dtype=np.intp)
 
-    def __init__(self):
-        super().__init__()
+    # every byte offset read as a 32-bit word (unaligned strided view, no copy)
+    words = np.ndarray((len(buffer) - HEADER_LEN + 1,), dtype=np.uint32, buffer=buffer, strides=(1,))
+    positions, = (words == 0xFFFFFFFF).nonzero()
+    if len(positions) < 2:
+        return positions
 
+    gaps = positions[1:] - positions[:-1]
+    if gaps.min() >= HEADER_LEN:
+        return positions
+
+    # overlapping matches only come from long 0xFF runs, keep every 4th match counted from the start of its run
+    run_start = np.empty(len(positions), dtype=bool)
+    run_start[0] = True
+    np.not_equal(gaps, 1, out=run_start[1:])
+    run_offsets = positions - positions[run_start][run_start.cumsum() - 1]
+    return positions[run_offsets % HEADER_LEN == 0]
 
-class EmptyError(Exception):
-    pass
 
+def gather_segments(buffer: np.ndarray, starts: np.ndarray, lengths: np.ndarray,
+                    out: np.ndarray | None = None) -> np.ndarray:
+    """
+    concatenate buffer[start:start + length] of every segment into one float32 array in a single copy,
+    lengths must be multiples of 4
+    """
+    n_bytes = int(lengths.sum())
+    n_samples = n_bytes // SAMPLE_SIZE
+    if out is not None and len(out) < n_samples:
+        raise ValueError(f"output buffer holds {len(out)} samples but {n_samples} were decoded")
+
+    if len(starts) == 1:
+        source = buffer[starts[0]:starts[0] + n_bytes]
+    else:
+        # index of every kept byte: segment start + position inside the segment
+        indices = (starts - (lengths.cumsum() - lengths)).repeat(lengths)
+        indices += np.arange(n_bytes)
+        if out is None:
+            return buffer.take(indices).view(np.float32)
+        result = out[:n_samples]
+        buffer.take(indices, out=result.view(np.uint8))
+        return result
 
-def decode_bytes(byte_packet):
+    if out is None:
+        return source.view(np.float32).copy()
+    result = out[:n_samples]
+    result.view(np.uint8)[:] = source
+    return result
+
+
+def decode_bytes(byte_packet, out: np.ndarray | None = None) -> np.ndarray:
     """
     UART byte decoder for 32-bit float values
 
-    these monstrously written lines finds headers we defined as 4 0xFF and converts to float.
-    Packages contains 4 bytes = 32 bits.
-    """
-    # extract float's by looking for headers and then flatten
-    packets = byte_packet.split(b'\xff\xff\xff\xff')
-    # trim the first and the last packages
-    packets[0] = packets[0][len(packets[0]) % 4:]
-    packets[-1] = packets[-1][:-len(packets[-1]) % 4] if len(packets[-1]) % 4 else packets[-1]
-    packets = [packet[:-len(packet) % 4] if (len(packet) % 4) else packet for packet in packets]
-    packets = [packet for packet in packets if len(packet) > 3]
-    print([len(packet) for packet in packets])
-    float_packets = [np.frombuffer(packet, dtype=np.float32) for packet in packets]
-    float_packet = [item for sublist in float_packets for item in sublist]
-    return float_packet
+    finds the headers we defined as 4 0xFF and converts everything in between to float32. Packages contain 4 bytes = 32
+    bits. The segment before the first header is cut to its last whole floats, any later segment whose length is not a
+    multiple of 4 lost bytes on the way and is dropped as a whole.
+
+    byte_packet: bytes-like object read from the port
+    out: optional preallocated float32 buffer, the decoded samples are written to its beginning
+    returns a float32 ndarray (a view into out if it was given)
+
+    reads with few headers go through bytes.split and one join, which match headers the same way and do all the work
+    in C; the array temporaries below only pay off for large reads full of short segments
+    """
+    data = byte_packet if isinstance(byte_packet, (bytes, bytearray)) else bytes(byte_packet)
+    if len(data) <= SPLIT_MAX_BYTES or data.count(HEADER) * SPLIT_MIN_SEGMENT < len(data):
+        return _decode_split(data, out)
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    headers = find_headers(buffer)
+
+    # segment i runs from the end of header i-1 to the start of header i
+    starts = np.empty(len(headers) + 1, dtype=np.intp)
+    starts[0] = 0
+    starts[1:] = headers + HEADER_LEN
+    ends = np.empty_like(starts)
+    ends[:-1] = headers
+    ends[-1] = len(buffer)
+
+    lengths = ends - starts
+    starts[0] = lengths[0] % SAMPLE_SIZE
+    lengths[0] -= starts[0]
+
+    keep = (lengths % SAMPLE_SIZE == 0) & (lengths > 0)
+    return gather_segments(buffer, starts[keep], lengths[keep], out)
+
+
+def _decode_split(data: bytes, out: np.ndarray | None = None) -> np.ndarray:
+    """
+    decode_bytes with bytes.split: the same segments, kept and dropped by the same rules
+    """
+    segments = data.split(HEADER)
+    first = segments[0]
+    segments[0] = first[len(first) % SAMPLE_SIZE:]
+    payload = b''.join([segment for segment in segments if not len(segment) % SAMPLE_SIZE])
+    n_samples = len(payload) // SAMPLE_SIZE
+    if out is None:
+        return np.frombuffer(payload, dtype=np.float32).copy()
+    if len(out) < n_samples:
+        raise ValueError(f"output buffer holds {len(out)} samples but {n_samples} were decoded")
+    result = out[:n_samples]
+    result[:] = np.frombuffer(payload, dtype=np.float32)
+    return result
+
+
+class StreamDecoder:
+    """
+    incremental version of decode_bytes for a continuous UART stream
+
+    bytes that can not be decoded yet (a float or a header cut by the end of a read) are carried to the next feed()
+    instead of being thrown away. The decoder is out of sync until it sees the first header, everything before it is
+    counted in resync_bytes together with the bytes of broken segments (length not a multiple of 4). Whole floats of a
+    segment are emitted as soon as they arrive, so when a segment turns out to be broken only its remaining part is
+    dropped.
+    """
+
+    def __init__(self):
+        self.synced = False
+        self.resync_bytes = 0
+        self.n_bytes = 0
+        self.n_samples = 0
+        self._pending = b''
+
+    def reset(self):
+        self.synced = False
+        self._pending = b''
+
+    @property
+    def pending_bytes(self) -> int:
+        """
+        bytes carried over to the next feed(), they are the last pending_bytes of everything fed so far
+        """
+        return len(self._pending)
+
+    @property
+    def payload_bytes(self) -> int:
+        return self.n_samples * SAMPLE_SIZE
+
+    def stats(self) -> str:
+        return f'{self.n_samples} samples, resync bytes: {self.resync_bytes}'
+
+    def feed(self, byte_packet, out: np.ndarray | None = None) -> np.ndarray:
+        """
+        decode the next block of the stream, returns only complete samples (float32 ndarray, a view into out if given)
+        """
+        self.n_bytes += len(byte_packet)
+        if not self._pending:
+            return self._decode(byte_packet, out)
+        if len(byte_packet) <= CARRY_COPY_MAX_BYTES:
+            return self._decode(self._pending + bytes(byte_packet), out)
+
+        # a large read is not copied behind the carried bytes: only the frame they belong to is, up to and including
+        # the next header. The rest of the read starts a new segment and is decoded in place, with the same result
+        data = memoryview(byte_packet).cast('B')
+        pending = self._pending
+        head_length = CARRY_HEAD_BYTES
+        while head_length < len(data):
+            head = pending + bytes(data[:head_length])
+            # the leftmost match is also the first header of the greedy matching
+            cut = head.find(HEADER) + HEADER_LEN
+            if cut >= HEADER_LEN:
+                if out is None:
+                    out = np.empty((len(pending) + len(data)) // SAMPLE_SIZE, dtype=np.float32)
+                head_samples = self._decode(head[:cut], out)
+                tail_samples = self._decode(data[cut - len(pending):], out[len(head_samples):])
+                return out[:len(head_samples) + len(tail_samples)]
+            head_length *= 4
+        return self._decode(pending + bytes(data), out)
+
+    def _decode(self, data, out: np.ndarray | None) -> np.ndarray:
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        headers = find_headers(buffer)
+
+        if not self.synced:
+            if not len(headers):
+                # nothing to align to, only keep what could be the beginning of a header
+                n_keep = _count_trailing_ff(buffer)
+                self.resync_bytes += len(buffer) - n_keep
+                self._pending = bytes(data[len(buffer) - n_keep:])
+                return np.empty(0, dtype=np.float32) if out is None else out[:0]
+
+            self.resync_bytes += int(headers[0])
+            self.synced = True
+            starts = headers + HEADER_LEN
+            ends = np.append(headers[1:], len(buffer))
+        else:
+            # the pending bytes always start on a float boundary
+            starts = np.append(0, headers + HEADER_LEN)
+            ends = np.append(headers, len(buffer))
+
+        # the last segment is still open: emit its whole floats, carry the rest
+        open_start = starts[-1]
+        open_length = (len(buffer) - open_start) // SAMPLE_SIZE * SAMPLE_SIZE
+        if _count_trailing_ff(buffer[open_start:]) > len(buffer) - open_start - open_length:
+            # the last float ends in 0xFF bytes that may be the first part of the next header
+            open_length = max(open_length - SAMPLE_SIZE, 0)
+        ends[-1] = open_start + open_length
+        self._pending = bytes(data[ends[-1]:])
+
+        lengths = ends - starts
+        broken = lengths % SAMPLE_SIZE != 0
+        self.resync_bytes += int(lengths[broken].sum())
+
+        keep = ~broken & (lengths > 0)
+        samples = gather_segments(buffer, starts[keep], lengths[keep], out)
+        self.n_samples += len(samples)
+        return samples
+
+
+def _count_trailing_ff(buffer: np.ndarray) -> int:
+    """
+    number of 0xFF bytes (at most 3) at the end of the buffer, a header may continue in the next read
+    """
+    tail = buffer[len(buffer) - min(len(buffer), HEADER_LEN - 1):]
+    not_ff, = (tail != 0xFF).nonzero()
+    return len(tail) - int(not_ff[-1]) - 1 if len(not_ff) else len(tail)
+
+
+class RingBuffer:
+    """
+    fixed size sample buffer that always holds the newest `capacity` samples
+
+    every sample is stored twice, at i and i + capacity, so the window from the oldest to the newest sample is always
+    one contiguous slice of the preallocated array: write() copies O(chunk) samples and view() never copies or
+    reallocates.
+
+    a sample may be an array of item_shape, e.g. one spectrum per row, everything then works along the first axis
+    """
+
+    def __init__(self, capacity: int, dtype=np.float32, item_shape: tuple = (), fill_value=0):
+        if capacity <= 0:
+            raise ValueError(f"ring buffer capacity must be positive, got {capacity}")
+        self.capacity = capacity
+        self.n_written = 0  # samples written since creation, also used by readers to see if anything changed
+        self._buffer = np.full((2 * capacity, *item_shape), fill_value, dtype=dtype)
+
+    def write(self, samples: np.ndarray):
+        n_samples = len(samples)
+        if n_samples > self.capacity:
+            # only the newest samples survive anyway
+            self.n_written += n_samples - self.capacity
+            samples = samples[-self.capacity:]
+            n_samples = self.capacity
+
+        start = self.n_written % self.capacity
+        first = min(n_samples, self.capacity - start)
+        rest = n_samples - first
+        self._buffer[start:start + first] = samples[:first]
+        self._buffer[start + self.capacity:start + self.capacity + first] = samples[:first]
+        self._buffer[:rest] = samples[first:]
+        self._buffer[self.capacity:self.capacity + rest] = samples[first:]
+        self.n_written += n_samples
+
+    def view(self) -> np.ndarray:
+        """
+        the whole window from the oldest to the newest sample, a view that is overwritten by later writes
+        """
+        start = self.n_written % self.capacity
+        return self._buffer[start:start + self.capacity]
+
+    def latest(self, n_samples: int) -> np.ndarray:
+        return self.view()[self.capacity - min(n_samples, self.capacity):]
+
+    def read_since(self, position: int, max_samples: int | None = None) -> tuple[np.ndarray, int]:
+        """
+        copy of the samples written after `position` (an earlier n_written) and the new position, for a reader in
+        another thread. A reader that fell more than capacity behind only gets the newest capacity samples.
+        With max_samples only the oldest max_samples of them are returned, the rest is left for the next call
+        """
+        n_written = self.n_written
+        n_new = min(n_written - position, self.capacity)
+        if max_samples is not None and n_new > max_samples:
+            n_written -= n_new - max_samples
+            n_new = max_samples
+        start = n_written % self.capacity
+        return self._buffer[start + self.capacity - n_new:start + self.capacity].copy(), n_written
+
+    def read_into(self, position: int, out: np.ndarray) -> tuple[int, int]:
+        """
+        read_since(position, len(out)) copied into out instead of a new array, e.g. from an audio callback. Returns the
+        number of samples copied and the new position
+        """
+        n_written = self.n_written
+        n_new = min(n_written - position, self.capacity)
+        if n_new > len(out):
+            n_written -= n_new - len(out)
+            n_new = len(out)
+        start = n_written % self.capacity
+        out[:n_new] = self._buffer[start + self.capacity - n_new:start + self.capacity]
+        return n_new, n_written
+
+
+class SampleBlock(NamedTuple):
+    """
+    decoded samples of one read as they travel through the capture queues
+
+    stream: port or device name the samples came from
+    timestamp: time.monotonic() of the first sample, estimated from the end of the read and the sample rate, so
+    blocks of different streams can be put on one timeline
+    """
+    stream: str
+    timestamp: float
+    samples: np.ndarray
+
+
+def channel_blocks(stream: str, timestamp: float, samples: np.ndarray, channels) -> list:
+    """
+    SampleBlocks of decoded samples: (n,) samples keep the stream name, every column of (n, channels) samples becomes
+    its own stream 'name/channel'
+    """
+    if samples.ndim == 1:
+        return [SampleBlock(stream, timestamp, samples)]
+    return [SampleBlock(f'{stream}/{channel}', timestamp, samples[:, i]) for i, channel in enumerate(channels)]
+
+
+class StreamBuffer:
+    """
+    live window of one stream: the newest samples, the host time right after the newest one and a sample counter
+    for the throughput display
+    """
+
+    def __init__(self, name: str, capacity: int, sample_rate: float):
+        self.name = name
+        self.sample_rate = sample_rate
+        self.ring = RingBuffer(capacity)
+        self.end_time = None
+        self.n_samples = 0
+
+    def write(self, block: SampleBlock):
+        self.ring.write(block.samples)
+        self.n_samples += len(block.samples)
+        self.end_time = block.timestamp + len(block.samples) / self.sample_rate
+
+
+QUEUE_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+
+class BlockQueue:
+    """
+    bounded single producer / single consumer queue of sample blocks between a capture thread and its consumer
+
+    deque append/popleft are atomic, so the producer and the consumer never take a lock unless the 'block' policy has
+    to wait for space. What happens when the queue is full:
+    drop_oldest: the oldest block is thrown away, the consumer always sees the newest data
+    drop_newest: the new block is thrown away
+    block: the producer waits (up to timeout) for the consumer to make room
+
+    enqueued, dropped and high_water_mark count the lifetime of the queue
+    """
+
+    def __init__(self, maxsize: int = 64, policy: str = 'drop_oldest'):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"unknown queue policy '{policy}', use one of {QUEUE_POLICIES}")
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.enqueued = 0
+        self.dropped = 0
+        self.high_water_mark = 0
+        self._blocks = deque()
+        self._space = threading.Condition()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def put(self, block, timeout: float | None = None) -> bool:
+        """
+        returns False if the block was dropped
+        """
+        if len(self._blocks) >= self.maxsize:
+            if self.policy == 'drop_newest':
+                self.dropped += 1
+                return False
+
+            if self.policy == 'drop_oldest':
+                try:
+                    self._blocks.popleft()
+                    self.dropped += 1
+                except IndexError:  # the consumer emptied it in the meantime
+                    pass
+            else:
+                with self._space:
+                    if not self._space.wait_for(lambda: len(self._blocks) < self.maxsize, timeout):
+                        self.dropped += 1
+                        return False
+
+        self._blocks.append(block)
+        self.enqueued += 1
+        self.high_water_mark = max(self.high_water_mark, len(self._blocks))
+        return True
+
+    def get_all(self) -> list:
+        """
+        everything queued so far, oldest first
+        """
+        blocks = []
+        while True:
+            try:
+                blocks.append(self._blocks.popleft())
+            except IndexError:
+                break
+
+        if blocks and self.policy == 'block':
+            with self._space:
+                self._space.notify()
+        return blocks
+
+    def stats(self) -> str:
+        return f'enqueued: {self.enqueued}, dropped: {self.dropped}, high_water_mark: {self.high_water_mark}'